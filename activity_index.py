@@ -0,0 +1,250 @@
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from activity_log import LOG_DIR, CATEGORIES
+
+INDEX_PATH = os.path.join(LOG_DIR, "activity_index.db")
+# Current files plus their rotated backups, and the legacy files in the working directory
+SOURCE_PATTERNS = (os.path.join(LOG_DIR, "*_activity.log*"), "*_activity.log*")
+# Bytes compared to tell a reused inode from the file that was indexed before
+HEAD_BYTES = 256
+
+_LEGACY_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[,.]\d+)?) \| ")
+_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+_ACTOR = re.compile(r"\b(?:USER_UUID|USER_ID|user_id|uuid)\s*:\s*([^\s|]+)")
+_ACTION = re.compile(r"\bACTION:\s*([A-Za-z_]+)")
+_ACTION_FIELD = re.compile(r"^[A-Z][A-Z_ ]*$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activity (
+    id INTEGER PRIMARY KEY,
+    ts TEXT NOT NULL,
+    category TEXT,
+    level TEXT,
+    actor TEXT,
+    action TEXT,
+    message TEXT NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_activity_ts ON activity (ts, id);
+CREATE INDEX IF NOT EXISTS ix_activity_actor ON activity (actor, ts);
+CREATE INDEX IF NOT EXISTS ix_activity_action ON activity (action, ts);
+CREATE INDEX IF NOT EXISTS ix_activity_level ON activity (level, ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS activity_fts USING fts5(text, content='');
+CREATE TABLE IF NOT EXISTS ingest_state (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    head BLOB,
+    offset INTEGER NOT NULL,
+    path TEXT,
+    PRIMARY KEY (device, inode)
+);
+"""
+
+
+def _category(path):
+    name = os.path.basename(path).split("_activity.log")[0]
+    return name if name in CATEGORIES else None
+
+
+def _normalize_ts(value):
+    return datetime.fromisoformat(value.replace(",", ".")).isoformat(sep="T", timespec="microseconds")
+
+
+def parse_line(line):
+    """Parse one log line into a record dict, or None for a continuation line.
+
+    Handles the JSON lines written by activity_log, the legacy
+    "ts | uuid | action | details" lines and the "ts | LEVEL | ..." lines of
+    the old logging setup.
+    """
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if isinstance(record, dict) and "timestamp" in record:
+            return {
+                "ts": _normalize_ts(record["timestamp"]),
+                "level": record.get("level", "INFO"),
+                "actor": record.get("user"),
+                "action": record.get("action"),
+                "message": line,
+                # Index the values only, not the JSON keys every record shares
+                "text": " ".join(str(record.get(k) or "") for k in ("user", "action", "details"))
+            }
+    match = _LEGACY_LINE.match(line)
+    if not match:
+        return None
+    fields = line[match.end():].split(" | ")
+    record = {"ts": _normalize_ts(match.group(1)), "level": "INFO",
+              "actor": None, "action": None, "message": line}
+    if fields[0] in _LEVELS:
+        record["level"] = fields[0]
+        actor = _ACTOR.search(line)
+        action = _ACTION.search(line)
+        record["actor"] = actor.group(1) if actor else None
+        if action:
+            record["action"] = action.group(1)
+        elif len(fields) > 1 and _ACTION_FIELD.match(fields[1]):
+            record["action"] = fields[1].replace(" ", "_")
+    elif len(fields) >= 2:
+        record["actor"], record["action"] = fields[0] or None, fields[1]
+    return record
+
+
+def _fts_query(text):
+    # Quote every term so user input is never parsed as FTS5 syntax; terms are ANDed
+    return " ".join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+class ActivityIndex:
+    """SQLite/FTS5 index over the activity log files, ingested incrementally.
+
+    Each source file is tracked by (device, inode) and byte offset, so rotation
+    (a rename) keeps its position and only new complete lines are read.
+    """
+
+    def __init__(self, path=INDEX_PATH, patterns=SOURCE_PATTERNS):
+        self.path = path
+        self.patterns = patterns
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _sources(self):
+        paths = set()
+        for pattern in self.patterns:
+            paths.update(p for p in glob.glob(pattern) if _category(p) and not p.endswith(".db"))
+        return sorted(paths)
+
+    def _ingest_file(self, conn, path):
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                head = f.read(HEAD_BYTES)
+                state = conn.execute(
+                    "SELECT head, offset FROM ingest_state WHERE device = ? AND inode = ?",
+                    (stat.st_dev, stat.st_ino)).fetchone()
+                offset = 0
+                if state and head[:len(state["head"])] == state["head"] and state["offset"] <= stat.st_size:
+                    offset = state["offset"]
+                if offset >= stat.st_size:
+                    return 0
+                f.seek(offset)
+                data = f.read(stat.st_size - offset)
+        except FileNotFoundError:
+            # Rotated away between glob and open; picked up under its new name next time
+            return 0
+        # Only complete lines; a partial last line is read again next time
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return 0
+        category = _category(path)
+        rows = []
+        for raw in data[:end].decode("utf-8", errors="replace").splitlines():
+            if not raw.strip():
+                continue
+            record = parse_line(raw)
+            if record is None:
+                if rows:
+                    rows[-1]["message"] += "\n" + raw
+                    continue
+                record = {"ts": None, "level": None, "actor": None, "action": None, "message": raw}
+            record["category"] = category
+            record["source"] = os.path.basename(path)
+            rows.append(record)
+        for row in rows:
+            if row["ts"] is None:
+                # Continuation of a record indexed in an earlier pass; keep it findable
+                previous = conn.execute("SELECT MAX(ts) FROM activity WHERE source = ?", (row["source"],)).fetchone()[0]
+                row["ts"] = previous or datetime.utcfromtimestamp(stat.st_mtime).isoformat(timespec="microseconds")
+        for row in rows:
+            cursor = conn.execute(
+                "INSERT INTO activity (ts, category, level, actor, action, message, source) "
+                "VALUES (:ts, :category, :level, :actor, :action, :message, :source)", row)
+            conn.execute("INSERT INTO activity_fts (rowid, text) VALUES (?, ?)",
+                         (cursor.lastrowid, row.get("text") or row["message"]))
+        conn.execute(
+            "INSERT INTO ingest_state (device, inode, head, offset, path) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (device, inode) DO UPDATE SET head = excluded.head, "
+            "offset = excluded.offset, path = excluded.path",
+            (stat.st_dev, stat.st_ino, head, offset + end, path))
+        return len(rows)
+
+    def ingest(self):
+        """Index new lines from every source file; returns the number of records added."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                added = 0
+                for path in self._sources():
+                    # One transaction per file so concurrent workers never double-ingest
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        added += self._ingest_file(conn, path)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                return added
+            finally:
+                conn.close()
+
+    def search(self, start=None, end=None, actor=None, action=None, category=None,
+               level=None, text=None, limit=100, cursor=None):
+        """Newest-first records matching the filters; cursor is the last page's next_cursor."""
+        self.ingest()
+        clauses, params = [], []
+        for column, value in (("actor", actor), ("action", action),
+                              ("category", category), ("level", level)):
+            if value:
+                clauses.append(f"a.{column} = ?")
+                params.append(value.upper() if column == "level" else value)
+        if start:
+            clauses.append("a.ts >= ?")
+            params.append(start.isoformat(timespec="microseconds"))
+        if end:
+            clauses.append("a.ts < ?")
+            params.append(end.isoformat(timespec="microseconds"))
+        if cursor:
+            cursor_ts, _, cursor_id = cursor.rpartition("|")
+            if not cursor_ts or not cursor_id.isdigit():
+                raise ValueError("Invalid cursor")
+            clauses.append("(a.ts < ? OR (a.ts = ? AND a.id < ?))")
+            params.extend([cursor_ts, cursor_ts, int(cursor_id)])
+        if text and text.split():
+            clauses.append("a.id IN (SELECT rowid FROM activity_fts WHERE activity_fts MATCH ?)")
+            params.append(_fts_query(text))
+        query = "SELECT a.id, a.ts, a.category, a.level, a.actor, a.action, a.message, a.source FROM activity a"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY a.ts DESC, a.id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = [dict(row) for row in conn.execute(query, params)]
+            finally:
+                conn.close()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['ts']}|{rows[-1]['id']}"
+        return {"records": rows, "next_cursor": next_cursor}
+
+
+activity_index = ActivityIndex()
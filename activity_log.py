@@ -0,0 +1,177 @@
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = os.getenv("ACTIVITY_LOG_DIR", "logs")
+CATEGORIES = ("admin", "superadmin", "user", "system")
+# Records waiting for the writer; beyond this new records are dropped, never awaited
+QUEUE_MAX_RECORDS = 10000
+FLUSH_BATCH_SIZE = 500
+FLUSH_INTERVAL_SECONDS = 1.0
+# A category file is rotated when it would grow past this size or the day changes
+MAX_FILE_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 7
+
+
+class _RotatingFile:
+    """Append-only log file rotated by size and by UTC day."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._size = 0
+        self._day = None
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        mtime = os.path.getmtime(self.path)
+        self._day = datetime.utcfromtimestamp(mtime).date() if self._size else datetime.utcnow().date()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        os.replace(self.path, f"{self.path}.{datetime.utcnow():%Y%m%d-%H%M%S-%f}")
+        backups = sorted(glob.glob(glob.escape(self.path) + ".*"))
+        for old in backups[:-BACKUP_COUNT]:
+            os.remove(old)
+
+    def write(self, data):
+        if self._file is None:
+            self._open()
+        if self._size and (self._size + len(data) > MAX_FILE_BYTES or self._day != datetime.utcnow().date()):
+            self._rotate()
+            self._open()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ActivityLog:
+    """Bounded queue of activity records flushed in batches by a writer thread.
+
+    Request handlers only enqueue; all file I/O happens on the writer thread.
+    When the queue is full the record is dropped and counted, and the count is
+    written as a system record once the writer catches up.
+    """
+
+    def __init__(self, log_dir=LOG_DIR):
+        self.log_dir = log_dir
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=QUEUE_MAX_RECORDS)
+        self._files = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def log(self, category, action, user=None, details=""):
+        if category not in CATEGORIES:
+            raise ValueError(f"Unknown activity log category: {category}")
+        record = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "category": category,
+            "user": user,
+            "action": action,
+            "details": details
+        }
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                os.makedirs(self.log_dir, exist_ok=True)
+                self._thread = threading.Thread(
+                    target=self._run, name="activity-log-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Flush queued records and stop the writer thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        # The sentinel must get in even when the queue is full
+        self._queue.put(None)
+        thread.join(timeout)
+        self._thread = None
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < FLUSH_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        running = True
+        while running:
+            try:
+                batch = self._drain(self._queue.get(timeout=FLUSH_INTERVAL_SECONDS))
+            except queue.Empty:
+                batch = []
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                batch.append({
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "category": "system",
+                    "user": None,
+                    "action": "ACTIVITY_LOG_RECORDS_DROPPED",
+                    "details": f"dropped: {dropped}"
+                })
+            if batch:
+                self._write(batch)
+        # Records enqueued after the stop sentinel
+        leftovers = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                leftovers.append(record)
+        if leftovers:
+            self._write(leftovers)
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def _write(self, batch):
+        lines = {}
+        for record in batch:
+            lines.setdefault(record["category"], []).append(
+                json.dumps(record, default=str) + "\n")
+        for category, entries in lines.items():
+            log_file = self._files.get(category)
+            if log_file is None:
+                log_file = self._files[category] = _RotatingFile(
+                    os.path.join(self.log_dir, f"{category}_activity.log"))
+            try:
+                log_file.write("".join(entries))
+            except OSError:
+                logger.exception("Failed to write %d %s activity records", len(entries), category)
+                log_file.close()
+
+
+activity_log = ActivityLog()
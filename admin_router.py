@@ -1,12 +1,19 @@
 # Role-based CRUD permission check dependency
-from controller import get_current_user, log_user_activity
+from controller import get_current_user, log_user_activity, activity_category
+from sla_scheduler import sla_scheduler
+from audit_trail import audit_trail
+from activity_index import activity_index
+from duplicate_detector import duplicate_detector
+from assignment_engine import assignment_engine
+from dbactions import get_duplicate_cluster, get_work_queue, claim_next_ticket, claim_ticket
 from datetime import datetime, timedelta
 from typing import List, Optional
-from models import Ticket, TicketMessage, Category, User, Permission, AuditLog
+from models import Ticket, TicketMessage, Category, User, Permission
 from db import get_db
 from sqlalchemy import select, func, desc
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+import asyncio
 from models import RolePermission
 from router import require_role_permission
 
@@ -24,9 +31,8 @@ async def admin_required(current_user: User = Depends(get_current_user)):
 
 
 def log_audit(db: AsyncSession, user_id: int, action: str, status: str, details: str = ""):
-    log = AuditLog(user_id=user_id, action=action,
-                   status=status, details=details)
-    db.add(log)
+    # Persisted by the audit write-behind, outside the request's transaction
+    audit_trail.audit(user_id, action, status, details)
 
 
 # --- Admin Dashboard ---
@@ -50,7 +56,8 @@ async def get_dashboard_stats(db: AsyncSession = Depends(get_db), current_user:
     log_user_activity(
         current_user.uuid,
         "DASHBOARD_STATS_ACCESSED",
-        f"total: {stats['totalTickets']} | pending: {stats['pendingTickets']} | resolved: {stats['resolvedTickets']}"
+        f"total: {stats['totalTickets']} | pending: {stats['pendingTickets']} | resolved: {stats['resolvedTickets']}",
+        category=activity_category(current_user)
     )
 
     return stats
@@ -183,23 +190,185 @@ async def update_ticket_status(ticket_id: int, status: str, db: AsyncSession = D
         log_user_activity(
             current_user.uuid,
             "TICKET_STATUS_UPDATE_FAILED",
-            f"ticket_id: {ticket_id} | reason: ticket_not_found"
+            f"ticket_id: {ticket_id} | reason: ticket_not_found",
+            category=activity_category(current_user)
         )
+        log_audit(db, current_user.userid, "TICKET_STATUS_UPDATE", "failed",
+                  f"ticket_id: {ticket_id} | reason: ticket_not_found")
         raise HTTPException(status_code=404, detail="Ticket not found")
 
     old_status = ticket.status
     ticket.status = status
     ticket.updatedat = datetime.utcnow()
     await db.commit()
+    sla_scheduler.track(ticket)
+    duplicate_detector.track(ticket)
+    await assignment_engine.status_changed(db, ticket, old_status)
+    audit_trail.status_change(ticket_id, old_status, status, changed_by_id=current_user.userid,
+                              changed_by_type="admin", escalation_level=ticket.escalation_level)
+    log_audit(db, current_user.userid, "TICKET_STATUS_UPDATE", "success",
+              f"ticket_id: {ticket_id} | old_status: {old_status} | new_status: {status}")
 
     log_user_activity(
         current_user.uuid,
         "TICKET_STATUS_UPDATED",
-        f"ticket_id: {ticket_id} | old_status: {old_status} | new_status: {status}"
+        f"ticket_id: {ticket_id} | old_status: {old_status} | new_status: {status}",
+        category=activity_category(current_user)
     )
 
     return {"status": "success", "ticket_id": ticket_id, "new_status": status}
 
+
+@admin_router.get("/tickets/{ticket_id}/cluster", summary="Get near-duplicate ticket cluster", tags=["Admin Ticket"], operation_id="get_duplicate_cluster")
+async def get_ticket_cluster(ticket_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(admin_required)):
+    members, pairs = await get_duplicate_cluster(db, ticket_id)
+    tickets = (await db.execute(
+        select(Ticket).where(Ticket.ticketid.in_(members)).order_by(Ticket.createdat))).scalars().all()
+    if not any(t.ticketid == ticket_id for t in tickets):
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return {
+        "ticket_id": ticket_id,
+        "tickets": [
+            {
+                "ticket_id": t.ticketid,
+                "subject": t.subject,
+                "status": t.status,
+                "priority": t.priority,
+                "created_at": t.createdat.isoformat() if t.createdat else None
+            }
+            for t in tickets
+        ],
+        "duplicates": [
+            {"ticket_id": p.ticketid, "duplicate_of": p.duplicate_of, "similarity": p.similarity}
+            for p in pairs
+        ]
+    }
+
+
+@admin_router.put("/tickets/{ticket_id}/cluster/status", summary="Update status of a near-duplicate cluster", tags=["Admin Ticket"], operation_id="update_cluster_status")
+async def update_cluster_status(ticket_id: int, status: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(admin_required)):
+    members, _ = await get_duplicate_cluster(db, ticket_id)
+    tickets = (await db.execute(select(Ticket).where(Ticket.ticketid.in_(members)))).scalars().all()
+    if not any(t.ticketid == ticket_id for t in tickets):
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    now = datetime.utcnow()
+    old_statuses = {}
+    for ticket in tickets:
+        old_statuses[ticket.ticketid] = ticket.status
+        ticket.status = status
+        ticket.updatedat = now
+    await db.commit()
+    for ticket in tickets:
+        sla_scheduler.track(ticket)
+        duplicate_detector.track(ticket)
+        await assignment_engine.status_changed(db, ticket, old_statuses[ticket.ticketid])
+        audit_trail.status_change(ticket.ticketid, old_statuses[ticket.ticketid], status,
+                                  changed_by_id=current_user.userid, changed_by_type="admin",
+                                  escalation_level=ticket.escalation_level,
+                                  comment=f"cluster of ticket {ticket_id}")
+    ticket_ids = sorted(old_statuses)
+    log_audit(db, current_user.userid, "TICKET_CLUSTER_STATUS_UPDATE", "success",
+              f"ticket_id: {ticket_id} | tickets: {ticket_ids} | new_status: {status}")
+    log_user_activity(
+        current_user.uuid,
+        "TICKET_CLUSTER_STATUS_UPDATED",
+        f"ticket_id: {ticket_id} | tickets: {ticket_ids} | new_status: {status}",
+        category=activity_category(current_user)
+    )
+    return {"status": "success", "ticket_id": ticket_id, "ticket_ids": ticket_ids, "new_status": status}
+
+
+@admin_router.post("/routing/rebalance", summary="Rebalance ticket assignments for a team", tags=["Admin Ticket"], operation_id="rebalance_team")
+async def rebalance_team(team: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(admin_required)):
+    moves = await assignment_engine.rebalance(db, team)
+    log_audit(db, current_user.userid, "TICKET_ROUTING_REBALANCE", "success",
+              f"team: {team} | moved: {len(moves)}")
+    log_user_activity(current_user.uuid, "TICKET_ROUTING_REBALANCED", f"team: {team} | moved: {len(moves)}",
+                      category=activity_category(current_user))
+    return {"status": "success", "team": team, "moves": moves}
+
+# --- Work Queue ---
+
+
+def _work_item(ticket, now):
+    return {
+        "ticket_id": ticket.ticketid,
+        "subject": ticket.subject,
+        "status": ticket.status,
+        "priority": ticket.priority,
+        "category_id": ticket.categoryid,
+        "assigned_to": ticket.assignedto,
+        "escalation_level": ticket.escalation_level,
+        "sla_target": ticket.current_sla_target.isoformat() if ticket.current_sla_target else None,
+        "due_in_seconds": int((ticket.current_sla_target - now).total_seconds()) if ticket.current_sla_target else None
+    }
+
+
+async def _claimed(db, current_user, claim):
+    ticket, old_status, old_assignee = claim
+    await assignment_engine.reassigned(db, ticket, old_assignee)
+    if old_status != ticket.status:
+        audit_trail.status_change(ticket.ticketid, old_status, ticket.status, changed_by_id=current_user.userid,
+                                  changed_by_type="admin", escalation_level=ticket.escalation_level,
+                                  comment="claimed")
+    log_user_activity(current_user.uuid, "TICKET_CLAIMED",
+                      f"ticket_id: {ticket.ticketid} | previous_assignee: {old_assignee}",
+                      category=activity_category(current_user))
+    return {"status": "success", "ticket": _work_item(ticket, datetime.utcnow())}
+
+
+@admin_router.get("/work-queue", summary="Open tickets by SLA urgency", tags=["Admin Work Queue"], operation_id="get_work_queue")
+async def get_admin_work_queue(
+    team: Optional[str] = None,
+    assignee: Optional[str] = Query(None, description='Agent uuid, or "me"'),
+    unassigned: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(admin_required)
+):
+    if assignee == "me":
+        assignee = current_user.uuid
+    tickets = await get_work_queue(db, team, assignee, unassigned, limit)
+    now = datetime.utcnow()
+    return {"tickets": [_work_item(t, now) for t in tickets]}
+
+
+@admin_router.post("/work-queue/next", summary="Claim the most urgent unstarted ticket", tags=["Admin Work Queue"], operation_id="claim_next_ticket")
+async def claim_next(team: Optional[str] = None, db: AsyncSession = Depends(get_db), current_user: User = Depends(admin_required)):
+    claim = await claim_next_ticket(db, current_user.uuid, team)
+    if claim is None:
+        return {"status": "empty", "ticket": None}
+    return await _claimed(db, current_user, claim)
+
+
+@admin_router.post("/work-queue/{ticket_id}/claim", summary="Claim a ticket", tags=["Admin Work Queue"], operation_id="claim_ticket")
+async def claim(ticket_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(admin_required)):
+    return await _claimed(db, current_user, await claim_ticket(db, ticket_id, current_user.uuid))
+
+# --- Activity Logs ---
+
+
+@admin_router.get("/activity-logs", summary="Search activity logs", tags=["Admin Activity"], operation_id="search_activity_logs")
+async def search_activity_logs(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    actor: Optional[str] = None,
+    action: Optional[str] = None,
+    category: Optional[str] = None,
+    level: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(admin_required)
+):
+    # Ingestion and SQLite queries are blocking, so they run off the event loop
+    try:
+        return await asyncio.to_thread(
+            activity_index.search, start=start, end=end, actor=actor, action=action,
+            category=category, level=level, text=q, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # --- Admin Analytics ---
 
 
@@ -0,0 +1,159 @@
+import asyncio
+import re
+import time
+from collections import Counter
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select, func
+from models import CommonQuery
+
+# How often the CommonQuery signature is re-checked for changes
+SIGNATURE_CHECK_SECONDS = 30
+# Question terms count this many times more than solution terms
+QUESTION_WEIGHT = 2.0
+DEFAULT_TOP_K = 3
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in is it its me my
+no not of on or our so that the their then there this to was we what when where
+which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def _term_counts(question, solution):
+    counts = Counter()
+    for term in tokenize(question):
+        counts[term] += QUESTION_WEIGHT
+    for term in tokenize(solution):
+        counts[term] += 1
+    return counts
+
+
+class AnswerEngine:
+    """TF-IDF index over CommonQuery question + solution for answering free text.
+
+    Rows are tokenized once and cached by queryid; when the table's signature
+    changes only new or edited rows are re-read and the sparse matrix is
+    re-assembled from the cached term counts. Queries are a sparse
+    matrix-vector product, so scoring stays in the low milliseconds.
+    """
+
+    def __init__(self):
+        # queryid -> (stamp, term counts, question, solution, categoryid)
+        self._docs = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self.vocabulary = {}
+        self.idf = np.empty(0)
+        self.matrix = sparse.csc_matrix((0, 0))
+        self.query_ids = np.empty(0, dtype=np.int64)
+        self.category_ids = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    async def refresh(self, db, force=False):
+        if not force and time.monotonic() - self._checked_at < SIGNATURE_CHECK_SECONDS:
+            return self
+        async with self._lock:
+            if not force and time.monotonic() - self._checked_at < SIGNATURE_CHECK_SECONDS:
+                return self
+            stamp = func.coalesce(CommonQuery.updatedat, CommonQuery.createdat)
+            signature = tuple((await db.execute(
+                select(func.count(CommonQuery.queryid), func.max(stamp),
+                       func.coalesce(func.sum(CommonQuery.queryid), 0))
+            )).one())
+            if signature != self._signature:
+                stamps = dict((await db.execute(select(CommonQuery.queryid, stamp))).all())
+                changed = [qid for qid, s in stamps.items()
+                           if qid not in self._docs or self._docs[qid][0] != s]
+                docs = {qid: doc for qid, doc in self._docs.items() if qid in stamps}
+                if changed:
+                    rows = await db.execute(
+                        select(CommonQuery.queryid, CommonQuery.question, CommonQuery.solution,
+                               CommonQuery.categoryid)
+                        .where(CommonQuery.queryid.in_(changed)))
+                    for qid, question, solution, categoryid in rows.all():
+                        docs[qid] = (stamps[qid], _term_counts(question, solution),
+                                     question, solution, categoryid)
+                self._docs = docs
+                self._build()
+                self._signature = signature
+            self._checked_at = time.monotonic()
+        return self
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    def _build(self):
+        query_ids = sorted(self._docs)
+        vocabulary = {}
+        rows, cols, data = [], [], []
+        for row, qid in enumerate(query_ids):
+            for term, count in self._docs[qid][1].items():
+                rows.append(row)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+                data.append(count)
+        shape = (len(query_ids), len(vocabulary))
+        tf = sparse.csr_matrix((np.array(data, dtype=np.float64), (rows, cols)), shape=shape)
+        document_frequency = np.bincount(tf.indices, minlength=shape[1])
+        idf = np.log((1 + shape[0]) / (1 + document_frequency)) + 1
+        # Sublinear tf, then l2-normalized rows so a dot product is cosine similarity
+        tf.data = 1 + np.log(tf.data)
+        matrix = tf @ sparse.diags(idf)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        # Column-major, since queries slice the columns of their terms
+        matrix = sparse.csc_matrix(sparse.diags(1 / norms) @ matrix)
+        # Swap in the new index as a whole so readers never see a mix
+        self.vocabulary, self.idf, self.matrix = vocabulary, idf, matrix
+        self.query_ids = np.array(query_ids, dtype=np.int64)
+        self.category_ids = np.array([self._docs[q][4] or 0 for q in query_ids], dtype=np.int64)
+
+    def _vectorize(self, text):
+        counts = Counter(t for t in tokenize(text) if t in self.vocabulary)
+        if not counts:
+            return None
+        cols = np.fromiter((self.vocabulary[t] for t in counts), dtype=np.int64, count=len(counts))
+        weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))) * self.idf[cols]
+        return cols, weights / np.linalg.norm(weights)
+
+    def search(self, text, top_k=DEFAULT_TOP_K, category_id=None):
+        """Top-k CommonQuery matches for text as dicts with a 0-1 cosine confidence."""
+        vector = self._vectorize(text)
+        if vector is None or not len(self.query_ids):
+            return []
+        cols, weights = vector
+        scores = self.matrix[:, cols] @ weights
+        if category_id is not None:
+            scores = np.where(self.category_ids == category_id, scores, 0)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for index in top:
+            if scores[index] <= 0:
+                break
+            qid = int(self.query_ids[index])
+            _, _, question, solution, categoryid = self._docs[qid]
+            results.append({
+                "query_id": qid,
+                "category_id": categoryid,
+                "question": question,
+                "solution": solution,
+                "confidence": round(float(scores[index]), 4)
+            })
+        return results
+
+    async def answer(self, db, text, top_k=DEFAULT_TOP_K, category_id=None):
+        await self.refresh(db)
+        return self.search(text, top_k, category_id)
+
+
+answer_engine = AnswerEngine()
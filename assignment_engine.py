@@ -0,0 +1,295 @@
+import heapq
+import itertools
+import logging
+import os
+import socket
+from datetime import datetime
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db import SessionLocal
+from models import Ticket, User, Category, AgentSkill, RoutingLease
+from sla_scheduler import CLOSED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Skill level from which an agent also takes escalated tickets of that category
+SENIOR_SKILL_LEVEL = 2
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_open(status):
+    return (status or "").strip().lower() not in CLOSED_STATUSES
+
+
+def _open_ticket_filter():
+    return or_(Ticket.status.is_(None), func.lower(Ticket.status).notin_(CLOSED_STATUSES))
+
+
+class TeamQueue:
+    """Least-loaded agent heaps for one team.
+
+    There is a heap for the whole team plus one per skilled category (and per
+    category for senior agents). A load change pushes a fresh entry to each of
+    the agent's heaps and older entries are skipped when they surface, so
+    picking and updating are O(log n).
+    """
+
+    def __init__(self, agents, skills, loads):
+        self.agents = agents  # userid -> uuid
+        self.userids = {uuid: userid for userid, uuid in agents.items()}
+        self.skills = skills  # userid -> {categoryid: level}
+        self.loads = {userid: loads.get(uuid, 0) for userid, uuid in agents.items()}
+        self._order = itertools.count()
+        self._heaps = {}
+        self._keys = {}
+        for userid in agents:
+            keys = [(None, False)]
+            for categoryid, level in skills.get(userid, {}).items():
+                keys.append((categoryid, False))
+                if level >= SENIOR_SKILL_LEVEL:
+                    keys.append((categoryid, True))
+            self._keys[userid] = keys
+            for key in keys:
+                self._heaps.setdefault(key, [])
+        for userid in agents:
+            self._push(userid)
+
+    def _push(self, userid):
+        load = self.loads[userid]
+        for key in self._keys[userid]:
+            heapq.heappush(self._heaps[key], (load, next(self._order), userid))
+
+    def _top(self, key):
+        heap = self._heaps.get(key)
+        while heap:
+            load, _, userid = heap[0]
+            if self.loads.get(userid) == load:
+                return userid
+            heapq.heappop(heap)
+        return None
+
+    def pick(self, categoryid, escalated=False):
+        """Least-loaded agent for the ticket, preferring skilled (and for escalations, senior) agents."""
+        keys = [(categoryid, True)] if escalated else []
+        for key in keys + [(categoryid, False), (None, False)]:
+            userid = self._top(key)
+            if userid is not None:
+                return userid
+        return None
+
+    def adjust(self, userid, delta):
+        if userid in self.loads:
+            self.loads[userid] = max(0, self.loads[userid] + delta)
+            self._push(userid)
+
+    def userid_for(self, uuid):
+        return self.userids.get(uuid)
+
+
+class AssignmentEngine:
+    """Assigns tickets to the least-loaded eligible agent of the category's team.
+
+    Agents are active admins whose department is the team. Assignment locks
+    the team's routing_leases row, so workers take turns, and compares its
+    generation with the one this worker last wrote. A mismatch means another
+    worker changed the loads, and the team is reloaded from the database
+    first. Load changes from claims, status changes and deletes do not take
+    the lease; they only bump the generation.
+    """
+
+    def __init__(self):
+        self._teams = {}
+        self._generations = {}
+        self._category_teams = {}
+
+    async def _team_for(self, db, categoryid):
+        if categoryid is None:
+            return None
+        if categoryid not in self._category_teams:
+            result = await db.execute(select(Category.categoryid, Category.team))
+            self._category_teams = dict(result.all())
+        return self._category_teams.get(categoryid)
+
+    async def _load_team(self, db, team):
+        result = await db.execute(
+            select(User.userid, User.uuid).where(
+                User.isadmin.is_(True), User.isactive.is_(True), User.department == team))
+        agents = dict(result.all())
+        skills = {}
+        if agents:
+            result = await db.execute(
+                select(AgentSkill.userid, AgentSkill.categoryid, AgentSkill.level)
+                .where(AgentSkill.userid.in_(agents)))
+            for userid, categoryid, level in result.all():
+                skills.setdefault(userid, {})[categoryid] = level or 1
+        loads = {}
+        if agents:
+            result = await db.execute(
+                select(Ticket.assignedto, func.count(Ticket.ticketid))
+                .where(Ticket.assignedto.in_(list(agents.values())), _open_ticket_filter())
+                .group_by(Ticket.assignedto))
+            loads = dict(result.all())
+        return TeamQueue(agents, skills, loads)
+
+    async def _lock(self, db, team):
+        """Take the team's lease row lock; returns its generation."""
+        await db.execute(
+            pg_insert(RoutingLease).values(team=team, generation=0)
+            .on_conflict_do_nothing(index_elements=["team"]))
+        result = await db.execute(
+            select(RoutingLease.generation).where(RoutingLease.team == team).with_for_update())
+        return result.scalar_one()
+
+    async def _queue(self, db, team):
+        generation = await self._lock(db, team)
+        if team not in self._teams or self._generations.get(team) != generation:
+            self._teams[team] = await self._load_team(db, team)
+        return self._teams[team], generation
+
+    async def _commit(self, db, team, generation):
+        await db.execute(
+            update(RoutingLease).where(RoutingLease.team == team)
+            .values(generation=generation + 1, holder=WORKER_ID, updatedat=datetime.utcnow()))
+        await db.commit()
+        self._generations[team] = generation + 1
+
+    async def _bump(self, db, team):
+        """Advance the team's generation with a single UPDATE; returns it, or None if the team has no lease."""
+        result = await db.execute(
+            update(RoutingLease).where(RoutingLease.team == team)
+            .values(generation=RoutingLease.generation + 1, holder=WORKER_ID, updatedat=datetime.utcnow())
+            .returning(RoutingLease.generation))
+        generation = result.scalar_one_or_none()
+        await db.commit()
+        return generation
+
+    def _forget(self, team):
+        self._teams.pop(team, None)
+        self._generations.pop(team, None)
+
+    async def assign(self, db, ticket):
+        """Assign an open, unassigned ticket; returns the agent's uuid or None."""
+        if ticket.assignedto or not _is_open(ticket.status):
+            return None
+        team = await self._team_for(db, ticket.categoryid)
+        if not team:
+            return None
+        try:
+            queue, generation = await self._queue(db, team)
+            userid = queue.pick(ticket.categoryid, escalated=bool(ticket.escalation_level))
+            if userid is None:
+                # No agent on the team; release the lease and leave the ticket unassigned
+                await db.commit()
+                return None
+            ticket.assignedto = queue.agents[userid]
+            queue.adjust(userid, 1)
+            await self._commit(db, team, generation)
+        except Exception:
+            logger.exception("Could not assign ticket %s", ticket.ticketid)
+            await db.rollback()
+            self._forget(team)
+            # Rollback expires the ticket; reload it for the caller
+            await db.refresh(ticket)
+            return None
+        return ticket.assignedto
+
+    async def assign_many(self, ticket_ids):
+        """Assign the given tickets that are still open and unassigned, e.g. after escalation."""
+        assigned = 0
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Ticket).where(Ticket.ticketid.in_(ticket_ids), Ticket.assignedto.is_(None),
+                                     _open_ticket_filter()))
+            for ticket in result.scalars().all():
+                if await self.assign(db, ticket):
+                    assigned += 1
+        return assigned
+
+    async def _load_changed(self, db, ticket, changes):
+        """Apply (agent uuid, delta) load changes for a ticket of one team."""
+        team = await self._team_for(db, ticket.categoryid)
+        if not team:
+            return
+        generation = await self._bump(db, team)
+        queue = self._teams.get(team)
+        # Only this change happened since our last write, so the local loads can be adjusted
+        if queue is not None and generation is not None and self._generations.get(team) == generation - 1:
+            for uuid, delta in changes:
+                queue.adjust(queue.userid_for(uuid), delta)
+            self._generations[team] = generation
+        else:
+            self._forget(team)
+
+    async def status_changed(self, db, ticket, old_status):
+        """Account for an assigned ticket closing or reopening once its status change is committed."""
+        was_open, is_open = _is_open(old_status), _is_open(ticket.status)
+        if ticket.assignedto and was_open != is_open:
+            await self._load_changed(db, ticket, [(ticket.assignedto, 1 if is_open else -1)])
+
+    async def reassigned(self, db, ticket, old_assignee):
+        """Account for an open ticket moving between agents once the change is committed."""
+        if ticket.assignedto != old_assignee and _is_open(ticket.status):
+            changes = [(ticket.assignedto, 1)] + ([(old_assignee, -1)] if old_assignee else [])
+            await self._load_changed(db, ticket, changes)
+
+    async def removed(self, db, ticket):
+        """Account for a deleted ticket once the delete is committed."""
+        if ticket.assignedto and _is_open(ticket.status):
+            await self._load_changed(db, ticket, [(ticket.assignedto, -1)])
+
+    async def rebalance(self, db, team):
+        """Move open tickets off agents who left the team and even out loads; returns the moves made."""
+        try:
+            generation = await self._lock(db, team)
+            queue = await self._load_team(db, team)
+            result = await db.execute(
+                select(Ticket)
+                .join(Category, Category.categoryid == Ticket.categoryid)
+                .where(Category.team == team, _open_ticket_filter())
+                .order_by(Ticket.createdat.desc()))
+            tickets = result.scalars().all()
+            moves = []
+
+            def move(ticket, userid):
+                moves.append({"ticket_id": ticket.ticketid, "from": ticket.assignedto,
+                              "to": queue.agents[userid]})
+                ticket.assignedto = queue.agents[userid]
+                queue.adjust(userid, 1)
+
+            by_agent = {userid: [] for userid in queue.agents}
+            for ticket in tickets:
+                userid = queue.userid_for(ticket.assignedto) if ticket.assignedto else None
+                if userid is None:
+                    # Unassigned, or held by an agent who is inactive or moved team
+                    target = queue.pick(ticket.categoryid, escalated=bool(ticket.escalation_level))
+                    if target is not None:
+                        move(ticket, target)
+                        by_agent[target].append(ticket)
+                else:
+                    by_agent[userid].append(ticket)
+            # Move the busiest agent's newest movable ticket until no move narrows the gap
+            while queue.loads:
+                busiest = max(queue.loads, key=queue.loads.get)
+                candidate = None
+                for ticket in by_agent[busiest]:
+                    target = queue.pick(ticket.categoryid, escalated=bool(ticket.escalation_level))
+                    if target is not None and queue.loads[busiest] - queue.loads[target] >= 2:
+                        candidate = (ticket, target)
+                        break
+                if candidate is None:
+                    break
+                ticket, target = candidate
+                by_agent[busiest].remove(ticket)
+                queue.adjust(busiest, -1)
+                move(ticket, target)
+                by_agent[target].append(ticket)
+            self._teams[team] = queue
+            await self._commit(db, team, generation)
+        except Exception:
+            await db.rollback()
+            self._forget(team)
+            raise
+        return moves
+
+
+assignment_engine = AssignmentEngine()
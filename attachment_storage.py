@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+from starlette.responses import PlainTextResponse
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.getcwd(), "uploads"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+CHUNK_SIZE = 1024 * 1024
+# Resumable uploads may be larger than a single request; each chunk is still capped by MAX_UPLOAD_BYTES
+MAX_RESUMABLE_UPLOAD_BYTES = int(os.getenv("MAX_RESUMABLE_UPLOAD_BYTES", 1024 * 1024 * 1024))
+# Sessions with no chunk for this long are deleted along with their staged data
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600
+# Stored content never changes, so clients may cache it for a year
+ATTACHMENT_MAX_AGE_SECONDS = 365 * 24 * 3600
+# Request paths whose bodies are capped at MAX_UPLOAD_BYTES while they arrive
+UPLOAD_PATHS = ("/api/upload",)
+
+
+def content_path(sha256):
+    """uploads/ab/cd/abcd... so no directory grows past 65536 entries."""
+    return os.path.join(UPLOAD_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+
+
+def _write_chunk(f, digest, chunk):
+    f.write(chunk)
+    if digest is not None:
+        digest.update(chunk)
+
+
+def _store(tmp_path, sha256):
+    target = content_path(sha256)
+    if os.path.exists(target):
+        # Identical content is already stored
+        os.remove(tmp_path)
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp_path, target)
+    return True
+
+
+def _discard(tmp_path, f):
+    f.close()
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _open_temp():
+    tmp_dir = os.path.join(UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    return tmp_path, open(tmp_path, "wb")
+
+
+async def store_stream(chunks, max_bytes=MAX_UPLOAD_BYTES):
+    """Write an async iterator of bytes to content-addressed storage.
+
+    Hashing and file I/O run in worker threads; the size limit is checked per
+    chunk so an oversized upload is abandoned as soon as it crosses the limit.
+    Returns (sha256, size, created) where created is False for a duplicate.
+    """
+    tmp_path, f = await asyncio.to_thread(_open_temp)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large()
+            await asyncio.to_thread(_write_chunk, f, digest, chunk)
+    except BaseException:
+        await asyncio.to_thread(_discard, tmp_path, f)
+        raise
+    sha256 = digest.hexdigest()
+    await asyncio.to_thread(f.close)
+    created = await asyncio.to_thread(_store, tmp_path, sha256)
+    return sha256, size, created
+
+
+# Resumable upload sessions: data is appended to uploads/tmp/sessions/<id> and the
+# finished file is renamed into place, so no byte is written or read twice
+
+
+def session_path(upload_id):
+    return os.path.join(UPLOAD_DIR, "tmp", "sessions", upload_id)
+
+
+# upload_id -> (offset, running sha256) for sessions this process has been appending to
+_session_digests = {}
+
+
+def _open_session(upload_id, offset):
+    path = session_path(upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = open(path, "ab")
+    # Bytes past the recorded offset were never acknowledged; drop them
+    f.truncate(offset)
+    return f
+
+
+async def append_session(upload_id, offset, chunks, max_offset):
+    """Append chunks at offset and return the new offset.
+
+    Data received before a disconnect is kept and reported, so the client can
+    resume from there; exceeding max_offset (the declared size) raises 413.
+    """
+    f = await asyncio.to_thread(_open_session, upload_id, offset)
+    cached = _session_digests.pop(upload_id, None)
+    digest = cached[1] if cached and cached[0] == offset else None
+    try:
+        async for chunk in chunks:
+            if offset + len(chunk) > max_offset:
+                raise HTTPException(status_code=413, detail="Chunk goes past the declared upload size")
+            await asyncio.to_thread(_write_chunk, f, digest, chunk)
+            offset += len(chunk)
+    except ClientDisconnect:
+        pass
+    finally:
+        await asyncio.to_thread(f.close)
+        if digest is not None:
+            _session_digests[upload_id] = (offset, digest)
+    return offset
+
+
+def _create_session(upload_id):
+    _open_session(upload_id, 0).close()
+
+
+async def start_session(upload_id):
+    await asyncio.to_thread(_create_session, upload_id)
+    _session_digests[upload_id] = (0, hashlib.sha256())
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def finalize_session(upload_id, size):
+    """Move a complete session file into content-addressed storage; returns (sha256, created)."""
+    path = session_path(upload_id)
+    cached = _session_digests.pop(upload_id, None)
+    if cached and cached[0] == size:
+        sha256 = cached[1].hexdigest()
+    else:
+        # Chunks went through another worker or a restart; hash the file once
+        sha256 = await asyncio.to_thread(_hash_file, path)
+    created = await asyncio.to_thread(_store, path, sha256)
+    return sha256, created
+
+
+async def discard_session(upload_id):
+    _session_digests.pop(upload_id, None)
+    try:
+        await asyncio.to_thread(os.remove, session_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+async def iter_upload_file(file, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _expire_session_files(max_age_seconds):
+    session_dir = os.path.dirname(session_path("x"))
+    cutoff = time.time() - max_age_seconds
+    try:
+        entries = list(os.scandir(session_dir))
+    except FileNotFoundError:
+        return []
+    expired = []
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                expired.append(entry.name)
+        except FileNotFoundError:
+            pass
+    return expired
+
+
+async def expire_session_files(max_age_seconds):
+    expired = await asyncio.to_thread(_expire_session_files, max_age_seconds)
+    for upload_id in expired:
+        _session_digests.pop(upload_id, None)
+    return len(expired)
+
+
+class UploadSizeLimitMiddleware:
+    """Reject upload request bodies over the limit before they are buffered.
+
+    A declared Content-Length over the limit is refused without reading the
+    body; otherwise bytes are counted as they are received, so multipart
+    parsing stops at the limit instead of spooling the whole body first.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES, paths=UPLOAD_PATHS):
+        self.app = app
+        # Multipart framing adds a little on top of the file itself
+        self.max_bytes = max_bytes + 64 * 1024
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = PlainTextResponse("Upload too large", status_code=413)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,235 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from db import SessionLocal
+from models import AuditLog, TicketStatusLog
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv("AUDIT_SPOOL_DIR", "logs")
+SPOOL_NAME = "audit_spool"
+# Flush once this many events are pending, or after the interval, whichever comes first
+AUDIT_BATCH_SIZE = 500
+FLUSH_INTERVAL_SECONDS = 1.0
+RETRY_DELAY_SECONDS = 5
+
+EVENT_MODELS = {"audit": AuditLog, "status": TicketStatusLog}
+# Columns stored as ISO strings in the spool
+DATETIME_FIELDS = ("timestamp", "created_at")
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_segment(path):
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # A torn last line from a crash mid-write
+                logger.warning("Skipping unreadable audit spool line in %s", path)
+    return events
+
+
+def _row(event):
+    row = dict(event["row"])
+    for field in DATETIME_FIELDS:
+        if isinstance(row.get(field), str):
+            row[field] = datetime.fromisoformat(row[field])
+    return row
+
+
+class AuditTrail:
+    """Write-behind pipeline for AuditLog and TicketStatusLog rows.
+
+    Recording an event appends one JSON line to the active spool file, which
+    costs a write syscall and no database round trip. The flusher rotates the
+    spool into a numbered segment, inserts the segment's rows in their own
+    transaction and deletes the segment only after commit. Segments left over
+    from a crash are replayed on start, so delivery is at-least-once.
+    """
+
+    def __init__(self, spool_dir=SPOOL_DIR):
+        self.spool_dir = spool_dir
+        self._spool = None
+        self._pending = 0
+        self._segment_seq = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    # Spool files carry the pid so several workers can share one spool directory
+    @property
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, f"{SPOOL_NAME}.{os.getpid()}.jsonl")
+
+    def _segment_path(self):
+        self._segment_seq += 1
+        return os.path.join(
+            self.spool_dir,
+            f"{SPOOL_NAME}.{os.getpid()}.{datetime.utcnow():%Y%m%d%H%M%S%f}-{self._segment_seq:06d}.segment")
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(
+            glob.escape(self.spool_dir), f"{SPOOL_NAME}.{os.getpid()}.*.segment")))
+
+    def _adopt_orphans(self):
+        """Claim spool files and segments left behind by workers that are no longer running."""
+        pattern = os.path.join(glob.escape(self.spool_dir), f"{SPOOL_NAME}.*")
+        for path in glob.glob(pattern):
+            pid = os.path.basename(path).split(".")[1]
+            if not pid.isdigit() or int(pid) == os.getpid() or _pid_alive(int(pid)):
+                continue
+            try:
+                os.replace(path, self._segment_path())
+            except FileNotFoundError:
+                # Another worker claimed it first
+                pass
+
+    def _record(self, kind, row):
+        if self._spool is None:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._spool = open(self._spool_path, "a", encoding="utf-8")
+        self._spool.write(json.dumps({"kind": kind, "row": row}, default=str) + "\n")
+        # Hand the line to the OS so a process crash cannot lose it
+        self._spool.flush()
+        self._pending += 1
+        if self._pending >= AUDIT_BATCH_SIZE:
+            self._wakeup.set()
+
+    def audit(self, user_id, action, status, details=""):
+        self._record("audit", {
+            "user_id": user_id,
+            "action": action,
+            "status": status,
+            "timestamp": datetime.utcnow(),
+            "details": details
+        })
+
+    def status_change(self, ticket_id, old_status, new_status, changed_by_id=None,
+                      changed_by_type=None, escalation_level=None, comment=None):
+        self._record("status", {
+            "ticket_id": ticket_id,
+            "old_status": old_status,
+            "new_status": new_status,
+            "changed_by_id": changed_by_id,
+            "changed_by_type": changed_by_type,
+            "escalation_level": escalation_level,
+            "comment": comment,
+            "created_at": datetime.utcnow()
+        })
+
+    def _rotate(self):
+        """Close the active spool and rename it into a segment the flusher owns."""
+        if self._spool is None:
+            return
+        self._spool.close()
+        self._spool = None
+        self._pending = 0
+        if os.path.getsize(self._spool_path):
+            os.replace(self._spool_path, self._segment_path())
+
+    async def _insert(self, db, model, rows):
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(model), rows)
+        except IntegrityError:
+            # e.g. a status change for a ticket deleted before the flush; keep the rest
+            for row in rows:
+                try:
+                    async with db.begin_nested():
+                        await db.execute(insert(model), [row])
+                except IntegrityError:
+                    logger.warning("Dropping audit %s row that violates constraints: %s",
+                                   model.__tablename__, row)
+
+    async def _flush_segment(self, path):
+        await asyncio.to_thread(_fsync, path)
+        events = await asyncio.to_thread(_read_segment, path)
+        rows = {kind: [] for kind in EVENT_MODELS}
+        for event in events:
+            rows[event["kind"]].append(_row(event))
+        async with SessionLocal() as db:
+            for kind, model in EVENT_MODELS.items():
+                for start in range(0, len(rows[kind]), AUDIT_BATCH_SIZE):
+                    await self._insert(db, model, rows[kind][start:start + AUDIT_BATCH_SIZE])
+            await db.commit()
+        await asyncio.to_thread(os.remove, path)
+        return len(events)
+
+    async def flush(self):
+        """Persist everything recorded so far; segments that fail stay on disk for retry."""
+        async with self._flush_lock:
+            self._rotate()
+            flushed = 0
+            for path in self._segments():
+                flushed += await self._flush_segment(path)
+            return flushed
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush audit spool; retrying")
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+    async def start(self):
+        # Spools left by crashed processes become segments and are replayed
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._adopt_orphans()
+        if os.path.exists(self._spool_path):
+            self._spool = open(self._spool_path, "a", encoding="utf-8")
+        try:
+            replayed = await self.flush()
+            if replayed:
+                logger.info("Replayed %d audit events from spool", replayed)
+        except Exception:
+            logger.exception("Failed to replay audit spool; will retry in the background")
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush audit spool on shutdown; it will be replayed on start")
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+audit_trail = AuditTrail()
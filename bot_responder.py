@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import select, update, insert
+from db import SessionLocal
+from models import Ticket, TicketMessage
+from answer_engine import answer_engine
+
+logger = logging.getLogger(__name__)
+
+BOT_QUEUE_SIZE = int(os.getenv("BOT_QUEUE_SIZE", 1000))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 2))
+BOT_BATCH_SIZE = 50
+# Matches below this cosine confidence are not posted
+BOT_MIN_CONFIDENCE = float(os.getenv("BOT_MIN_CONFIDENCE", 0.35))
+DRAIN_TIMEOUT_SECONDS = 5
+
+
+class BotResponder:
+    """Background stage that answers new customer messages from the common-query knowledge base.
+
+    Requests only enqueue (ticket_id, text); workers take up to BOT_BATCH_SIZE
+    items at a time, refresh the answer index once per batch and write all
+    bot replies and bot_attempted flags in a single transaction. When the
+    queue is full new items are dropped rather than slowing the request down.
+    """
+
+    def __init__(self, workers=BOT_WORKERS, maxsize=BOT_QUEUE_SIZE):
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks = []
+        self.dropped = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def submit(self, ticket_id, text):
+        try:
+            self._queue.put_nowait((ticket_id, text))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Bot queue full; not auto-answering ticket %s", ticket_id)
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        while len(batch) < BOT_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    def _best_match(self, text, category_id):
+        # Prefer an answer from the ticket's own category, then any category
+        for category in (category_id, None):
+            matches = answer_engine.search(text, 1, category)
+            if matches and matches[0]["confidence"] >= BOT_MIN_CONFIDENCE:
+                return matches[0]
+            if category is None:
+                break
+        return None
+
+    async def process(self, batch):
+        """Answer a batch of (ticket_id, text) items; returns the number of replies posted."""
+        ticket_ids = {ticket_id for ticket_id, _ in batch}
+        async with SessionLocal() as db:
+            await answer_engine.refresh(db)
+            result = await db.execute(
+                select(Ticket.ticketid, Ticket.categoryid, Ticket.first_response_at)
+                .where(Ticket.ticketid.in_(ticket_ids)))
+            tickets = {row.ticketid: row for row in result.all()}
+            now = datetime.utcnow()
+            replies = []
+            for ticket_id, text in batch:
+                ticket = tickets.get(ticket_id)
+                # Leave tickets an agent has already picked up to the agent
+                if ticket is None or ticket.first_response_at is not None:
+                    continue
+                match = self._best_match(text, ticket.categoryid)
+                if match:
+                    replies.append({
+                        "ticketid": ticket_id,
+                        "senderid": None,
+                        "content": match["solution"],
+                        "isadminreply": False,
+                        "isbotresponse": True,
+                        "bot_confidence": match["confidence"],
+                        "createdat": now
+                    })
+            if replies:
+                await db.execute(insert(TicketMessage), replies)
+            if tickets:
+                await db.execute(
+                    update(Ticket).where(Ticket.ticketid.in_(tickets)).values(bot_attempted=True))
+            await db.commit()
+        return len(replies)
+
+    async def run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.process(batch)
+            except Exception:
+                logger.exception("Bot auto-reply failed for %d queued messages", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Give queued messages a moment to be answered before the workers go
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %d unanswered bot queue items", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+bot_responder = BotResponder()
@@ -1,8 +1,25 @@
 from datetime import datetime
 import os
 import logging
-from models import User, Category, CommonQuery, Ticket, TicketMessage, Feedback
+from models import User, Category, CommonQuery, Ticket, TicketMessage, Feedback, Attachment, UploadSession
 from sla_controller import match_ticket_to_sla_policy
+from sla_scheduler import sla_scheduler
+from sla_calendar import business_calendars
+from activity_log import activity_log
+from answer_engine import answer_engine
+from bot_responder import bot_responder
+from query_suggest import query_suggester
+from duplicate_detector import duplicate_detector
+from ticket_triage import ticket_triage, TRIAGE_MODE
+from assignment_engine import assignment_engine
+from attachment_storage import (
+    store_stream, iter_upload_file, content_path, ATTACHMENT_MAX_AGE_SECONDS, MAX_RESUMABLE_UPLOAD_BYTES, UPLOAD_SESSION_TTL_SECONDS,
+    start_session, append_session, finalize_session, discard_session, expire_session_files
+)
+import uuid
+from image_derivatives import image_derivatives, DERIVATIVE_SIZES, DERIVATIVE_FORMATS, IMAGE_CONTENT_TYPES
+from fastapi.responses import FileResponse, Response
+import asyncio
 from sqlalchemy.future import select
 from schemas import UserRegisterRequest, UserLoginRequest, TokenResponse, SLAPolicyCreate, SLAPolicyUpdate, SLAPolicyOut, SLAStatusOut, SLAViolationOut, SLAReportOut
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -10,12 +27,13 @@ from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends, UploadFile
-from dbactions import register_user, get_user_by_uuid, get_categories, get_common_queries, submit_feedback, create_ticket, get_tickets, get_ticket_details, update_ticket_status, delete_ticket, get_ticket_messages, add_ticket_message
+from dbactions import register_user, get_user_by_uuid, get_categories, get_common_queries, submit_feedback, create_ticket, get_tickets, get_ticket_details, update_ticket_status, delete_ticket, get_ticket_messages, add_ticket_message, add_duplicate_candidates
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, UploadFile
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
-from sqlalchemy import select
+from sqlalchemy import select, delete
+from sqlalchemy.orm import joinedload
 from db import get_db
 from models import User
 
@@ -30,7 +48,8 @@ async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depe
         assert email is not None
     except:
         raise credentials_exception
-    result = await db.execute(select(User).where(User.email == email))
+    # Role is loaded with the user; role checks and activity logging read it outside any await
+    result = await db.execute(select(User).options(joinedload(User.role)).where(User.email == email))
     user = result.scalar_one_or_none()
     if not user:
         raise credentials_exception
@@ -47,16 +66,6 @@ async def get_current_admin_user(current_user: User = Depends(get_current_user))
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-async def upload_file_controller(file: UploadFile):
-    uploads_dir = os.path.join(os.getcwd(), "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    file_location = os.path.join(uploads_dir, file.filename)
-    content = await file.read()
-    with open(file_location, "wb") as f:
-        f.write(content)
-    return {"file_url": f"/uploads/{file.filename}"}
-
-
 async def login_user_controller(db: AsyncSession, form_data):
     result = await db.execute(select(User).where(User.email == form_data.username))
     user = result.scalar_one_or_none()
@@ -118,18 +127,191 @@ async def get_common_queries_controller(db: AsyncSession, category_id: int):
     return await get_common_queries(db, category_id)
 
 
-async def upload_file_controller(file: UploadFile):
-    uploads_dir = os.path.join(os.getcwd(), "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    file_location = os.path.join(uploads_dir, file.filename)
-    content = await file.read()
-    with open(file_location, "wb") as f:
-        f.write(content)
-    return {"file_url": f"/uploads/{file.filename}"}
+async def _check_ticket_upload_access(db: AsyncSession, ticket_id, current_user):
+    if ticket_id is None:
+        return
+    ticket = (await db.execute(select(Ticket).where(Ticket.ticketid == ticket_id))).scalar_one_or_none()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    if ticket.userid != current_user.userid and not current_user.isadmin:
+        raise HTTPException(status_code=403, detail="Not allowed to attach files to this ticket")
+
+
+async def _save_attachment(db: AsyncSession, sha256, size, filename, content_type, ticket_id, user_id):
+    attachment = Attachment(
+        sha256=sha256,
+        size=size,
+        filename=os.path.basename(filename or "") or None,
+        content_type=content_type,
+        ticketid=ticket_id,
+        uploadedby=user_id,
+        createdat=datetime.utcnow()
+    )
+    db.add(attachment)
+    await db.commit()
+    await db.refresh(attachment)
+    image_derivatives.schedule(sha256, content_type)
+    return {
+        "attachment_id": attachment.id,
+        "filename": attachment.filename,
+        "sha256": sha256,
+        "size": size,
+        "file_url": f"/api/attachments/{attachment.id}"
+    }
+
+
+async def upload_file_controller(db: AsyncSession, file: UploadFile, current_user, ticket_id: int = None):
+    await _check_ticket_upload_access(db, ticket_id, current_user)
+    sha256, size, _ = await store_stream(iter_upload_file(file))
+    return await _save_attachment(db, sha256, size, file.filename, file.content_type, ticket_id, current_user.userid)
+
+
+async def _expire_upload_sessions(db: AsyncSession):
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+    await db.execute(delete(UploadSession).where(UploadSession.updatedat < cutoff))
+    await db.commit()
+    # Staged files are swept by age, which also catches sessions removed with their ticket
+    await expire_session_files(UPLOAD_SESSION_TTL_SECONDS)
+
+
+async def _get_upload_session(db: AsyncSession, upload_id: str, current_user, for_update=False):
+    query = select(UploadSession).where(UploadSession.id == upload_id)
+    if for_update:
+        # Serializes concurrent chunks for the same session
+        query = query.with_for_update()
+    session = (await db.execute(query)).scalar_one_or_none()
+    if not session or session.userid != current_user.userid:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.updatedat < datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS):
+        raise HTTPException(status_code=410, detail="Upload session expired")
+    return session
+
+
+def _upload_session_out(session):
+    return {
+        "upload_id": session.id,
+        "offset": session.offset,
+        "size": session.size,
+        "expires_at": str(session.updatedat + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS))
+    }
+
+
+async def create_upload_session_controller(db: AsyncSession, payload, current_user):
+    if payload.size > MAX_RESUMABLE_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_RESUMABLE_UPLOAD_BYTES} bytes")
+    await _check_ticket_upload_access(db, payload.ticket_id, current_user)
+    await _expire_upload_sessions(db)
+    now = datetime.utcnow()
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        userid=current_user.userid,
+        ticketid=payload.ticket_id,
+        filename=payload.filename,
+        content_type=payload.content_type,
+        size=payload.size,
+        offset=0,
+        createdat=now,
+        updatedat=now
+    )
+    await start_session(session.id)
+    db.add(session)
+    await db.commit()
+    return _upload_session_out(session)
+
+
+async def get_upload_session_controller(db: AsyncSession, upload_id: str, current_user):
+    return _upload_session_out(await _get_upload_session(db, upload_id, current_user))
+
+
+async def append_upload_chunk_controller(db: AsyncSession, upload_id: str, offset: int, chunks, current_user):
+    session = await _get_upload_session(db, upload_id, current_user, for_update=True)
+    if offset != session.offset:
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": session.offset})
+    session.offset = await append_session(upload_id, offset, chunks, session.size)
+    session.updatedat = datetime.utcnow()
+    await db.commit()
+    return _upload_session_out(session)
+
+
+async def finalize_upload_session_controller(db: AsyncSession, upload_id: str, current_user):
+    session = await _get_upload_session(db, upload_id, current_user, for_update=True)
+    if session.offset != session.size:
+        raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "offset": session.offset})
+    sha256, _ = await finalize_session(upload_id, session.size)
+    await db.delete(session)
+    return await _save_attachment(db, sha256, session.size, session.filename, session.content_type,
+                                  session.ticketid, current_user.userid)
+
+
+async def delete_upload_session_controller(db: AsyncSession, upload_id: str, current_user):
+    session = await _get_upload_session(db, upload_id, current_user, for_update=True)
+    await db.delete(session)
+    await db.commit()
+    await discard_session(upload_id)
+    return {"message": "Upload session deleted"}
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+async def _get_accessible_attachment(db: AsyncSession, attachment_id: int, current_user):
+    attachment = (await db.execute(select(Attachment).where(Attachment.id == attachment_id))).scalar_one_or_none()
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if not current_user.isadmin and attachment.uploadedby != current_user.userid:
+        owner = None
+        if attachment.ticketid is not None:
+            owner = (await db.execute(select(Ticket.userid).where(Ticket.ticketid == attachment.ticketid))).scalar_one_or_none()
+        if owner != current_user.userid:
+            raise HTTPException(status_code=403, detail="Not allowed to access this attachment")
+    return attachment
+
+
+async def get_attachment_controller(db: AsyncSession, attachment_id: int, current_user, if_none_match: str = None):
+    attachment = await _get_accessible_attachment(db, attachment_id, current_user)
+    # Content is addressed by its hash, so the hash is a strong validator and never changes
+    headers = {
+        "ETag": f'"{attachment.sha256}"',
+        "Cache-Control": f"private, max-age={ATTACHMENT_MAX_AGE_SECONDS}, immutable"
+    }
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    path = content_path(attachment.sha256)
+    if not await asyncio.to_thread(os.path.exists, path):
+        raise HTTPException(status_code=404, detail="Attachment content not found")
+    # FileResponse handles Range/If-Range and uses http.response.pathsend when the server offers it
+    return FileResponse(path, media_type=attachment.content_type or "application/octet-stream",
+                        filename=attachment.filename or attachment.sha256, headers=headers)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+async def get_attachment_derivative_controller(db: AsyncSession, attachment_id: int, size: str, fmt: str,
+                                               current_user, if_none_match: str = None):
+    if size not in DERIVATIVE_SIZES or fmt not in DERIVATIVE_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown derivative")
+    attachment = await _get_accessible_attachment(db, attachment_id, current_user)
+    if (attachment.content_type or "").lower() not in IMAGE_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Attachment is not an image")
+    headers = {
+        "ETag": f'"{attachment.sha256}-{size}.{fmt}"',
+        "Cache-Control": f"private, max-age={ATTACHMENT_MAX_AGE_SECONDS}, immutable"
+    }
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        path = await image_derivatives.get(attachment.sha256, size, fmt)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Attachment content not found")
+    except Exception:
+        raise HTTPException(status_code=415, detail="Attachment could not be rendered as an image")
+    return FileResponse(path, media_type=DERIVATIVE_FORMATS[fmt], headers=headers)
+
+
 async def login_user_controller(db: AsyncSession, form_data):
     result = await db.execute(select(User).where(User.email == form_data.username))
     user = result.scalar_one_or_none()
@@ -246,7 +428,10 @@ async def get_categories_controller(db: AsyncSession):
 
 
 async def add_ticket_message_controller(db: AsyncSession, ticket_id: int, payload):
-    return await add_ticket_message(db, ticket_id, payload)
+    message = await add_ticket_message(db, ticket_id, payload)
+    if not payload.is_admin:
+        bot_responder.submit(ticket_id, payload.content)
+    return message
 
 
 async def get_ticket_messages_controller(db: AsyncSession, ticket_id: int):
@@ -258,18 +443,57 @@ async def get_ticket_details_controller(db: AsyncSession, ticket_id: int):
 
 
 async def create_ticket_controller(db: AsyncSession, payload):
-    return await create_ticket(db, payload)
+    # Runs first so a corrected priority also picks the SLA policy
+    corrections = ticket_triage.correct(payload)
+    sla_policy, _ = await match_ticket_to_sla_policy(db, payload.priority)
+    await business_calendars.load(db)
+    ticket = await create_ticket(
+        db, payload,
+        sla_policy.resolution_time_minutes if sla_policy else None,
+        business_calendars.for_ticket(sla_policy.sla_id, None) if sla_policy else None)
+    sla_scheduler.track(ticket)
+    if corrections:
+        activity_log.log("system", "TICKET_TRIAGE_CORRECTED", None,
+                         f"ticket_id: {ticket.ticketid} | " + " | ".join(
+                             f"{field}: {old} -> {new}" for field, (old, new) in corrections.items()))
+    await assignment_engine.assign(db, ticket)
+    candidates = duplicate_detector.add(ticket.ticketid, payload.subject, payload.message)
+    if candidates:
+        await add_duplicate_candidates(db, ticket.ticketid, candidates)
+    bot_responder.submit(ticket.ticketid, f"{payload.subject or ''} {payload.message}")
+    return ticket
 
 
 async def get_common_queries_controller(db: AsyncSession, category_id: int):
     return await get_common_queries(db, category_id)
 
 
-def log_user_activity(user_uuid: str, action: str, details: str = ""):
+async def answer_question_controller(db: AsyncSession, payload):
+    return {"answers": await answer_engine.answer(db, payload.text, payload.top_k, payload.category_id)}
+
+
+async def triage_ticket_controller(payload):
+    predictions = ticket_triage.predict(payload.subject, payload.message)
+    return {
+        "mode": TRIAGE_MODE,
+        **{field: {"value": value, "confidence": round(confidence, 4)}
+           for field, (value, confidence) in predictions.items()}
+    }
+
+
+async def suggest_questions_controller(db: AsyncSession, text: str, category_id=None, limit: int = 8):
+    return {"suggestions": await query_suggester.suggest(db, text, category_id, limit)}
+
+
+def activity_category(user) -> str:
+    """Activity log category for the acting user's role."""
+    if user.role and user.role.name.lower() == "superadmin":
+        return "superadmin"
+    return "admin" if user.isadmin else "user"
+
+
+def log_user_activity(user_uuid: str, action: str, details: str = "", category: str = "admin"):
     """
-    Logs user activity for admin actions to admin_activity.log.
+    Queues a user activity record for logs/{category}_activity.log; never blocks on file I/O.
     """
-    timestamp = datetime.utcnow().isoformat()
-    entry = f"{timestamp} | {user_uuid} | {action} | {details}\n"
-    with open("admin_activity.log", "a") as f:
-        f.write(entry)
+    activity_log.log(category, action, user_uuid, details)
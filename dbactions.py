@@ -1,8 +1,11 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, desc
+from sqlalchemy import select, func, desc, update, or_, text
 from fastapi import HTTPException
-from models import User, Category, CommonQuery, Ticket, TicketMessage, Feedback, TicketStatusLog
+from models import User, Category, CommonQuery, Ticket, TicketMessage, Feedback, TicketStatusLog, TicketDuplicateCandidate
 from sla_models import SLAPolicy, SLALog
+from sla_resolver import sla_policy_resolver
+from sla_calendar import sla_deadline
+from sla_scheduler import CLOSED_STATUSES
 from datetime import datetime, timedelta
 from schemas import (
     UserRegisterRequest, TicketCreateRequest, TicketMessageRequest, FeedbackRequest,
@@ -56,7 +59,7 @@ async def get_common_queries(db: AsyncSession, category_id: int):
 # --- Ticket Operations ---
 
 
-async def create_ticket(db: AsyncSession, payload: TicketCreateRequest):
+async def create_ticket(db: AsyncSession, payload: TicketCreateRequest, sla_minutes: int = None, calendar=None):
     now = datetime.utcnow()
     ticket = Ticket(
         userid=None,
@@ -67,9 +70,19 @@ async def create_ticket(db: AsyncSession, payload: TicketCreateRequest):
         organizationname=payload.organization,
         createdby=payload.name,
         createdat=now,
-        updatedat=now
+        updatedat=now,
+        current_sla_target=sla_deadline(
+            now, sla_minutes, calendar) if sla_minutes else None
     )
     db.add(ticket)
+    await db.flush()
+    db.add(TicketMessage(
+        ticketid=ticket.ticketid,
+        content=payload.message,
+        isadminreply=False,
+        createdat=now,
+        isbotresponse=False
+    ))
     await db.commit()
     await db.refresh(ticket)
     return ticket
@@ -118,6 +131,111 @@ async def delete_ticket(db: AsyncSession, ticket_id: int):
     await db.commit()
     return True
 
+
+async def add_duplicate_candidates(db: AsyncSession, ticket_id: int, candidates):
+    now = datetime.utcnow()
+    db.add_all([
+        TicketDuplicateCandidate(ticketid=ticket_id, duplicate_of=other_id,
+                                 similarity=round(score, 4), createdat=now)
+        for other_id, score in candidates
+    ])
+    await db.commit()
+
+
+async def get_duplicate_cluster(db: AsyncSession, ticket_id: int, limit: int = 500):
+    """Tickets linked to ticket_id through duplicate candidate pairs, and the pairs themselves."""
+    members, frontier, edges = {ticket_id}, {ticket_id}, {}
+    while frontier and len(members) < limit:
+        result = await db.execute(
+            select(TicketDuplicateCandidate).where(or_(
+                TicketDuplicateCandidate.ticketid.in_(frontier),
+                TicketDuplicateCandidate.duplicate_of.in_(frontier))))
+        frontier = set()
+        for pair in result.scalars().all():
+            edges[pair.id] = pair
+            for other in (pair.ticketid, pair.duplicate_of):
+                if other not in members:
+                    members.add(other)
+                    frontier.add(other)
+    return members, list(edges.values())
+
+# --- Work Queue ---
+
+# Literal predicate shared with the ix_tickets_work_queue partial index, so the planner can use it
+ACTIVE_TICKET_PREDICATE = "(tickets.status IS NULL OR lower(tickets.status) NOT IN (%s))" % ", ".join(
+    "'%s'" % s for s in CLOSED_STATUSES)
+WORK_QUEUE_ORDER = (
+    Ticket.current_sla_target.asc().nulls_last(),
+    Ticket.escalation_level.desc().nulls_last(),
+    Ticket.ticketid
+)
+# Tickets an agent is working on; "next" only hands out tickets not yet started
+CLAIMED_STATUS = "in_progress"
+
+
+def _work_queue_query(team=None, assignee=None, unassigned=False):
+    query = select(Ticket).where(text(ACTIVE_TICKET_PREDICATE))
+    if team:
+        query = query.join(Category, Category.categoryid == Ticket.categoryid).where(Category.team == team)
+    if assignee:
+        query = query.where(Ticket.assignedto == assignee)
+    elif unassigned:
+        query = query.where(Ticket.assignedto.is_(None))
+    return query.order_by(*WORK_QUEUE_ORDER)
+
+
+async def get_work_queue(db: AsyncSession, team=None, assignee=None, unassigned=False, limit: int = 50):
+    result = await db.execute(_work_queue_query(team, assignee, unassigned).limit(limit))
+    return result.scalars().all()
+
+
+async def claim_next_ticket(db: AsyncSession, agent_uuid: str, team=None):
+    """Lock and claim the most urgent unstarted ticket that is unassigned or assigned to the agent.
+
+    Rows locked by another agent's claim are skipped rather than waited on,
+    so concurrent callers each get a different ticket. Returns
+    (ticket, old_status, old_assignee) or None when the queue is empty.
+    """
+    query = (
+        _work_queue_query(team)
+        .where(or_(Ticket.assignedto.is_(None), Ticket.assignedto == agent_uuid),
+               or_(Ticket.status.is_(None), func.lower(Ticket.status) != CLAIMED_STATUS))
+        .limit(1)
+        .with_for_update(skip_locked=True, of=Ticket)
+    )
+    ticket = (await db.execute(query)).scalar_one_or_none()
+    if ticket is None:
+        await db.rollback()
+        return None
+    return await _claim(db, ticket, agent_uuid)
+
+
+async def claim_ticket(db: AsyncSession, ticket_id: int, agent_uuid: str):
+    query = select(Ticket).where(Ticket.ticketid == ticket_id).with_for_update(skip_locked=True)
+    ticket = (await db.execute(query)).scalar_one_or_none()
+    if ticket is None:
+        exists = (await db.execute(select(Ticket.ticketid).where(Ticket.ticketid == ticket_id))).scalar_one_or_none()
+        await db.rollback()
+        if exists is None:
+            raise HTTPException(status_code=404, detail="Ticket not found")
+        raise HTTPException(status_code=409, detail="Ticket is being claimed by another agent")
+    if (ticket.status or "").strip().lower() in CLOSED_STATUSES:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Ticket is already closed")
+    if ticket.assignedto not in (None, agent_uuid) and (ticket.status or "").lower() == CLAIMED_STATUS:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Ticket is already claimed by another agent")
+    return await _claim(db, ticket, agent_uuid)
+
+
+async def _claim(db: AsyncSession, ticket, agent_uuid):
+    old_status, old_assignee = ticket.status, ticket.assignedto
+    ticket.assignedto = agent_uuid
+    ticket.status = CLAIMED_STATUS
+    ticket.updatedat = datetime.utcnow()
+    await db.commit()
+    return ticket, old_status, old_assignee
+
 # --- Ticket Messages ---
 
 
@@ -136,6 +254,12 @@ async def add_ticket_message(db: AsyncSession, ticket_id: int, payload: TicketMe
         isbotresponse=False
     )
     db.add(message)
+    if payload.is_admin:
+        await db.execute(
+            update(Ticket)
+            .where(Ticket.ticketid == ticket_id, Ticket.first_response_at.is_(None))
+            .values(first_response_at=message.createdat)
+        )
     await db.commit()
     await db.refresh(message)
     return message
@@ -168,6 +292,7 @@ async def create_sla_policy(db: AsyncSession, payload: SLAPolicyCreate):
     db.add(policy)
     await db.commit()
     await db.refresh(policy)
+    sla_policy_resolver.invalidate()
     return policy
 
 
@@ -180,6 +305,7 @@ async def update_sla_policy(db: AsyncSession, sla_id: int, payload: SLAPolicyUpd
         setattr(policy, key, value)
     await db.commit()
     await db.refresh(policy)
+    sla_policy_resolver.invalidate()
     return policy
 
 # --- Analytics ---
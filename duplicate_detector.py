@@ -0,0 +1,145 @@
+import asyncio
+import re
+import zlib
+from collections import defaultdict
+import numpy as np
+from sqlalchemy import select, or_, func
+from db import SessionLocal
+from models import Ticket, TicketMessage
+from sla_scheduler import CLOSED_STATUSES
+
+NUM_PERM = 128
+# 32 bands of 4 rows: pairs above ~0.42 Jaccard usually share a bucket
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+# Estimated Jaccard similarity at which a candidate is flagged
+DUPLICATE_THRESHOLD = 0.5
+MAX_TEXT_CHARS = 2000
+MAX_CANDIDATES = 20
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+# Fixed seed so signatures stay comparable across processes and restarts
+_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+
+def ticket_text(subject, message):
+    return f"{subject or ''} {message or ''}"
+
+
+def shingles(text):
+    # Punctuation and spacing differ between reports of the same problem
+    text = _SEPARATORS.sub(" ", (text or "").lower()).strip()[:MAX_TEXT_CHARS]
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    """NUM_PERM uint32 MinHash signature of the text's character shingles, or None if empty."""
+    grams = shingles(text)
+    if not grams:
+        return None
+    hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    # Universal hashing (a*x + b) mod p per permutation; uint64 overflow wraps like datasketch
+    permuted = (np.outer(hashes, _A) + _B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(a, b):
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class DuplicateDetector:
+    """LSH index of MinHash signatures for open tickets.
+
+    Each signature is cut into BANDS bands, and each band is hashed into a
+    bucket. Tickets that share a bucket in any band become candidates. A
+    lookup touches only BANDS buckets, not every open ticket.
+    """
+
+    def __init__(self):
+        self._signatures = {}
+        self._buckets = [defaultdict(set) for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self._signatures)
+
+    @staticmethod
+    def _bands(signature):
+        return [signature[i * ROWS:(i + 1) * ROWS].tobytes() for i in range(BANDS)]
+
+    def query(self, signature, exclude=None):
+        """(ticket_id, similarity) pairs at or above DUPLICATE_THRESHOLD, most similar first."""
+        candidates = set()
+        for band, key in enumerate(self._bands(signature)):
+            candidates |= self._buckets[band].get(key, set())
+        candidates.discard(exclude)
+        scored = [(ticket_id, similarity(signature, self._signatures[ticket_id])) for ticket_id in candidates]
+        scored = [pair for pair in scored if pair[1] >= DUPLICATE_THRESHOLD]
+        scored.sort(key=lambda pair: (-pair[1], pair[0]))
+        return scored[:MAX_CANDIDATES]
+
+    def insert(self, ticket_id, signature):
+        self.discard(ticket_id)
+        self._signatures[ticket_id] = signature
+        for band, key in enumerate(self._bands(signature)):
+            self._buckets[band][key].add(ticket_id)
+
+    def add(self, ticket_id, subject, message):
+        """Index a new ticket and return its candidate duplicates among the open tickets."""
+        signature = minhash(ticket_text(subject, message))
+        if signature is None:
+            return []
+        candidates = self.query(signature, exclude=ticket_id)
+        self.insert(ticket_id, signature)
+        return candidates
+
+    def discard(self, ticket_id):
+        signature = self._signatures.pop(ticket_id, None)
+        if signature is None:
+            return
+        for band, key in enumerate(self._bands(signature)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(ticket_id)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def track(self, ticket):
+        """Closed tickets leave the index so new tickets are only matched against open ones."""
+        if (ticket.status or "").strip().lower() in CLOSED_STATUSES:
+            self.discard(ticket.ticketid)
+
+    async def load(self, db):
+        """Rebuild the index from the subject and opening message of every open ticket."""
+        first_message = (
+            select(TicketMessage.content)
+            .where(TicketMessage.ticketid == Ticket.ticketid)
+            .order_by(TicketMessage.messageid)
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            select(Ticket.ticketid, Ticket.subject, first_message).where(
+                or_(Ticket.status.is_(None), func.lower(Ticket.status).notin_(CLOSED_STATUSES))))
+        rows = result.all()
+        signatures = await asyncio.to_thread(
+            lambda: [(ticket_id, minhash(ticket_text(subject, message))) for ticket_id, subject, message in rows])
+        self._signatures = {}
+        self._buckets = [defaultdict(set) for _ in range(BANDS)]
+        for ticket_id, signature in signatures:
+            if signature is not None:
+                self.insert(ticket_id, signature)
+        return len(self._signatures)
+
+    async def reload(self):
+        async with SessionLocal() as db:
+            return await self.load(db)
+
+
+duplicate_detector = DuplicateDetector()
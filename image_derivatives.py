@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from attachment_storage import UPLOAD_DIR, content_path
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each derivative
+DERIVATIVE_SIZES = {"thumb": 256, "preview": 1280}
+DERIVATIVE_FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+DERIVATIVE_QUALITY = 80
+IMAGE_CONTENT_TYPES = ("image/png", "image/jpeg", "image/webp", "image/gif", "image/bmp")
+# Refuse decompression bombs; screenshots are far below this
+MAX_IMAGE_PIXELS = 50_000_000
+WORKERS = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", 2))
+
+
+def derivative_path(sha256, size, fmt):
+    return os.path.join(UPLOAD_DIR, "derivatives", sha256[:2], sha256[2:4], f"{sha256}_{size}.{fmt}")
+
+
+def _render(source, target, max_edge, fmt):
+    # Runs in a worker process
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(source) as image:
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if fmt == "jpeg":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            transparent = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if transparent else "RGB")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        image.save(tmp, format=fmt.upper(), quality=DERIVATIVE_QUALITY, optimize=True)
+    os.replace(tmp, target)
+    return target
+
+
+class ImageDerivatives:
+    """Thumbnails and previews rendered in a process pool and cached on disk by content hash.
+
+    Derivatives are scheduled after upload and rendered on demand if missing;
+    concurrent requests for the same derivative share one render.
+    """
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._inflight = {}
+        # Strong references so scheduled renders are not garbage collected mid-flight
+        self._tasks = set()
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def get(self, sha256, size, fmt="webp"):
+        """Path of the derivative, rendering it first if needed."""
+        target = derivative_path(sha256, size, fmt)
+        if await asyncio.to_thread(os.path.exists, target):
+            return target
+        key = (sha256, size, fmt)
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor(), _render, content_path(sha256), target,
+                                          DERIVATIVE_SIZES[size], fmt)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _render_all(self, sha256):
+        for size in DERIVATIVE_SIZES:
+            try:
+                await self.get(sha256, size)
+            except Exception:
+                logger.warning("Could not render %s derivative for %s", size, sha256, exc_info=True)
+                return
+
+    def schedule(self, sha256, content_type):
+        """Pre-render the default derivatives for an image upload in the background."""
+        if (content_type or "").lower() not in IMAGE_CONTENT_TYPES:
+            return None
+        task = asyncio.get_running_loop().create_task(self._render_all(sha256))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+image_derivatives = ImageDerivatives()
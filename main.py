@@ -9,12 +9,27 @@ from models import Base
 from youshop_API.youshop.yshop_models import YShopProduct, YShopOrder, YShopOrderItem, YShopCartItem
 from db import engine
 import asyncio
+import logging
 from youshop_API.youshop.yshop_router import router as yshop_router
 from youshop_API.youshop.yshop_admin_router import router as yshop_admin_router
 from sqlalchemy import text
 from youshop_API.youshop.yshop_controller import get_password_hash
+from sla_scheduler import sla_scheduler
+from activity_log import activity_log
+from audit_trail import audit_trail
+from attachment_storage import UploadSizeLimitMiddleware
+from image_derivatives import image_derivatives
+from bot_responder import bot_responder
+from duplicate_detector import duplicate_detector
+from ticket_triage import ticket_triage
+from assignment_engine import assignment_engine
+from dbactions import ACTIVE_TICKET_PREDICATE
+from youshop_API.youshop.yshop_search import product_search, SEARCH_BACKEND, SEARCH_DOCUMENT_SQL
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Chatbot Cloud Public API")
+app.add_middleware(UploadSizeLimitMiddleware)
 
 
 @app.on_event("startup")
@@ -34,6 +49,21 @@ async def on_startup():
                 """
             )
         )
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE IF EXISTS yshop_products
+                ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc');
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_yshop_products_updated_at ON yshop_products (updated_at);
+                """
+            )
+        )
         # Ensure 'user_id' column exists in yshop_orders
         await conn.execute(
             text(
@@ -67,6 +97,75 @@ async def on_startup():
                 """
             )
         )
+        # Ensure first-response tracking exists on tickets
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE IF EXISTS tickets
+                ADD COLUMN IF NOT EXISTS first_response_at TIMESTAMP;
+                """
+            )
+        )
+        # Breaches are logged even when the ticket's priority matches no SLA policy
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE IF EXISTS sla_logs
+                ALTER COLUMN sla_policy_id DROP NOT NULL;
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_messages_admin_reply
+                ON messages (ticketid, createdat) WHERE isadminreply;
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE IF EXISTS messages
+                ADD COLUMN IF NOT EXISTS bot_confidence DOUBLE PRECISION;
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_tickets_assignedto
+                ON tickets (assignedto) WHERE assignedto IS NOT NULL;
+                """
+            )
+        )
+        # Work queue order over active tickets only; the queue's LIMIT is an ordered index scan
+        # with no sort, fetching just the returned rows from the heap (not an index-only scan)
+        await conn.execute(
+            text(
+                f"""
+                CREATE INDEX IF NOT EXISTS ix_tickets_work_queue
+                ON tickets (current_sla_target, escalation_level DESC NULLS LAST, ticketid)
+                WHERE {ACTIVE_TICKET_PREDICATE};
+                """
+            )
+        )
+        # Backfill first responses for tickets answered before the column existed
+        await conn.execute(
+            text(
+                """
+                UPDATE tickets t
+                SET first_response_at = m.first_response_at
+                FROM (
+                    SELECT ticketid, MIN(createdat) AS first_response_at
+                    FROM messages
+                    WHERE isadminreply
+                    GROUP BY ticketid
+                ) m
+                WHERE t.ticketid = m.ticketid AND t.first_response_at IS NULL;
+                """
+            )
+        )
         # Ensure default YouShop admin user exists
         admin_pw = get_password_hash("password-admin123")
         await conn.execute(
@@ -85,6 +184,49 @@ async def on_startup():
                 "passwordhash": admin_pw,
             }
         )
+    if SEARCH_BACKEND == "pg_trgm":
+        # Needs the pg_trgm extension; its own transaction so a missing privilege does not abort startup
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                await conn.execute(
+                    text(
+                        f"""
+                        CREATE INDEX IF NOT EXISTS ix_yshop_products_search_trgm
+                        ON yshop_products USING gin (({SEARCH_DOCUMENT_SQL}) gin_trgm_ops)
+                        WHERE is_active IS NOT FALSE;
+                        """
+                    )
+                )
+            product_search.trigram_ready = True
+        except Exception:
+            logger.exception("Could not create the pg_trgm product search index")
+    activity_log.start()
+    # Replay audit events spooled before the last shutdown or crash
+    await audit_trail.start()
+    # Load upcoming SLA deadlines and start watching for breaches
+    # Escalated tickets nobody holds yet are routed to an agent
+    sla_scheduler.breach_listeners.append(assignment_engine.assign_many)
+    await sla_scheduler.start()
+    await duplicate_detector.reload()
+    # Trains in the background; until then triage returns no predictions
+    ticket_triage.start()
+    # Auto-answer customer messages off the request path
+    bot_responder.start()
+    # Builds in the background; product search uses plain SQL until it is ready
+    product_search.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await product_search.stop()
+    await bot_responder.stop()
+    await ticket_triage.stop()
+    await sla_scheduler.stop()
+    await audit_trail.stop()
+    image_derivatives.shutdown()
+    # Joining the writer thread flushes queued records off the event loop
+    await asyncio.to_thread(activity_log.stop)
 
 app.include_router(router, prefix="/api")
 app.include_router(admin_router, prefix="/api/admin")
@@ -1,6 +1,6 @@
 
 import uuid
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, Table, UniqueConstraint
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -134,6 +134,8 @@ class Ticket(Base):
     resolution_method = Column(Text, nullable=True)
     bot_attempted = Column(Boolean, nullable=True)
     country = Column(Text, nullable=True)
+    # Time of the first admin reply, maintained by add_ticket_message
+    first_response_at = Column(DateTime, nullable=True)
     category = relationship("Category")
 
 # Ticket Messages Table (messages)
@@ -148,8 +150,45 @@ class TicketMessage(Base):
     isadminreply = Column(Boolean, nullable=True)
     createdat = Column(DateTime, nullable=True)
     isbotresponse = Column(Boolean, nullable=False)
+    bot_confidence = Column(Float, nullable=True)
     ticket = relationship("Ticket")
 
+# Near-duplicate pairs flagged by duplicate_detector when a ticket is created
+
+
+class TicketDuplicateCandidate(Base):
+    __tablename__ = "ticket_duplicate_candidates"
+    __table_args__ = (UniqueConstraint("ticketid", "duplicate_of"),)
+    id = Column(Integer, primary_key=True, index=True)
+    ticketid = Column(Integer, ForeignKey(
+        "tickets.ticketid", ondelete="CASCADE"), nullable=False, index=True)
+    duplicate_of = Column(Integer, ForeignKey(
+        "tickets.ticketid", ondelete="CASCADE"), nullable=False, index=True)
+    similarity = Column(Float, nullable=False)
+    createdat = Column(DateTime, nullable=True)
+
+# Categories an agent is skilled in; tickets go to skilled agents when the team has any
+
+
+class AgentSkill(Base):
+    __tablename__ = "agent_skills"
+    __table_args__ = (UniqueConstraint("userid", "categoryid"),)
+    id = Column(Integer, primary_key=True, index=True)
+    userid = Column(Integer, ForeignKey("users.userid", ondelete="CASCADE"), nullable=False, index=True)
+    categoryid = Column(Integer, ForeignKey("categories.categoryid", ondelete="CASCADE"), nullable=False)
+    level = Column(Integer, nullable=False, default=1)
+
+# One row per team; locked while assigning so workers take turns, and the
+# generation tells a worker whether its in-memory agent loads are current
+
+
+class RoutingLease(Base):
+    __tablename__ = "routing_leases"
+    team = Column(Text, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    holder = Column(Text, nullable=True)
+    updatedat = Column(DateTime, nullable=True)
+
 # Feedback Table
 
 
@@ -162,6 +201,38 @@ class Feedback(Base):
     createdat = Column(DateTime, nullable=True)
     ticket = relationship("Ticket")
 
+# Attachments Table; file content lives in attachment_storage keyed by sha256
+
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    size = Column(Integer, nullable=False)
+    filename = Column(Text, nullable=True)
+    content_type = Column(Text, nullable=True)
+    ticketid = Column(Integer, ForeignKey(
+        "tickets.ticketid", ondelete="CASCADE"), nullable=True, index=True)
+    uploadedby = Column(Integer, ForeignKey("users.userid"), nullable=True)
+    createdat = Column(DateTime, nullable=True)
+
+
+# Resumable upload sessions; data is staged under attachment_storage.session_path(id)
+
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True)
+    userid = Column(Integer, ForeignKey("users.userid"), nullable=False)
+    ticketid = Column(Integer, ForeignKey(
+        "tickets.ticketid", ondelete="CASCADE"), nullable=True)
+    filename = Column(Text, nullable=True)
+    content_type = Column(Text, nullable=True)
+    size = Column(Integer, nullable=False)
+    offset = Column(Integer, nullable=False, default=0)
+    createdat = Column(DateTime, nullable=True)
+    updatedat = Column(DateTime, nullable=True, index=True)
+
 
 class Permission(Base):
     __tablename__ = "permissions"
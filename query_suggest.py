@@ -0,0 +1,201 @@
+import asyncio
+import bisect
+import heapq
+import re
+import time
+from collections import Counter, defaultdict
+from sqlalchemy import select, func
+from models import CommonQuery
+
+# How often the CommonQuery signature is re-checked for changes
+SIGNATURE_CHECK_SECONDS = 30
+DEFAULT_LIMIT = 8
+MATCH_CACHE_SIZE = 10000
+# Prefix terms shorter than this are only matched exactly, not fuzzily
+MIN_FUZZY_LENGTH = 3
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def words(text):
+    return _WORD.findall((text or "").lower())
+
+
+def max_typos(term, prefix=False):
+    if len(term) < MIN_FUZZY_LENGTH:
+        return 0
+    # A word still being typed is too short a context for two typos
+    return 1 if prefix or len(term) <= 5 else 2
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit, prefix=False):
+    """Levenshtein distance between a and b (or the closest prefix of b), capped at limit + 1."""
+    if prefix:
+        b = b[:len(a) + limit]
+    elif abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous) if prefix else previous[-1]
+
+
+class SuggestionIndex:
+    """Immutable word index over CommonQuery questions.
+
+    Every question word points at the questions containing it, and every
+    word is reachable from its trigrams, so a typo only has to be checked
+    against the few words sharing a trigram with it. Complete words match
+    whole words anywhere in a question; the word being typed matches as a
+    prefix.
+    """
+
+    def __init__(self, rows):
+        # rows: (queryid, categoryid, question)
+        self.rows = sorted(rows, key=lambda row: (len(row[2]), row[0]))
+        postings = defaultdict(set)
+        self.by_category = defaultdict(set)
+        for doc, (_, categoryid, question) in enumerate(self.rows):
+            self.by_category[categoryid].add(doc)
+            for word in words(question):
+                postings[word].add(doc)
+        self.postings = {word: frozenset(docs) for word, docs in postings.items()}
+        self.vocabulary = sorted(self.postings)
+        by_trigram = defaultdict(list)
+        for word in self.vocabulary:
+            for gram in trigrams(word):
+                by_trigram[gram].append(word)
+        self.by_trigram = dict(by_trigram)
+        # Each keystroke repeats the words before it, so their matches are kept
+        self._match_cache = {}
+
+    def _prefixed(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff")
+        return self.vocabulary[start:end]
+
+    def _fuzzy_candidates(self, term, prefix, limit):
+        grams = trigrams(term)
+        if prefix:
+            # The typed part has no closing boundary yet
+            grams = {gram for gram in grams if not gram.endswith(" ")}
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.by_trigram.get(gram, ()))
+        # Each edit changes at most three trigrams
+        needed = max(1, len(grams) - 3 * limit)
+        shortest = len(term) - limit
+        longest = None if prefix else len(term) + limit
+        return [word for word, count in shared.items()
+                if count >= needed and len(word) >= shortest and (longest is None or len(word) <= longest)]
+
+    def _matches(self, term, prefix):
+        """word -> typos for the vocabulary words term may stand for."""
+        key = (term, prefix)
+        if key not in self._match_cache:
+            if len(self._match_cache) >= MATCH_CACHE_SIZE:
+                self._match_cache.clear()
+            self._match_cache[key] = self._find_matches(term, prefix)
+        return self._match_cache[key]
+
+    def _find_matches(self, term, prefix):
+        matches = {}
+        if prefix:
+            matches.update((word, 0) for word in self._prefixed(term))
+        elif term in self.postings:
+            matches[term] = 0
+        limit = max_typos(term, prefix)
+        if not limit:
+            return matches
+        for word in self._fuzzy_candidates(term, prefix, limit):
+            if word in matches:
+                continue
+            distance = edit_distance(term, word, limit, prefix)
+            if distance <= limit:
+                matches[word] = distance
+        return matches
+
+    def suggest(self, text, category_id=None, limit=DEFAULT_LIMIT):
+        terms = words(text)
+        if not terms:
+            return []
+        # The last word is still being typed unless the text ends in a separator
+        typing = text[-1:].isalnum()
+        docs = self.by_category.get(category_id, set()) if category_id is not None else None
+        typos = defaultdict(int)
+        for position, term in enumerate(terms):
+            by_distance = defaultdict(list)
+            for word, distance in self._matches(term, typing and position == len(terms) - 1).items():
+                by_distance[distance].append(self.postings[word])
+            matched = set()
+            # A question matched both exactly and with typos counts as exact
+            for distance in sorted(by_distance):
+                found = set().union(*by_distance[distance])
+                if docs is not None:
+                    found &= docs
+                found -= matched
+                if distance:
+                    for doc in found:
+                        typos[doc] += distance
+                matched |= found
+            docs = matched
+            if not docs:
+                return []
+        # Fewest typos first, then shorter questions (rows are sorted by length)
+        ranked = heapq.nsmallest(limit, docs, key=lambda doc: (typos[doc], doc))
+        return [{"query_id": self.rows[doc][0], "category_id": self.rows[doc][1],
+                 "question": self.rows[doc][2]} for doc in ranked]
+
+
+class QuerySuggester:
+    """Keeps a SuggestionIndex current with the commonqueries table.
+
+    A changed table signature triggers a rebuild in a worker thread; the new
+    index replaces the old one in a single assignment, so requests never see
+    a half-built index.
+    """
+
+    def __init__(self):
+        self.index = SuggestionIndex([])
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, db, force=False):
+        if not force and time.monotonic() - self._checked_at < SIGNATURE_CHECK_SECONDS:
+            return self.index
+        async with self._lock:
+            if not force and time.monotonic() - self._checked_at < SIGNATURE_CHECK_SECONDS:
+                return self.index
+            stamp = func.coalesce(CommonQuery.updatedat, CommonQuery.createdat)
+            signature = tuple((await db.execute(
+                select(func.count(CommonQuery.queryid), func.max(stamp),
+                       func.coalesce(func.sum(CommonQuery.queryid), 0))
+            )).one())
+            if signature != self._signature:
+                rows = (await db.execute(
+                    select(CommonQuery.queryid, CommonQuery.categoryid, CommonQuery.question))).all()
+                self.index = await asyncio.to_thread(SuggestionIndex, [tuple(row) for row in rows])
+                self._signature = signature
+            self._checked_at = time.monotonic()
+        return self.index
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    async def suggest(self, db, text, category_id=None, limit=DEFAULT_LIMIT):
+        index = await self.refresh(db)
+        return index.suggest(text, category_id, limit)
+
+
+query_suggester = QuerySuggester()
@@ -1,24 +1,38 @@
 # Imports grouped by type for clarity
-from fastapi import APIRouter, Request, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Request, Response, Depends, HTTPException, UploadFile, File, Query
+from typing import Optional
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from models import User, RolePermission
 from db import get_db
+from sla_scheduler import sla_scheduler
+from duplicate_detector import duplicate_detector
+from assignment_engine import assignment_engine
 from schemas import (
     TicketCreateRequest, TicketMessageRequest, FeedbackRequest,
-    UserRegisterRequest, UserLoginRequest, TokenResponse
+    UserRegisterRequest, UserLoginRequest, TokenResponse, UploadSessionCreate, AnswerRequest, TriageRequest
 )
 
 # Controller imports
 from controller import (
     get_categories_controller,
     get_common_queries_controller,
+    answer_question_controller,
+    suggest_questions_controller,
+    triage_ticket_controller,
     create_ticket_controller,
     get_ticket_details_controller,
     get_ticket_messages_controller,
     add_ticket_message_controller,
     upload_file_controller,
+    get_attachment_controller,
+    get_attachment_derivative_controller,
+    create_upload_session_controller,
+    get_upload_session_controller,
+    append_upload_chunk_controller,
+    finalize_upload_session_controller,
+    delete_upload_session_controller,
     submit_feedback_controller,
     test_database_controller,
     get_users_controller,
@@ -100,6 +114,22 @@ async def get_categories(request: Request, db: AsyncSession = Depends(get_db)):
     return await get_categories_controller(db)
 
 
+@router.post("/common-queries/answer", summary="Suggest answers for a question from common queries", tags=["Categories"])
+async def answer_question(payload: AnswerRequest, db: AsyncSession = Depends(get_db)):
+    return await answer_question_controller(db, payload)
+
+
+# Registered before /common-queries/{category_id} so "suggest" is not taken for an id
+@router.get("/common-queries/suggest", summary="Suggest common questions while typing", tags=["Categories"])
+async def suggest_questions(
+    q: str = Query(..., max_length=200),
+    category_id: Optional[int] = None,
+    limit: int = Query(8, ge=1, le=20),
+    db: AsyncSession = Depends(get_db)
+):
+    return await suggest_questions_controller(db, q, category_id, limit)
+
+
 @router.get("/common-queries/{category_id}", summary="Get common queries for category", tags=["Categories"])
 async def get_common_queries(category_id: int, db: AsyncSession = Depends(get_db)):
     return await get_common_queries_controller(db, category_id)
@@ -119,6 +149,11 @@ async def create_ticket(
     return await create_ticket_controller(db, payload)
 
 
+@router.post("/tickets/triage", summary="Suggest category and priority for a new ticket", tags=["Tickets"])
+async def triage_ticket(payload: TriageRequest, current_user: User = Depends(get_current_user)):
+    return await triage_ticket_controller(payload)
+
+
 @router.get("/tickets/{ticket_id}", summary="Get ticket details", tags=["Tickets"])
 async def get_ticket_details(ticket_id: int, db: AsyncSession = Depends(get_db)):
     return await get_ticket_details_controller(db, ticket_id)
@@ -136,15 +171,24 @@ async def add_ticket_message(ticket_id: int, payload: TicketMessageRequest, db:
 
 @router.delete("/tickets/{ticket_id}", summary="Delete ticket", tags=["Tickets"])
 async def delete_ticket(ticket_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
-    from models import Ticket, TicketMessage, Feedback, TicketStatusLog
+    from models import Ticket, TicketMessage, Feedback, TicketStatusLog, Attachment, UploadSession, TicketDuplicateCandidate
+    from sla_models import SLALog
     await db.execute(TicketMessage.__table__.delete().where(TicketMessage.ticketid == ticket_id))
     await db.execute(Feedback.__table__.delete().where(Feedback.ticketid == ticket_id))
     await db.execute(TicketStatusLog.__table__.delete().where(TicketStatusLog.ticket_id == ticket_id))
+    await db.execute(Attachment.__table__.delete().where(Attachment.ticketid == ticket_id))
+    await db.execute(UploadSession.__table__.delete().where(UploadSession.ticketid == ticket_id))
+    await db.execute(TicketDuplicateCandidate.__table__.delete().where(
+        (TicketDuplicateCandidate.ticketid == ticket_id) | (TicketDuplicateCandidate.duplicate_of == ticket_id)))
+    await db.execute(SLALog.__table__.delete().where(SLALog.ticket_id == ticket_id))
     ticket = (await db.execute(select(Ticket).where(Ticket.ticketid == ticket_id))).scalar_one_or_none()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
     await db.delete(ticket)
     await db.commit()
+    sla_scheduler.discard(ticket_id)
+    duplicate_detector.discard(ticket_id)
+    await assignment_engine.removed(db, ticket)
     return {"message": f"Ticket {ticket_id} and all related data deleted successfully"}
 
 # =====================
@@ -153,8 +197,53 @@ async def delete_ticket(ticket_id: int, db: AsyncSession = Depends(get_db), curr
 
 
 @router.post("/upload", summary="Upload file", tags=["File Upload"])
-async def upload_file(file: UploadFile = File(...)):
-    return await upload_file_controller(file)
+async def upload_file(file: UploadFile = File(...), ticket_id: Optional[int] = None, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await upload_file_controller(db, file, current_user, ticket_id)
+
+
+@router.post("/uploads", status_code=201, summary="Start resumable upload", tags=["File Upload"])
+async def create_upload_session(payload: UploadSessionCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await create_upload_session_controller(db, payload, current_user)
+
+
+@router.head("/uploads/{upload_id}", summary="Get resumable upload offset", tags=["File Upload"])
+async def head_upload_session(upload_id: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    session = await get_upload_session_controller(db, upload_id, current_user)
+    return Response(headers={
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["size"]),
+        "Cache-Control": "no-store"
+    })
+
+
+@router.get("/uploads/{upload_id}", summary="Get resumable upload status", tags=["File Upload"])
+async def get_upload_session(upload_id: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await get_upload_session_controller(db, upload_id, current_user)
+
+
+@router.put("/uploads/{upload_id}", summary="Upload chunk at offset", tags=["File Upload"])
+async def append_upload_chunk(upload_id: str, offset: int, request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await append_upload_chunk_controller(db, upload_id, offset, request.stream(), current_user)
+
+
+@router.post("/uploads/{upload_id}/finalize", summary="Finish resumable upload", tags=["File Upload"])
+async def finalize_upload_session(upload_id: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await finalize_upload_session_controller(db, upload_id, current_user)
+
+
+@router.delete("/uploads/{upload_id}", summary="Cancel resumable upload", tags=["File Upload"])
+async def delete_upload_session(upload_id: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await delete_upload_session_controller(db, upload_id, current_user)
+
+
+@router.get("/attachments/{attachment_id}", summary="Download attachment", tags=["File Upload"])
+async def get_attachment(attachment_id: int, request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await get_attachment_controller(db, attachment_id, current_user, request.headers.get("if-none-match"))
+
+
+@router.get("/attachments/{attachment_id}/{size}", summary="Download image thumbnail or preview", tags=["File Upload"])
+async def get_attachment_derivative(attachment_id: int, size: str, request: Request, format: str = "webp", db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await get_attachment_derivative_controller(db, attachment_id, size, format, current_user, request.headers.get("if-none-match"))
 
 # =====================
 # Feedback
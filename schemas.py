@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
-from typing import Optional
+from typing import Optional, List
 
 # For user registration
 
@@ -55,6 +55,24 @@ class FeedbackRequest(BaseModel):
 # SLA Schemas (merged from sla_schemas.py)
 
 
+class AnswerRequest(BaseModel):
+    text: str = Field(..., min_length=1)
+    category_id: Optional[int] = None
+    top_k: int = Field(3, ge=1, le=20)
+
+
+class TriageRequest(BaseModel):
+    subject: Optional[str] = None
+    message: str
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int = Field(..., gt=0)
+    content_type: Optional[str] = None
+    ticket_id: Optional[int] = None
+
+
 class SLAPolicyBase(BaseModel):
     name: str
     description: Optional[str] = None
@@ -83,8 +101,65 @@ class SLAPolicyOut(SLAPolicyBase):
 class SLAStatusOut(BaseModel):
     ticket_id: int
     sla_policy: Optional[SLAPolicyOut]
-    status: str  # e.g., on track, breached
+    status: str  # on track, met, breached or unknown
     time_left_minutes: Optional[int]
+    breached: bool = False
+    sla_target: Optional[str] = None
+    business_calendar: Optional[str] = None
+    elapsed_minutes: Optional[int] = None
+
+
+class SLABatchStatusRequest(BaseModel):
+    ticket_ids: List[int] = Field(..., min_length=1, max_length=500)
+
+
+class SLABatchStatusOut(BaseModel):
+    statuses: List[SLAStatusOut]
+    not_found: List[int]
+
+
+class SLACalendarBase(BaseModel):
+    name: str
+    sla_policy_id: Optional[int] = None
+    country: Optional[str] = None
+    utc_offset_minutes: int = 0
+    work_start: str = "09:00"
+    work_end: str = "17:00"
+    weekend_days: str = "5,6"  # Monday=0
+    holidays: Optional[str] = None  # comma-separated ISO dates
+
+
+class SLACalendarCreate(SLACalendarBase):
+    pass
+
+
+class SLACalendarUpdate(BaseModel):
+    name: Optional[str] = None
+    sla_policy_id: Optional[int] = None
+    country: Optional[str] = None
+    utc_offset_minutes: Optional[int] = None
+    work_start: Optional[str] = None
+    work_end: Optional[str] = None
+    weekend_days: Optional[str] = None
+    holidays: Optional[str] = None
+
+
+class SLACalendarOut(SLACalendarBase):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+
+class SLASimulationPolicy(BaseModel):
+    name: str
+    resolution_time_minutes: int
+    response_time_minutes: Optional[int] = None
+
+
+class SLASimulationRequest(BaseModel):
+    policies: List[SLASimulationPolicy] = Field(..., min_length=1)
+    curve_points: int = Field(20, ge=2, le=200)
 
 
 class SLAViolationOut(BaseModel):
@@ -92,6 +167,7 @@ class SLAViolationOut(BaseModel):
     user_id: int
     breached_at: str
     sla_policy: Optional[SLAPolicyOut]
+    violation_type: str = "resolution"
 
 
 class SLAReportOut(BaseModel):
@@ -99,3 +175,7 @@ class SLAReportOut(BaseModel):
     tickets_within_sla: int
     tickets_breached: int
     compliance_percentage: float
+    responses_within_sla: Optional[int] = None
+    responses_breached: Optional[int] = None
+    responses_pending: Optional[int] = None
+    response_compliance_percentage: Optional[float] = None
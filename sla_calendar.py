@@ -0,0 +1,165 @@
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from sqlalchemy import select
+from sla_models import SLABusinessCalendar
+
+# Cumulative index starts here and is extended forward on demand
+INDEX_START = date(2000, 1, 1)
+INDEX_GROWTH_DAYS = 366
+CALENDAR_CACHE_TTL_SECONDS = 60
+
+
+def _parse_hhmm(value):
+    hours, minutes = value.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _parse_list(value):
+    return [v.strip() for v in (value or "").replace(";", ",").split(",") if v.strip()]
+
+
+class BusinessCalendar:
+    """Working-hours calendar with O(log n) business-minute arithmetic.
+
+    _cum[i] holds the working minutes between INDEX_START and the start of day i,
+    so converting a timestamp to a business-minute offset is an index lookup and
+    the inverse is a bisect over _cum.
+    """
+
+    def __init__(self, name, work_start="09:00", work_end="17:00", weekend_days=(5, 6),
+                 holidays=(), utc_offset_minutes=0, calendar_id=None):
+        self.calendar_id = calendar_id
+        self.name = name
+        self.work_start = _parse_hhmm(work_start)
+        self.work_end = _parse_hhmm(work_end)
+        if not 0 <= self.work_start < self.work_end <= 24 * 60:
+            raise ValueError("work_end must be after work_start within one day")
+        self.weekend_days = frozenset(int(d) for d in weekend_days)
+        if not self.weekend_days <= set(range(7)) or len(self.weekend_days) == 7:
+            raise ValueError("weekend_days must be weekday numbers 0-6 leaving at least one working day")
+        self.holidays = frozenset(
+            h if isinstance(h, date) else date.fromisoformat(h) for h in holidays)
+        self.utc_offset = timedelta(minutes=utc_offset_minutes or 0)
+        self._cum = [0]
+
+    @classmethod
+    def from_model(cls, calendar):
+        return cls(
+            calendar.name,
+            work_start=calendar.work_start or "09:00",
+            work_end=calendar.work_end or "17:00",
+            weekend_days=_parse_list(calendar.weekend_days),
+            holidays=_parse_list(calendar.holidays),
+            utc_offset_minutes=calendar.utc_offset_minutes,
+            calendar_id=calendar.id
+        )
+
+    def _day_minutes(self, day):
+        if day.weekday() in self.weekend_days or day in self.holidays:
+            return 0
+        return self.work_end - self.work_start
+
+    def _extend(self, day_index):
+        # _cum needs an entry for day_index + 1 (the end of that day)
+        while len(self._cum) <= day_index + 1:
+            day = INDEX_START + timedelta(days=len(self._cum) - 1)
+            for _ in range(INDEX_GROWTH_DAYS):
+                self._cum.append(self._cum[-1] + self._day_minutes(day))
+                day += timedelta(days=1)
+
+    def _offset(self, local):
+        if local.date() < INDEX_START:
+            return 0
+        day_index = (local.date() - INDEX_START).days
+        self._extend(day_index)
+        worked = 0
+        if self._day_minutes(local.date()):
+            minute = local.hour * 60 + local.minute + \
+                (local.second + local.microsecond / 1e6) / 60
+            worked = min(max(minute - self.work_start, 0),
+                         self.work_end - self.work_start)
+        return self._cum[day_index] + worked
+
+    def business_minutes_between(self, start, end):
+        """Working minutes between two naive UTC datetimes (negative if end < start)."""
+        return self._offset(end + self.utc_offset) - self._offset(start + self.utc_offset)
+
+    def add_business_minutes(self, start, minutes):
+        """Naive UTC datetime that lies `minutes` working minutes after start."""
+        if minutes <= 0:
+            return start
+        target = self._offset(start + self.utc_offset) + minutes
+        while self._cum[-1] < target:
+            self._extend(len(self._cum) + INDEX_GROWTH_DAYS)
+        # First day whose end-of-work reaches the target offset
+        day_index = bisect_left(self._cum, target) - 1
+        day = INDEX_START + timedelta(days=day_index)
+        deadline = datetime(day.year, day.month, day.day) + \
+            timedelta(minutes=self.work_start + target - self._cum[day_index])
+        return deadline - self.utc_offset
+
+
+def sla_deadline(start, minutes, calendar=None):
+    if calendar is None:
+        return start + timedelta(minutes=minutes)
+    return calendar.add_business_minutes(start, minutes)
+
+
+def sla_elapsed_minutes(start, end, calendar=None):
+    if calendar is None:
+        return (end - start).total_seconds() / 60
+    return calendar.business_minutes_between(start, end)
+
+
+class BusinessCalendarRegistry:
+    """Compiled SLABusinessCalendar rows; a policy calendar wins over a country calendar."""
+
+    def __init__(self):
+        self._by_policy = None
+        self._by_country = {}
+        self._loaded_at = 0.0
+
+    @property
+    def policy_ids(self):
+        return list(self._by_policy or {})
+
+    @property
+    def countries(self):
+        return list(self._by_country)
+
+    def __bool__(self):
+        return bool(self._by_policy or self._by_country)
+
+    def invalidate(self):
+        self._by_policy = None
+        self._by_country = {}
+
+    async def load(self, db):
+        if self._by_policy is not None and time.monotonic() - self._loaded_at < CALENDAR_CACHE_TTL_SECONDS:
+            return self
+        result = await db.execute(select(SLABusinessCalendar))
+        by_policy, by_country = {}, {}
+        for row in result.scalars().all():
+            calendar = BusinessCalendar.from_model(row)
+            if row.sla_policy_id is not None:
+                by_policy[row.sla_policy_id] = calendar
+            elif row.country:
+                by_country[normalize_country(row.country)] = calendar
+        self._by_policy = by_policy
+        self._by_country = by_country
+        self._loaded_at = time.monotonic()
+        return self
+
+    def for_ticket(self, sla_policy_id, country):
+        calendar = (self._by_policy or {}).get(sla_policy_id)
+        if calendar is None and country:
+            calendar = self._by_country.get(normalize_country(country))
+        return calendar
+
+
+def normalize_country(country):
+    return (country or "").strip().lower()
+
+
+business_calendars = BusinessCalendarRegistry()
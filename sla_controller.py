@@ -1,45 +1,91 @@
+import csv
+import io
+import json
 import math
-import os
-from sla_models import SLAPolicy
-from sqlalchemy import select
+from sla_models import SLAPolicy, SLAAlignmentJob, SLABusinessCalendar
+from sqlalchemy import select, update, func, distinct, values, column, or_, and_, false, Integer, Text
 from fastapi import HTTPException
 from datetime import datetime, timedelta
 from models import Ticket
+from db import SessionLocal
 from dbactions import get_sla_policies, create_sla_policy, update_sla_policy
+from sla_scheduler import sla_scheduler, CLOSED_STATUSES
+from sla_resolver import PRIORITY_LEVELS, sla_policy_resolver, normalize_priority
+from sla_calendar import BusinessCalendar, business_calendars, sla_deadline, sla_elapsed_minutes
+from sla_simulator import simulate_sla_policies
+
+# Tickets realigned per UPDATE/commit in update_all_tickets_sla_alignment
+ALIGNMENT_CHUNK_SIZE = 5000
 # Utility: Match ticket priority to SLA policy (shared logic)
 
 
 async def match_ticket_to_sla_policy(db, ticket_priority):
-    from sla_models import SLAPolicy
-    from sqlalchemy import select
-    policy_result = await db.execute(select(SLAPolicy))
-    all_policies = policy_result.scalars().all()
-    sla_policies = {str(p.name).strip().lower(): p for p in all_policies}
-    ticket_priority_normalized = (ticket_priority or '').strip().lower()
-    matched_sla_name = None
-    sla_policy = None
-    if ticket_priority_normalized in sla_policies:
-        sla_policy = sla_policies[ticket_priority_normalized]
-        matched_sla_name = sla_policy.name
-    else:
-        for env_key, env_value in PRIORITY_LEVELS.items():
-            if ticket_priority_normalized == env_value:
-                if env_key in sla_policies:
-                    sla_policy = sla_policies[env_key]
-                    matched_sla_name = sla_policy.name
-                    break
-        if not sla_policy:
-            for key, policy in sla_policies.items():
-                if key in ticket_priority_normalized or ticket_priority_normalized in key:
-                    sla_policy = policy
-                    matched_sla_name = policy.name
-                    break
-        if not sla_policy and sla_policies:
-            sla_policy = sla_policies.get(
-                "default sla") or list(sla_policies.values())[0]
-            matched_sla_name = sla_policy.name if hasattr(
-                sla_policy, "name") else sla_policy.get("name")
-    return sla_policy, matched_sla_name
+    return await sla_policy_resolver.match(db, ticket_priority)
+
+
+def _priority_key():
+    # normalize_priority() evaluated in SQL
+    return func.lower(func.trim(func.coalesce(Ticket.priority, "")))
+
+
+def _minutes_between(start, end):
+    return func.extract("epoch", end - start) / 60
+
+
+def _within_resolution_sla(mapping):
+    # updatedat stands in for the resolution time
+    return and_(
+        Ticket.createdat.isnot(None),
+        Ticket.updatedat.isnot(None),
+        mapping.c.sla_minutes > 0,
+        _minutes_between(Ticket.createdat,
+                         Ticket.updatedat) <= mapping.c.sla_minutes
+    )
+
+
+def _response_overdue(mapping, now):
+    # Unanswered tickets are measured up to now
+    return and_(
+        Ticket.createdat.isnot(None),
+        mapping.c.response_minutes > 0,
+        _minutes_between(Ticket.createdat, func.coalesce(
+            Ticket.first_response_at, now)) > mapping.c.response_minutes
+    )
+
+
+def _has_calendar(mapping):
+    # Tickets whose SLA clock runs on a business calendar instead of wall-clock time
+    clauses = []
+    if business_calendars.policy_ids:
+        clauses.append(mapping.c.sla_id.in_(business_calendars.policy_ids))
+    if business_calendars.countries:
+        # coalesce keeps NOT _has_calendar() true for tickets without a country
+        clauses.append(func.lower(func.trim(func.coalesce(Ticket.country, ""))).in_(
+            business_calendars.countries))
+    return or_(*clauses) if clauses else false()
+
+
+async def sla_priority_mapping(db):
+    """VALUES relation mapping each distinct ticket priority to its SLA policy, or None."""
+    await sla_policy_resolver.load(db)
+    await business_calendars.load(db)
+    result = await db.execute(select(distinct(_priority_key())))
+    rows = []
+    for (priority,) in result.all():
+        sla_policy, matched_sla_name = sla_policy_resolver.resolve(priority)
+        if sla_policy:
+            rows.append((priority, sla_policy.sla_id, matched_sla_name,
+                         sla_policy.response_time_minutes, sla_policy.resolution_time_minutes))
+    if not rows:
+        return None
+    return values(
+        column("priority", Text),
+        column("sla_id", Integer),
+        column("matched_sla_name", Text),
+        column("response_minutes", Integer),
+        column("sla_minutes", Integer),
+        name="sla_priority_map"
+    ).data(rows)
 
 
 def to_dict(obj):
@@ -54,100 +100,126 @@ def to_dict(obj):
     return obj
 
 
-# Get priority levels from environment variables
-PRIORITY_LEVELS = {
-    "critical": os.getenv("PRIORITY_LEVEL_0", "critical").lower(),
-    "high": os.getenv("PRIORITY_LEVEL_1", "high").lower(),
-    "medium": os.getenv("PRIORITY_LEVEL_2", "medium").lower(),
-    "low": os.getenv("PRIORITY_LEVEL_3", "low").lower(),
-}
-
 # SLA Controllers
 
 
-async def update_all_tickets_sla_alignment(db):
-    """Update all existing tickets to align with proper SLA assignment logic"""
-    tickets_result = await db.execute(select(Ticket))
-    tickets = tickets_result.scalars().all()
-
-    policy_result = await db.execute(select(SLAPolicy))
-    all_policies = policy_result.scalars().all()
-    # Create case-insensitive mapping
-    sla_policies = {}
-    for p in all_policies:
-        policy_name = str(p.name).strip().lower()
-        sla_policies[policy_name] = p
-
-    if not sla_policies:
+async def update_all_tickets_sla_alignment(db, job_id=None):
+    """Realign current_sla_target for all tickets in resumable id-range chunks"""
+    mapping = await sla_priority_mapping(db)
+    if not sla_policy_resolver.policies:
         return {"error": "No SLA policies found"}
 
-    updated_count = 0
-    alignment_report = []
-
-    for ticket in tickets:
-        ticket_priority = (ticket.priority or "").strip().lower()
-        old_sla_target = ticket.current_sla_target
-
-        # Apply same logic as get_ticket_sla_status_controller
-        matched_sla_name = None
-        sla_policy = None
-
-        # First try exact match with ticket priority
-        if ticket_priority in sla_policies:
-            sla_policy = sla_policies[ticket_priority]
-            matched_sla_name = sla_policy.name
-        else:
-            # Try mapping from env variables and check if SLA policy exists
-            for env_key, env_value in PRIORITY_LEVELS.items():
-                if ticket_priority == env_value:
-                    # Look for SLA policy with this name (case insensitive)
-                    if env_key in sla_policies:
-                        sla_policy = sla_policies[env_key]
-                        matched_sla_name = sla_policy.name
-                        break
-
-            # If still no match, try partial matching on policy names
-            if not sla_policy:
-                for key, policy in sla_policies.items():
-                    if key in ticket_priority or ticket_priority in key:
-                        sla_policy = policy
-                        matched_sla_name = policy.name
-                        break
-
-            # Final fallback to default
-            if not sla_policy:
-                sla_policy = sla_policies.get(
-                    "default sla") or list(sla_policies.values())[0]
-                matched_sla_name = sla_policy.name if hasattr(
-                    sla_policy, "name") else sla_policy.get("name")
-
-        # Calculate new SLA target time
-        if ticket.createdat and sla_policy:
-            new_sla_target = ticket.createdat + \
-                timedelta(minutes=sla_policy.resolution_time_minutes)
-            ticket.current_sla_target = new_sla_target
-            updated_count += 1
-
-            alignment_report.append({
-                "ticket_id": ticket.ticketid,
-                "subject": ticket.subject,
-                "priority": ticket.priority,
-                "matched_sla": matched_sla_name,
-                "sla_minutes": sla_policy.resolution_time_minutes,
-                "old_sla_target": str(old_sla_target) if old_sla_target else None,
-                "new_sla_target": str(new_sla_target)
-            })
-
-    await db.commit()
-
+    if job_id is not None:
+        job = await db.get(SLAAlignmentJob, job_id)
+        if not job:
+            raise HTTPException(
+                status_code=404, detail="SLA alignment job not found")
+    else:
+        max_ticket_id = (await db.execute(select(func.max(Ticket.ticketid)))).scalar()
+        job = SLAAlignmentJob(status="running", cursor=0, max_ticket_id=max_ticket_id or 0,
+                              updated_count=0, started_at=datetime.utcnow())
+        db.add(job)
+        await db.commit()
+
+    while job.status == "running" and job.cursor < job.max_ticket_id:
+        upper = min(job.cursor + ALIGNMENT_CHUNK_SIZE, job.max_ticket_id)
+        if mapping is not None:
+            in_chunk = (Ticket.ticketid > job.cursor, Ticket.ticketid <= upper,
+                        Ticket.createdat.isnot(None))
+            result = await db.execute(
+                update(Ticket)
+                .where(
+                    *in_chunk,
+                    _priority_key() == mapping.c.priority,
+                    ~_has_calendar(mapping)
+                )
+                .values(current_sla_target=Ticket.createdat +
+                        func.make_interval(0, 0, 0, 0, 0, mapping.c.sla_minutes))
+                .execution_options(synchronize_session=False)
+            )
+            job.updated_count += result.rowcount
+            if business_calendars:
+                job.updated_count += await _align_calendar_tickets(db, mapping, in_chunk)
+        # Chunk and cursor commit together so a failed run resumes where it stopped
+        job.cursor = upper
+        await db.commit()
+
+    if job.status == "running":
+        job.status = "completed"
+        job.finished_at = datetime.utcnow()
+        await db.commit()
+        await sla_scheduler.reload()
+
+    total_tickets = (await db.execute(select(func.count(Ticket.ticketid)))).scalar_one()
     return {
-        "message": f"Successfully updated SLA alignment for {updated_count} tickets",
-        "updated_count": updated_count,
-        "total_tickets": len(tickets),
-        "alignment_report": alignment_report
+        "message": f"Successfully updated SLA alignment for {job.updated_count} tickets",
+        "job_id": job.id,
+        "status": job.status,
+        "cursor": job.cursor,
+        "updated_count": job.updated_count,
+        "total_tickets": total_tickets,
+        "report_url": "/api/sla/align-tickets/report"
     }
 
 
+async def _align_calendar_tickets(db, mapping, in_chunk):
+    result = await db.execute(
+        select(Ticket.ticketid, Ticket.createdat, Ticket.country,
+               mapping.c.sla_id, mapping.c.sla_minutes)
+        .join(mapping, _priority_key() == mapping.c.priority)
+        .where(*in_chunk, _has_calendar(mapping))
+    )
+    targets = [
+        {
+            "ticketid": row.ticketid,
+            "current_sla_target": sla_deadline(row.createdat, row.sla_minutes,
+                                               business_calendars.for_ticket(row.sla_id, row.country))
+        }
+        for row in result.all()
+    ]
+    if targets:
+        # ORM bulk UPDATE by primary key (executemany)
+        await db.execute(update(Ticket), targets)
+    return len(targets)
+
+
+async def stream_sla_alignment_report():
+    """Yield the per-ticket alignment report as CSV; runs in its own session."""
+    async with SessionLocal() as db:
+        mapping = await sla_priority_mapping(db)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["ticket_id", "subject", "priority", "matched_sla",
+                         "sla_minutes", "current_sla_target", "expected_sla_target", "aligned"])
+        yield buffer.getvalue()
+        if mapping is None:
+            return
+        expected_sla_target = Ticket.createdat + \
+            func.make_interval(0, 0, 0, 0, 0, mapping.c.sla_minutes)
+        rows = await db.stream(
+            select(Ticket.ticketid, Ticket.subject, Ticket.priority, mapping.c.matched_sla_name,
+                   mapping.c.sla_minutes, Ticket.current_sla_target, Ticket.createdat,
+                   Ticket.country, mapping.c.sla_id,
+                   expected_sla_target.label("expected_sla_target"))
+            .join(mapping, _priority_key() == mapping.c.priority, isouter=True)
+            .order_by(Ticket.ticketid)
+            .execution_options(yield_per=1000)
+        )
+        async for partition in rows.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            for row in partition:
+                expected = row.expected_sla_target
+                calendar = business_calendars.for_ticket(row.sla_id, row.country)
+                if calendar and row.createdat and row.sla_minutes is not None:
+                    expected = calendar.add_business_minutes(
+                        row.createdat, row.sla_minutes)
+                writer.writerow([row.ticketid, row.subject, row.priority, row.matched_sla_name,
+                                 row.sla_minutes, row.current_sla_target, expected,
+                                 row.current_sla_target is not None and row.current_sla_target == expected])
+            yield buffer.getvalue()
+
+
 async def get_sla_policies_controller(db):
     result = await db.execute(select(SLAPolicy))
     return result.scalars().all()
@@ -158,6 +230,7 @@ async def create_sla_policy_controller(sla, db):
     db.add(new_policy)
     await db.commit()
     await db.refresh(new_policy)
+    sla_policy_resolver.invalidate()
     return new_policy
 
 
@@ -171,253 +244,342 @@ async def update_sla_policy_controller(sla_id, sla, db):
         setattr(policy, key, value)
     await db.commit()
     await db.refresh(policy)
+    sla_policy_resolver.invalidate()
 
     return policy
 
 
+async def simulate_sla_policies_controller(payload, db):
+    result = await db.execute(select(SLAPolicy))
+    return await simulate_sla_policies(payload.policies, result.scalars().all(), payload.curve_points)
+
+
+def _ticket_sla_status(ticket, sla_policy, now):
+    created = ticket.createdat
+    calendar = business_calendars.for_ticket(
+        sla_policy.sla_id if sla_policy else None, ticket.country)
+    sla_target = ticket.current_sla_target
+    if sla_target is None and created and sla_policy:
+        sla_target = sla_deadline(
+            created, sla_policy.resolution_time_minutes, calendar)
+    # Closed tickets stop the clock at their last update
+    closed = (ticket.status or "").strip().lower() in CLOSED_STATUSES
+    end = (ticket.updatedat or now) if closed else now
+    breached = sla_target is not None and end > sla_target
+    if sla_target is None:
+        status = "unknown"
+    elif breached:
+        status = "breached"
+    else:
+        status = "met" if closed else "on track"
+    return {
+        "ticket_id": ticket.ticketid,
+        "sla_policy": to_dict(sla_policy),
+        "status": status,
+        "breached": breached,
+        "sla_target": str(sla_target) if sla_target else None,
+        "business_calendar": calendar.name if calendar else None,
+        "elapsed_minutes": math.floor(sla_elapsed_minutes(created, end, calendar)) if created else None,
+        "time_left_minutes": math.floor(sla_elapsed_minutes(end, sla_target, calendar)) if sla_target else None
+    }
+
+
+async def get_tickets_sla_status_controller(ticket_ids, db, user_id=None):
+    """SLA status for many tickets in one query; user_id restricts to that user's tickets."""
+    await sla_policy_resolver.load(db)
+    await business_calendars.load(db)
+    if not sla_policy_resolver.policies:
+        raise HTTPException(status_code=404, detail="No SLA policies found")
+    query = select(Ticket.ticketid, Ticket.priority, Ticket.status, Ticket.createdat, Ticket.updatedat,
+                   Ticket.current_sla_target, Ticket.country).where(Ticket.ticketid.in_(ticket_ids))
+    if user_id is not None:
+        query = query.where(Ticket.userid == user_id)
+    tickets = (await db.execute(query)).all()
+    now = datetime.utcnow()
+    policies = {}
+    statuses = []
+    for ticket in tickets:
+        if ticket.priority not in policies:
+            policies[ticket.priority] = sla_policy_resolver.resolve(ticket.priority)[0]
+        statuses.append(_ticket_sla_status(
+            ticket, policies[ticket.priority], now))
+    found = {ticket.ticketid for ticket in tickets}
+    return {
+        "statuses": statuses,
+        "not_found": [ticket_id for ticket_id in dict.fromkeys(ticket_ids) if ticket_id not in found]
+    }
+
+
 async def get_ticket_sla_status_controller(ticket_id, db):
     result = await db.execute(select(Ticket).where(Ticket.ticketid == ticket_id))
     ticket = result.scalar_one_or_none()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    policy_result = await db.execute(select(SLAPolicy))
-    all_policies = policy_result.scalars().all()
-    # Create case-insensitive mapping
-    sla_policies = {}
-    for p in all_policies:
-        policy_name = str(p.name).strip().lower()
-        sla_policies[policy_name] = p
-
-    if not sla_policies:
+    await sla_policy_resolver.load(db)
+    await business_calendars.load(db)
+    if not sla_policy_resolver.policies:
         raise HTTPException(status_code=404, detail="No SLA policies found")
-    created = ticket.createdat
-    ticket_priority = (ticket.priority or "").strip().lower()
+    sla_policy, matched_sla_name = sla_policy_resolver.resolve(ticket.priority)
+    sla_status = _ticket_sla_status(ticket, sla_policy, datetime.utcnow())
+    sla_status["debug"] = {
+        "createdat": str(ticket.createdat),
+        "ticket_priority": ticket.priority,
+        "normalized_priority": normalize_priority(ticket.priority),
+        "available_sla_priorities": list(sla_policy_resolver.policies.keys()),
+        "env_priority_levels": PRIORITY_LEVELS,
+        "matched_sla_name": matched_sla_name
+    }
+    return sla_status
 
-    # Map ticket priority to SLA policy using environment variables
-    matched_sla_name = None
-    sla_policy = None
-    debug_priorities = list(sla_policies.keys())
 
-    # First try exact match with ticket priority
-    if ticket_priority in sla_policies:
-        sla_policy = sla_policies[ticket_priority]
-        matched_sla_name = sla_policy.name
-    else:
-        # Try mapping from env variables and check if SLA policy exists
-        for env_key, env_value in PRIORITY_LEVELS.items():
-            if ticket_priority == env_value:
-                # Look for SLA policy with this name (case insensitive)
-                if env_key in sla_policies:
-                    sla_policy = sla_policies[env_key]
-                    matched_sla_name = sla_policy.name
-                    break
-
-        # If still no match, try partial matching on policy names
-        if not sla_policy:
-            for key, policy in sla_policies.items():
-                if key in ticket_priority or ticket_priority in key:
-                    sla_policy = policy
-                    matched_sla_name = policy.name
-                    break
-
-        # Final fallback to default
-        if not sla_policy:
-            sla_policy = sla_policies.get(
-                "default sla") or list(sla_policies.values())[0]
-            matched_sla_name = sla_policy.name if hasattr(
-                sla_policy, "name") else sla_policy.get("name")
-
-    status = "on track"
-    time_left = sla_policy.resolution_time_minutes if hasattr(
-        sla_policy, "resolution_time_minutes") else sla_policy.get("resolution_time_minutes")
-    sla_policy_dict = to_dict(sla_policy)
-    return {
-        "ticket_id": ticket.ticketid,
-        "sla_policy": sla_policy_dict,
-        "status": status,
-        "time_left_minutes": time_left,
-        "debug": {
-            "createdat": str(created),
-            "ticket_priority": ticket.priority,
-            "normalized_priority": ticket_priority,
-            "available_sla_priorities": debug_priorities,
-            "env_priority_levels": PRIORITY_LEVELS,
-            "matched_sla_name": matched_sla_name
-        }
-    }
+def _calendar_within_sla(row, end, sla_minutes):
+    """Re-check a wall-clock breach on the ticket's business calendar, if it has one."""
+    calendar = business_calendars.for_ticket(row.sla_id, row.country)
+    if calendar is None:
+        return False, None
+    elapsed = calendar.business_minutes_between(row.createdat, end)
+    return elapsed <= sla_minutes, elapsed
 
 
-async def get_sla_violations_controller(db):
-    from sla_models import SLAPolicy
-    from datetime import datetime, timedelta
-    from models import Ticket
-    ticket_result = await db.execute(select(Ticket))
-    tickets = ticket_result.scalars().all()
-    sla_policy_result = await db.execute(select(SLAPolicy))
-    all_policies = sla_policy_result.scalars().all()
-    # Create case-insensitive mapping
-    sla_policies = {}
-    for p in all_policies:
-        policy_name = str(p.name).strip().lower()
-        sla_policies[policy_name] = p
+async def _response_violations(db, mapping, limit, after_ticket_id):
+    now = datetime.utcnow()
+    result = await db.stream(
+        select(Ticket.ticketid, Ticket.userid, Ticket.createdat, Ticket.first_response_at,
+               Ticket.country, mapping.c.sla_id, mapping.c.response_minutes)
+        .join(mapping, _priority_key() == mapping.c.priority)
+        .where(
+            Ticket.ticketid > after_ticket_id,
+            Ticket.userid.isnot(None),
+            _response_overdue(mapping, now)
+        )
+        .order_by(Ticket.ticketid)
+        .execution_options(yield_per=limit)
+    )
+    policies = {p.sla_id: p for p in sla_policy_resolver.policies.values()}
     violations = []
-    for ticket in tickets:
-        if not ticket.userid:
+    async for row in result:
+        if _calendar_within_sla(row, row.first_response_at or now, row.response_minutes)[0]:
             continue
-        created = ticket.createdat
-        resolved = getattr(ticket, "end_date", None) or getattr(
-            ticket, "updatedat", None)
-        ticket_priority = (ticket.priority or "").strip().lower()
-        matched_sla_name = None
-        sla_policy = None
-        # First try exact match with ticket priority
-        if ticket_priority in sla_policies:
-            sla_policy = sla_policies[ticket_priority]
-            matched_sla_name = sla_policy.name
-        else:
-            for env_key, env_value in PRIORITY_LEVELS.items():
-                if ticket_priority == env_value:
-                    if env_key in sla_policies:
-                        sla_policy = sla_policies[env_key]
-                        matched_sla_name = sla_policy.name
-                        break
-            if not sla_policy:
-                for key, policy in sla_policies.items():
-                    if key in ticket_priority or ticket_priority in key:
-                        sla_policy = policy
-                        matched_sla_name = policy.name
-                        break
-            if not sla_policy:
-                sla_policy = sla_policies.get(
-                    "default sla") or list(sla_policies.values())[0]
-                matched_sla_name = sla_policy.name if hasattr(
-                    sla_policy, "name") else sla_policy.get("name")
-        sla_minutes = sla_policy.resolution_time_minutes if hasattr(
-            sla_policy, "resolution_time_minutes") else sla_policy.get("resolution_time_minutes")
-        if not created or not resolved or not sla_policy:
+        calendar = business_calendars.for_ticket(row.sla_id, row.country)
+        breached_at = row.first_response_at or sla_deadline(
+            row.createdat, row.response_minutes, calendar)
+        violations.append({
+            "ticket_id": row.ticketid,
+            "user_id": row.userid,
+            "breached_at": str(breached_at),
+            "sla_policy": to_dict(policies.get(row.sla_id)),
+            "violation_type": "response"
+        })
+        if len(violations) >= limit:
+            break
+    await result.close()
+    return violations
+
+
+async def get_sla_violations_controller(db, limit=100, after_ticket_id=0, violation_type="resolution"):
+    mapping = await sla_priority_mapping(db)
+    if mapping is None:
+        return []
+    if violation_type == "response":
+        return await _response_violations(db, mapping, limit, after_ticket_id)
+    time_to_resolve = _minutes_between(Ticket.createdat, Ticket.updatedat)
+    # Business time never exceeds wall-clock time, so a wall-clock breach is a
+    # necessary condition; calendar tickets are then confirmed in Python
+    result = await db.stream(
+        select(Ticket.ticketid, Ticket.userid, Ticket.createdat, Ticket.updatedat,
+               Ticket.country, mapping.c.sla_id, mapping.c.sla_minutes)
+        .join(mapping, _priority_key() == mapping.c.priority)
+        .where(
+            Ticket.ticketid > after_ticket_id,
+            Ticket.userid.isnot(None),
+            Ticket.createdat.isnot(None),
+            Ticket.updatedat.isnot(None),
+            or_(mapping.c.sla_minutes <= 0,
+                time_to_resolve > mapping.c.sla_minutes)
+        )
+        .order_by(Ticket.ticketid)
+        .execution_options(yield_per=limit)
+    )
+    policies = {p.sla_id: p for p in sla_policy_resolver.policies.values()}
+    violations = []
+    async for row in result:
+        if row.sla_minutes > 0 and _calendar_within_sla(row, row.updatedat, row.sla_minutes)[0]:
             continue
-        time_to_resolve = (resolved - created).total_seconds() / 60
-        within_sla = time_to_resolve <= sla_minutes if sla_minutes else False
-        if not within_sla:
-            violations.append({
-                "ticket_id": ticket.ticketid,
-                "user_id": ticket.userid,
-                "breached_at": str(resolved),
-                "sla_policy": {
-                    "sla_id": sla_policy.sla_id,
-                    "name": sla_policy.name,
-                    "description": sla_policy.description,
-                    "response_time_minutes": sla_policy.response_time_minutes,
-                    "resolution_time_minutes": sla_policy.resolution_time_minutes
-                }
-            })
+        violations.append({
+            "ticket_id": row.ticketid,
+            "user_id": row.userid,
+            "breached_at": str(row.updatedat),
+            "sla_policy": to_dict(policies.get(row.sla_id)),
+            "violation_type": "resolution"
+        })
+        if len(violations) >= limit:
+            break
+    await result.close()
     return violations
 
 
 async def get_sla_report_controller(db):
-    tickets_result = await db.execute(select(Ticket))
-    tickets = tickets_result.scalars().all()
-    sla_policy_result = await db.execute(select(SLAPolicy))
-    all_policies = sla_policy_result.scalars().all()
-    sla_policies = {}
-    for p in all_policies:
-        policy_name = str(p.name).strip().lower()
-        sla_policies[policy_name] = p
-    if not sla_policies:
+    mapping = await sla_priority_mapping(db)
+    if not sla_policy_resolver.policies:
         return {
             "error": "No SLA policies found. Please create SLA policies for each priority.",
             "total_tickets": 0,
             "tickets_within_sla": 0,
             "tickets_breached": 0,
-            "compliance_percentage": 0.0,
-            "details": []
+            "compliance_percentage": 0.0
         }
+    total_tickets = 0
     tickets_within_sla = 0
-    tickets_breached = 0
-    details = []
-    now = datetime.utcnow()
-    for ticket in tickets:
-        created = ticket.createdat
-        resolved = getattr(ticket, "end_date", None) or getattr(
-            ticket, "updatedat", None)
-        ticket_priority = (ticket.priority or "").strip().lower()
-        matched_sla_name = None
-        sla_policy = None
-        if ticket_priority in sla_policies:
-            sla_policy = sla_policies[ticket_priority]
-            matched_sla_name = sla_policy.name
-        else:
-            for env_key, env_value in PRIORITY_LEVELS.items():
-                if ticket_priority == env_value:
-                    if env_key in sla_policies:
-                        sla_policy = sla_policies[env_key]
-                        matched_sla_name = sla_policy.name
-                        break
-            if not sla_policy:
-                for key, policy in sla_policies.items():
-                    if key in ticket_priority or ticket_priority in key:
-                        sla_policy = policy
-                        matched_sla_name = policy.name
-                        break
-            if not sla_policy:
-                sla_policy = sla_policies.get(
-                    "default sla") or list(sla_policies.values())[0]
-                matched_sla_name = sla_policy.name if hasattr(
-                    sla_policy, "name") else sla_policy.get("name")
-        sla_minutes = sla_policy.resolution_time_minutes if hasattr(
-            sla_policy, "resolution_time_minutes") else sla_policy.get("resolution_time_minutes")
-        if not created or not resolved or not sla_policy:
-            details.append({
-                "ticketid": ticket.ticketid,
-                "subject": ticket.subject,
-                "status": ticket.status,
-                "priority": ticket.priority,
-                "createdat": str(created),
-                "resolvedat": str(resolved) if resolved else None,
-                "time_to_resolve_minutes": None,
-                "sla_minutes": sla_minutes,
-                "within_sla": False,
-                "debug": {
-                    "ticket_priority": ticket.priority,
-                    "normalized_priority": ticket_priority,
-                    "available_sla_priorities": list(sla_policies.keys()),
-                    "env_priority_levels": PRIORITY_LEVELS,
-                    "matched_sla_name": matched_sla_name
-                }
-            })
-            tickets_breached += 1
-            continue
-        time_to_resolve = (resolved - created).total_seconds() / 60
-        within_sla = time_to_resolve <= sla_minutes if sla_minutes else False
-        if within_sla:
-            tickets_within_sla += 1
-        else:
-            tickets_breached += 1
-        details.append({
-            "ticketid": ticket.ticketid,
-            "subject": ticket.subject,
-            "status": ticket.status,
-            "priority": ticket.priority,
-            "createdat": str(created),
-            "resolvedat": str(resolved),
-            "time_to_resolve_minutes": math.ceil(time_to_resolve),
-            "sla_minutes": sla_minutes,
-            "within_sla": within_sla,
-            "debug": {
-                "ticket_priority": ticket.priority,
-                "normalized_priority": ticket_priority,
-                "available_sla_priorities": list(sla_policies.keys()),
-                "env_priority_levels": PRIORITY_LEVELS,
-                "matched_sla_name": matched_sla_name
-            }
-        })
-    total_tickets = len(tickets)
+    responses_within_sla = responses_breached = responses_pending = 0
+    if mapping is not None:
+        now = datetime.utcnow()
+        within_sla = _within_resolution_sla(mapping)
+        response_overdue = _response_overdue(mapping, now)
+        has_response_sla = and_(Ticket.createdat.isnot(None), mapping.c.response_minutes > 0)
+        result = await db.execute(
+            select(func.count(Ticket.ticketid),
+                   func.count(Ticket.ticketid).filter(within_sla),
+                   func.count(Ticket.ticketid).filter(
+                       has_response_sla, Ticket.first_response_at.isnot(None), ~response_overdue),
+                   func.count(Ticket.ticketid).filter(response_overdue),
+                   func.count(Ticket.ticketid).filter(
+                       has_response_sla, Ticket.first_response_at.is_(None), ~response_overdue))
+            .join(mapping, _priority_key() == mapping.c.priority, isouter=True)
+        )
+        (total_tickets, tickets_within_sla, responses_within_sla,
+         responses_breached, responses_pending) = result.one()
+        if business_calendars:
+            # Only wall-clock breaches can turn into business-hours compliance
+            rows = await db.stream(
+                select(Ticket.createdat, Ticket.updatedat, Ticket.country,
+                       mapping.c.sla_id, mapping.c.sla_minutes)
+                .join(mapping, _priority_key() == mapping.c.priority)
+                .where(_has_calendar(mapping), Ticket.createdat.isnot(None),
+                       Ticket.updatedat.isnot(None), mapping.c.sla_minutes > 0, ~within_sla)
+                .execution_options(yield_per=1000)
+            )
+            async for row in rows:
+                if _calendar_within_sla(row, row.updatedat, row.sla_minutes)[0]:
+                    tickets_within_sla += 1
+            rows = await db.stream(
+                select(Ticket.createdat, Ticket.first_response_at, Ticket.country,
+                       mapping.c.sla_id, mapping.c.response_minutes)
+                .join(mapping, _priority_key() == mapping.c.priority)
+                .where(_has_calendar(mapping), response_overdue)
+                .execution_options(yield_per=1000)
+            )
+            async for row in rows:
+                if _calendar_within_sla(row, row.first_response_at or now, row.response_minutes)[0]:
+                    responses_breached -= 1
+                    if row.first_response_at:
+                        responses_within_sla += 1
+                    else:
+                        responses_pending += 1
     compliance_percentage = (tickets_within_sla /
                              total_tickets * 100) if total_tickets > 0 else 0.0
+    # Unanswered tickets still inside their response window are not yet met or breached
+    responses_due = responses_within_sla + responses_breached
+    response_compliance_percentage = (responses_within_sla /
+                                      responses_due * 100) if responses_due > 0 else 0.0
     return {
         "total_tickets": total_tickets,
         "tickets_within_sla": tickets_within_sla,
-        "tickets_breached": tickets_breached,
+        "tickets_breached": total_tickets - tickets_within_sla,
         "compliance_percentage": round(compliance_percentage, 2),
-        "details": details
+        "responses_within_sla": responses_within_sla,
+        "responses_breached": responses_breached,
+        "responses_pending": responses_pending,
+        "response_compliance_percentage": round(response_compliance_percentage, 2)
     }
+
+
+async def stream_sla_report_details(limit=1000, after_ticket_id=0, debug=False):
+    """Yield one JSON line per ticket; runs in its own session since it outlives the request."""
+    async with SessionLocal() as db:
+        mapping = await sla_priority_mapping(db)
+        if mapping is None:
+            return
+        time_to_resolve = _minutes_between(Ticket.createdat, Ticket.updatedat)
+        query = (
+            select(Ticket.ticketid, Ticket.subject, Ticket.status, Ticket.priority,
+                   Ticket.createdat, Ticket.updatedat, Ticket.country, mapping.c.sla_id,
+                   mapping.c.sla_minutes, mapping.c.matched_sla_name,
+                   time_to_resolve.label("time_to_resolve"),
+                   _within_resolution_sla(mapping).label("within_sla"))
+            .join(mapping, _priority_key() == mapping.c.priority, isouter=True)
+            .where(Ticket.ticketid > after_ticket_id)
+            .order_by(Ticket.ticketid)
+            .limit(limit)
+            .execution_options(yield_per=500)
+        )
+        available_sla_priorities = list(sla_policy_resolver.policies.keys())
+        rows = await db.stream(query)
+        async for row in rows:
+            minutes, within_sla = row.time_to_resolve, bool(row.within_sla)
+            if minutes is not None and row.sla_minutes:
+                calendar_within, calendar_minutes = _calendar_within_sla(
+                    row, row.updatedat, row.sla_minutes)
+                if calendar_minutes is not None:
+                    minutes, within_sla = calendar_minutes, calendar_within
+            detail = {
+                "ticketid": row.ticketid,
+                "subject": row.subject,
+                "status": row.status,
+                "priority": row.priority,
+                "createdat": str(row.createdat),
+                "resolvedat": str(row.updatedat) if row.updatedat else None,
+                "time_to_resolve_minutes": math.ceil(minutes) if minutes is not None else None,
+                "sla_minutes": row.sla_minutes,
+                "within_sla": within_sla
+            }
+            if debug:
+                detail["debug"] = {
+                    "ticket_priority": row.priority,
+                    "normalized_priority": normalize_priority(row.priority),
+                    "available_sla_priorities": available_sla_priorities,
+                    "env_priority_levels": PRIORITY_LEVELS,
+                    "matched_sla_name": row.matched_sla_name
+                }
+            yield json.dumps(detail) + "\n"
+
+
+# SLA Business Calendars
+
+
+def _compile_calendar(calendar):
+    if calendar.sla_policy_id is None and not calendar.country:
+        raise HTTPException(
+            status_code=400, detail="A business calendar needs an sla_policy_id or a country")
+    try:
+        BusinessCalendar.from_model(calendar)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid business calendar: {e}")
+
+
+async def get_sla_calendars_controller(db):
+    result = await db.execute(select(SLABusinessCalendar))
+    return result.scalars().all()
+
+
+async def create_sla_calendar_controller(calendar, db):
+    new_calendar = SLABusinessCalendar(**calendar.dict())
+    _compile_calendar(new_calendar)
+    db.add(new_calendar)
+    await db.commit()
+    await db.refresh(new_calendar)
+    business_calendars.invalidate()
+    return new_calendar
+
+
+async def update_sla_calendar_controller(calendar_id, calendar, db):
+    existing = await db.get(SLABusinessCalendar, calendar_id)
+    if not existing:
+        raise HTTPException(
+            status_code=404, detail="Business calendar not found")
+    for key, value in calendar.dict(exclude_unset=True).items():
+        setattr(existing, key, value)
+    _compile_calendar(existing)
+    await db.commit()
+    await db.refresh(existing)
+    business_calendars.invalidate()
+    return existing
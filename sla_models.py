@@ -19,9 +19,44 @@ class SLALog(Base):
     __tablename__ = "sla_logs"
     id = Column(Integer, primary_key=True, index=True)
     ticket_id = Column(Integer, ForeignKey("tickets.ticketid"), nullable=False)
+    # Null when the ticket's priority matched no policy
     sla_policy_id = Column(Integer, ForeignKey(
-        "sla_policies.sla_id"), nullable=False)
+        "sla_policies.sla_id"), nullable=True)
     # e.g., 'assigned', 'breached', 'resolved'
     event_type = Column(String, nullable=False)
     timestamp = Column(DateTime, nullable=False)
     details = Column(Text)
+
+# SLA Alignment Jobs Table
+
+
+class SLAAlignmentJob(Base):
+    __tablename__ = "sla_alignment_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    # 'running' or 'completed'; a running job resumes from cursor
+    status = Column(String, nullable=False)
+    # Highest ticket id already realigned
+    cursor = Column(Integer, nullable=False, default=0)
+    max_ticket_id = Column(Integer, nullable=False)
+    updated_count = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+
+# SLA Business Calendars Table
+
+
+class SLABusinessCalendar(Base):
+    __tablename__ = "sla_business_calendars"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    # Applies to one policy, or (when sla_policy_id is null) to tickets from one country
+    sla_policy_id = Column(Integer, ForeignKey(
+        "sla_policies.sla_id"), nullable=True, unique=True)
+    country = Column(Text, nullable=True)
+    # Working hours are local time; local = UTC + utc_offset_minutes
+    utc_offset_minutes = Column(Integer, nullable=False, default=0)
+    work_start = Column(String(5), nullable=False, default="09:00")
+    work_end = Column(String(5), nullable=False, default="17:00")
+    # Comma-separated weekday numbers (Monday=0) and ISO holiday dates
+    weekend_days = Column(String, nullable=False, default="5,6")
+    holidays = Column(Text)
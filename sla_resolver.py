@@ -0,0 +1,91 @@
+import os
+import time
+from sqlalchemy import select
+from sla_models import SLAPolicy
+
+# Get priority levels from environment variables
+PRIORITY_LEVELS = {
+    "critical": os.getenv("PRIORITY_LEVEL_0", "critical").lower(),
+    "high": os.getenv("PRIORITY_LEVEL_1", "high").lower(),
+    "medium": os.getenv("PRIORITY_LEVEL_2", "medium").lower(),
+    "low": os.getenv("PRIORITY_LEVEL_3", "low").lower(),
+}
+
+# Policies are re-read after this long so other workers' edits are picked up
+POLICY_CACHE_TTL_SECONDS = 60
+# Ticket priorities are free text; stop memoizing once this many are cached
+MAX_MEMOIZED_PRIORITIES = 1024
+
+
+def normalize_priority(priority):
+    return (priority or "").strip().lower()
+
+
+def _snapshot(policy):
+    # Detached copy so cached policies never touch a closed session
+    return SLAPolicy(**{c.name: getattr(policy, c.name) for c in SLAPolicy.__table__.columns})
+
+
+class SLAPolicyResolver:
+    """Priority -> SLA policy lookup compiled once from SLAPolicy rows and PRIORITY_LEVELS."""
+
+    def __init__(self):
+        # normalized policy name -> policy, in query order
+        self._policies = None
+        # normalized priority -> (policy, matched policy name)
+        self._table = {}
+        self._loaded_at = 0.0
+
+    @property
+    def policies(self):
+        return self._policies or {}
+
+    def invalidate(self):
+        self._policies = None
+        self._table = {}
+
+    async def load(self, db):
+        if self._policies is not None and time.monotonic() - self._loaded_at < POLICY_CACHE_TTL_SECONDS:
+            return self
+        result = await db.execute(select(SLAPolicy))
+        self.compile(result.scalars().all())
+        return self
+
+    def compile(self, policies):
+        compiled = {}
+        for p in policies:
+            compiled[normalize_priority(str(p.name))] = _snapshot(p)
+        # Exact policy names win, then env priority values mapped to their level's policy
+        table = {key: (policy, policy.name) for key, policy in compiled.items()}
+        for env_key, env_value in PRIORITY_LEVELS.items():
+            if env_value not in table and env_key in compiled:
+                table[env_value] = (compiled[env_key], compiled[env_key].name)
+        self._policies = compiled
+        self._table = table
+        self._loaded_at = time.monotonic()
+
+    def _match_unseen(self, normalized):
+        for key, policy in self.policies.items():
+            if key in normalized or normalized in key:
+                return policy, policy.name
+        if not self.policies:
+            return None, None
+        policy = self.policies.get("default sla") or next(iter(self.policies.values()))
+        return policy, policy.name
+
+    def resolve(self, priority):
+        """Return (policy, matched_name) for a ticket priority; call load() first."""
+        normalized = normalize_priority(priority)
+        match = self._table.get(normalized)
+        if match is None:
+            match = self._match_unseen(normalized)
+            if len(self._table) < MAX_MEMOIZED_PRIORITIES:
+                self._table[normalized] = match
+        return match
+
+    async def match(self, db, priority):
+        await self.load(db)
+        return self.resolve(priority)
+
+
+sla_policy_resolver = SLAPolicyResolver()
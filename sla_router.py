@@ -1,10 +1,12 @@
 
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from db import get_db
 from models import User
 from router import get_current_user
-from sla_controller import get_sla_policies_controller, create_sla_policy_controller, update_sla_policy_controller, get_ticket_sla_status_controller, get_sla_violations_controller, get_sla_report_controller, update_all_tickets_sla_alignment, to_dict
-from schemas import SLAPolicyCreate, SLAPolicyUpdate, SLAPolicyOut, SLAStatusOut, SLAViolationOut, SLAReportOut
+from sla_controller import get_sla_policies_controller, create_sla_policy_controller, update_sla_policy_controller, get_ticket_sla_status_controller, get_tickets_sla_status_controller, get_sla_violations_controller, get_sla_report_controller, stream_sla_report_details, update_all_tickets_sla_alignment, stream_sla_alignment_report, get_sla_calendars_controller, create_sla_calendar_controller, update_sla_calendar_controller, simulate_sla_policies_controller, to_dict
+from schemas import SLAPolicyCreate, SLAPolicyUpdate, SLAPolicyOut, SLAStatusOut, SLAViolationOut, SLAReportOut, SLABatchStatusRequest, SLABatchStatusOut, SLACalendarCreate, SLACalendarUpdate, SLACalendarOut, SLASimulationRequest
 
 sla_router = APIRouter(prefix="/api/sla", tags=["SLA"])
 
@@ -30,11 +32,45 @@ async def update_sla_policy(sla_id: int, sla: SLAPolicyUpdate, db=Depends(get_db
     return await update_sla_policy_controller(sla_id, sla, db)
 
 
+@sla_router.post("/policies/simulate")
+async def simulate_sla_policies(payload: SLASimulationRequest, db=Depends(get_db), current_user=Depends(get_current_user)):
+    if not current_user.role or current_user.role.name.lower() != "superadmin":
+        raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
+    return await simulate_sla_policies_controller(payload, db)
+
+
+@sla_router.get("/calendars", response_model=list[SLACalendarOut])
+async def get_sla_calendars(db=Depends(get_db), current_user=Depends(get_current_user)):
+    if not current_user.role or current_user.role.name.lower() != "superadmin":
+        raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
+    return await get_sla_calendars_controller(db)
+
+
+@sla_router.post("/calendars", response_model=SLACalendarOut)
+async def create_sla_calendar(calendar: SLACalendarCreate, db=Depends(get_db), current_user=Depends(get_current_user)):
+    if not current_user.role or current_user.role.name.lower() != "superadmin":
+        raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
+    return await create_sla_calendar_controller(calendar, db)
+
+
+@sla_router.put("/calendars/{calendar_id}", response_model=SLACalendarOut)
+async def update_sla_calendar(calendar_id: int, calendar: SLACalendarUpdate, db=Depends(get_db), current_user=Depends(get_current_user)):
+    if not current_user.role or current_user.role.name.lower() != "superadmin":
+        raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
+    return await update_sla_calendar_controller(calendar_id, calendar, db)
+
+
 @sla_router.get("/violations", response_model=list[SLAViolationOut])
-async def get_sla_violations(db=Depends(get_db), current_user=Depends(get_current_user)):
+async def get_sla_violations(
+    limit: int = Query(100, ge=1, le=1000),
+    after_ticket_id: int = 0,
+    violation_type: str = Query("resolution", pattern="^(resolution|response)$"),
+    db=Depends(get_db),
+    current_user=Depends(get_current_user)
+):
     if not current_user.role or current_user.role.name.lower() != "superadmin":
         raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
-    return await get_sla_violations_controller(db)
+    return await get_sla_violations_controller(db, limit, after_ticket_id, violation_type)
 
 
 @sla_router.get("/report", response_model=SLAReportOut)
@@ -44,15 +80,41 @@ async def get_sla_report(db=Depends(get_db), current_user=Depends(get_current_us
     return await get_sla_report_controller(db)
 
 
+@sla_router.get("/report/details")
+async def get_sla_report_details(
+    limit: int = Query(1000, ge=1, le=10000),
+    after_ticket_id: int = 0,
+    debug: bool = False,
+    current_user=Depends(get_current_user)
+):
+    if not current_user.role or current_user.role.name.lower() != "superadmin":
+        raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
+    return StreamingResponse(
+        stream_sla_report_details(limit, after_ticket_id, debug),
+        media_type="application/x-ndjson"
+    )
+
+
 @sla_router.post("/align-tickets")
-async def align_all_tickets_sla(db=Depends(get_db), current_user=Depends(get_current_user)):
+async def align_all_tickets_sla(job_id: Optional[int] = None, db=Depends(get_db), current_user=Depends(get_current_user)):
     if not current_user.role or current_user.role.name.lower() != "superadmin":
         raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
     from fastapi.responses import JSONResponse
-    result = await update_all_tickets_sla_alignment(db)
+    result = await update_all_tickets_sla_alignment(db, job_id)
     return JSONResponse(content=to_dict(result))
 
 
+@sla_router.get("/align-tickets/report")
+async def download_sla_alignment_report(current_user=Depends(get_current_user)):
+    if not current_user.role or current_user.role.name.lower() != "superadmin":
+        raise HTTPException(status_code=403, detail="Only superadmin can access this endpoint.")
+    return StreamingResponse(
+        stream_sla_alignment_report(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=sla_alignment_report.csv"}
+    )
+
+
 @sla_router.get("/ticket/{ticket_id}/status")
 async def get_ticket_sla_status(ticket_id: int, db=Depends(get_db), current_user=Depends(get_current_user)):
     # Only allow users to access their own ticket, or admins/superadmins
@@ -67,3 +129,10 @@ async def get_ticket_sla_status(ticket_id: int, db=Depends(get_db), current_user
     from fastapi.responses import JSONResponse
     result = await get_ticket_sla_status_controller(ticket_id, db)
     return JSONResponse(content=to_dict(result))
+
+
+@sla_router.post("/tickets/status", response_model=SLABatchStatusOut)
+async def get_tickets_sla_status(payload: SLABatchStatusRequest, db=Depends(get_db), current_user=Depends(get_current_user)):
+    # Non-admins only see their own tickets; the rest are reported as not found
+    user_id = None if getattr(current_user, 'isadmin', False) else current_user.userid
+    return await get_tickets_sla_status_controller(payload.ticket_ids, db, user_id)
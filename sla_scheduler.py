@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from sqlalchemy import select, update, insert, or_, exists, func
+from db import SessionLocal
+from models import Ticket
+from sla_models import SLALog
+from sla_resolver import sla_policy_resolver
+from activity_log import activity_log
+
+logger = logging.getLogger(__name__)
+
+# Tickets in these statuses no longer have a running SLA clock
+CLOSED_STATUSES = ("resolved", "closed")
+BREACH_BATCH_SIZE = 500
+# Upper bound on a single sleep so clock drift never delays a breach for long
+MAX_SLEEP_SECONDS = 300
+
+
+def _breach_logged():
+    """True for tickets whose current SLA target already has a breached log row."""
+    return exists().where(
+        SLALog.ticket_id == Ticket.ticketid,
+        SLALog.event_type == "breached",
+        SLALog.timestamp >= Ticket.current_sla_target
+    )
+
+
+class SLAScheduler:
+    """Min-heap of upcoming SLA deadlines that records breaches as they fall due."""
+
+    def __init__(self):
+        self._heap = []
+        # ticket_id -> deadline currently scheduled; heap entries that disagree are stale
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Coroutine functions called with the ids of newly breached tickets
+        self.breach_listeners = []
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, ticket_id, deadline):
+        if deadline is None:
+            self.discard(ticket_id)
+            return
+        if self._deadlines.get(ticket_id) == deadline:
+            return
+        self._deadlines[ticket_id] = deadline
+        heapq.heappush(self._heap, (deadline, ticket_id))
+        if self._heap[0] == (deadline, ticket_id):
+            self._wakeup.set()
+
+    def discard(self, ticket_id):
+        self._deadlines.pop(ticket_id, None)
+
+    def track(self, ticket):
+        """Schedule or drop a ticket based on its status and current_sla_target.
+
+        Deadlines already past are not rescheduled: the ticket has either been
+        recorded as breached or will be picked up by load() at startup.
+        """
+        if (ticket.status or "").strip().lower() in CLOSED_STATUSES:
+            self.discard(ticket.ticketid)
+        elif ticket.current_sla_target is not None and ticket.current_sla_target <= datetime.utcnow():
+            self.discard(ticket.ticketid)
+        else:
+            self.schedule(ticket.ticketid, ticket.current_sla_target)
+
+    async def load(self, db):
+        """Rebuild the heap from active tickets that have not been logged as breached."""
+        result = await db.execute(
+            select(Ticket.ticketid, Ticket.current_sla_target).where(
+                Ticket.current_sla_target.isnot(None),
+                or_(Ticket.status.is_(None),
+                    func.lower(Ticket.status).notin_(CLOSED_STATUSES)),
+                ~_breach_logged()
+            )
+        )
+        self._deadlines = {row[0]: row[1] for row in result.all()}
+        self._heap = [(deadline, ticket_id)
+                      for ticket_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+        return len(self._deadlines)
+
+    async def reload(self):
+        async with SessionLocal() as db:
+            return await self.load(db)
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and len(due) < BREACH_BATCH_SIZE:
+            deadline, ticket_id = self._heap[0]
+            if self._deadlines.get(ticket_id) != deadline:
+                heapq.heappop(self._heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self._heap)
+            del self._deadlines[ticket_id]
+            due.append(ticket_id)
+        return due
+
+    def _seconds_until_next(self, now):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return MAX_SLEEP_SECONDS
+        delay = (self._heap[0][0] - now).total_seconds()
+        return min(max(delay, 0), MAX_SLEEP_SECONDS)
+
+    async def _record_breaches(self, ticket_ids):
+        now = datetime.utcnow()
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(Ticket)
+                .where(
+                    Ticket.ticketid.in_(ticket_ids),
+                    Ticket.current_sla_target <= now,
+                    or_(Ticket.status.is_(None),
+                        func.lower(Ticket.status).notin_(CLOSED_STATUSES)),
+                    # Another worker, or an earlier reschedule, may have recorded it already
+                    ~_breach_logged()
+                )
+                .values(escalation_level=func.coalesce(Ticket.escalation_level, 0) + 1)
+                .returning(Ticket.ticketid, Ticket.priority, Ticket.current_sla_target, Ticket.escalation_level)
+                .execution_options(synchronize_session=False)
+            )
+            breached = result.all()
+            await sla_policy_resolver.load(db)
+            policies = {row.priority: sla_policy_resolver.resolve(row.priority)[0]
+                        for row in breached}
+            logs = [
+                {
+                    "ticket_id": row.ticketid,
+                    "sla_policy_id": policies[row.priority].sla_id if policies[row.priority] else None,
+                    "event_type": "breached",
+                    "timestamp": now,
+                    "details": f"sla_target: {row.current_sla_target} | escalation_level: {row.escalation_level}"
+                }
+                for row in breached
+            ]
+            if logs:
+                await db.execute(insert(SLALog), logs)
+            await db.commit()
+        return breached
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+            due = self._pop_due(now)
+            if due:
+                try:
+                    breached = await self._record_breaches(due)
+                    logger.info("SLA breaches recorded for %d tickets", len(breached))
+                    if breached:
+                        activity_log.log("system", "SLA_BREACHES_RECORDED",
+                                         details=f"tickets: {len(breached)}")
+                        for listener in self.breach_listeners:
+                            try:
+                                await listener([row.ticketid for row in breached])
+                            except Exception:
+                                # The breaches are recorded; never retry them for a listener
+                                logger.exception("SLA breach listener failed")
+                except Exception:
+                    logger.exception("Failed to record SLA breaches; rescheduling")
+                    for ticket_id in due:
+                        self._deadlines.setdefault(ticket_id, now)
+                        heapq.heappush(self._heap, (self._deadlines[ticket_id], ticket_id))
+                    await asyncio.sleep(5)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next(now))
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        await self.reload()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+sla_scheduler = SLAScheduler()
@@ -0,0 +1,140 @@
+import asyncio
+import time
+import numpy as np
+from sqlalchemy import select, func
+from db import SessionLocal
+from models import Ticket
+from sla_models import SLAPolicy
+from sla_resolver import SLAPolicyResolver, normalize_priority
+
+# Historical durations are re-read from the database after this long
+DURATION_CACHE_TTL_SECONDS = 600
+LOAD_BATCH_SIZE = 50000
+
+
+class TicketDurationCache:
+    """Resolution durations of historical tickets, grouped by priority and sorted.
+
+    Compliance for any threshold is then a searchsorted over the priority's slice,
+    so a simulation costs O(priorities * points * log n) regardless of history size.
+    """
+
+    def __init__(self):
+        self.priorities = []
+        # Per-priority slices into sorted_durations: priority -> (start, end)
+        self.bounds = {}
+        self.sorted_durations = np.empty(0)
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.sorted_durations)
+
+    async def load(self, force=False):
+        async with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < DURATION_CACHE_TTL_SECONDS:
+                return self
+            priority_codes = {}
+            codes, durations = [], []
+            async with SessionLocal() as db:
+                # updatedat stands in for the resolution time, as in the SLA report
+                rows = await db.stream(
+                    select(func.lower(func.trim(func.coalesce(Ticket.priority, ""))),
+                           func.extract("epoch", Ticket.updatedat - Ticket.createdat) / 60)
+                    .where(Ticket.createdat.isnot(None), Ticket.updatedat.isnot(None))
+                    .execution_options(yield_per=LOAD_BATCH_SIZE)
+                )
+                async for partition in rows.partitions():
+                    codes.append(np.fromiter(
+                        (priority_codes.setdefault(row[0], len(priority_codes))
+                         for row in partition), dtype=np.int32, count=len(partition)))
+                    durations.append(np.fromiter(
+                        (row[1] for row in partition), dtype=np.float64, count=len(partition)))
+            codes = np.concatenate(codes) if codes else np.empty(0, dtype=np.int32)
+            durations = np.concatenate(durations) if durations else np.empty(0)
+            order = np.lexsort((durations, codes))
+            codes, durations = codes[order], durations[order]
+            starts = np.searchsorted(codes, np.arange(len(priority_codes)), side="left")
+            ends = np.searchsorted(codes, np.arange(len(priority_codes)), side="right")
+            self.priorities = list(priority_codes)
+            self.bounds = {p: (int(starts[i]), int(ends[i]))
+                           for p, i in priority_codes.items()}
+            self.sorted_durations = durations
+            self._loaded_at = time.monotonic()
+            return self
+
+    def compliant_counts(self, priority, thresholds):
+        start, end = self.bounds[priority]
+        return np.searchsorted(self.sorted_durations[start:end], thresholds, side="right")
+
+
+ticket_durations = TicketDurationCache()
+
+
+def _percentage(count, total):
+    return round(float(count) / total * 100, 2) if total else 0.0
+
+
+async def simulate_sla_policies(candidates, current_policies, curve_points=20):
+    """Replay historical tickets against candidate policies merged over the current ones."""
+    cache = await ticket_durations.load()
+    current = SLAPolicyResolver()
+    current.compile(current_policies)
+    # Candidates replace current policies with the same (normalized) name
+    merged = {normalize_priority(p.name): p for p in current.policies.values()}
+    for candidate in candidates:
+        key = normalize_priority(candidate.name)
+        existing = merged.get(key)
+        merged[key] = SLAPolicy(
+            sla_id=existing.sla_id if existing else None,
+            name=candidate.name,
+            description=existing.description if existing else None,
+            response_time_minutes=candidate.response_time_minutes if candidate.response_time_minutes is not None else (
+                existing.response_time_minutes if existing else 0),
+            resolution_time_minutes=candidate.resolution_time_minutes
+        )
+    simulated = SLAPolicyResolver()
+    simulated.compile(merged.values())
+
+    total = len(cache)
+    current_within = simulated_within = 0
+    priorities = []
+    for priority in cache.priorities:
+        start, end = cache.bounds[priority]
+        count = end - start
+        current_policy, _ = current.resolve(priority)
+        simulated_policy, _ = simulated.resolve(priority)
+        current_minutes = current_policy.resolution_time_minutes if current_policy else 0
+        simulated_minutes = simulated_policy.resolution_time_minutes if simulated_policy else 0
+        # A zero SLA never counts as met, matching the report
+        now_ok, sim_ok = cache.compliant_counts(
+            priority, np.array([current_minutes, simulated_minutes], dtype=np.float64))
+        now_ok = now_ok if current_minutes else 0
+        sim_ok = sim_ok if simulated_minutes else 0
+        current_within += now_ok
+        simulated_within += sim_ok
+        upper = max(simulated_minutes, current_minutes) * 2
+        if not upper:
+            upper = float(cache.sorted_durations[end - 1])
+        thresholds = np.linspace(0, upper, curve_points)
+        curve = cache.compliant_counts(priority, thresholds) / count * 100
+        priorities.append({
+            "priority": priority,
+            "tickets": count,
+            "current_policy": current_policy.name if current_policy else None,
+            "current_sla_minutes": current_minutes,
+            "current_compliance_percentage": _percentage(now_ok, count),
+            "simulated_policy": simulated_policy.name if simulated_policy else None,
+            "simulated_sla_minutes": simulated_minutes,
+            "simulated_compliance_percentage": _percentage(sim_ok, count),
+            "curve": [
+                {"sla_minutes": round(float(t), 2), "compliance_percentage": round(float(c), 2)}
+                for t, c in zip(thresholds, curve)
+            ]
+        })
+    return {
+        "total_tickets": total,
+        "current_compliance_percentage": _percentage(current_within, total),
+        "simulated_compliance_percentage": _percentage(simulated_within, total),
+        "priorities": priorities
+    }
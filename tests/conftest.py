@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The suite drops and recreates the public schema of this database; never point it at real data
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+async def _reset_schema(url):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP SCHEMA public CASCADE"))
+        await conn.execute(text("CREATE SCHEMA public"))
+    await engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    asyncio.run(_reset_schema(TEST_DATABASE_URL))
+    os.environ.setdefault("ACTIVITY_LOG_DIR", str(tmp_path_factory.mktemp("logs")))
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def run(client):
+    """Run an async function of a database session on the app's event loop."""
+    from db import SessionLocal
+
+    async def in_session(fn):
+        async with SessionLocal() as db:
+            return await fn(db)
+
+    return lambda fn: client.portal.call(in_session, fn)
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+from sqlalchemy import text
+from youshop_API.youshop.yshop_dbactions import get_product_facets
+from youshop_API.youshop.yshop_facets import facet_value
+from youshop_API.youshop.yshop_schemas import ProductFacetsResponse
+
+
+async def _seed_with_nulls(db):
+    # Tables created before the model declared these NOT NULL may still hold NULLs
+    await db.execute(text("ALTER TABLE yshop_products ALTER COLUMN category DROP NOT NULL, "
+                          "ALTER COLUMN brand DROP NOT NULL, ALTER COLUMN price DROP NOT NULL"))
+    await db.execute(text("TRUNCATE yshop_products CASCADE"))
+    await db.execute(text(
+        "INSERT INTO yshop_products (name, category, brand, price, stock, is_active) VALUES "
+        "('blank', NULL, NULL, NULL, NULL, true), ('phone', 'Phones', 'Apple', 30, 2, true)"))
+    await db.commit()
+
+
+def test_sql_facets_bucket_null_columns_like_the_index(run):
+    async def scenario(db):
+        await _seed_with_nulls(db)
+        return await get_product_facets(db, None, {})
+
+    total, facets = run(scenario)
+    ProductFacetsResponse(total=total, facets=facets)
+    assert total == 2
+    blank = SimpleNamespace(category=None, brand=None, price=None, stock=None)
+    for facet in facets:
+        assert {"value": facet_value(facet, blank), "count": 1} in facets[facet]
+    assert {"value": "25-50", "count": 1} in facets["price"]
+    assert {"value": True, "count": 1} in facets["in_stock"]
+
+
+def test_sql_facets_price_filter_matches_null_price_bucket(run):
+    async def scenario(db):
+        await _seed_with_nulls(db)
+        return await get_product_facets(db, None, {"price": "0-25"})
+
+    total, facets = run(scenario)
+    assert total == 1
+    assert facets["category"] == [{"value": "", "count": 1}]
@@ -0,0 +1,47 @@
+from sqlalchemy import text
+from youshop_API.youshop.yshop_search import ProductSearch
+
+
+async def _insert(db, name, age_seconds=0):
+    result = await db.execute(text(
+        "INSERT INTO yshop_products (name, category, brand, price, stock, is_active, updated_at) "
+        "VALUES (:name, 'Phones', 'Apple', 10, 1, true, (now() AT TIME ZONE 'utc') - make_interval(secs => :age)) "
+        "RETURNING id"), {"name": name, "age": age_seconds})
+    await db.commit()
+    return result.scalar_one()
+
+
+def test_sync_applies_each_change_once(run):
+    search = ProductSearch()
+
+    async def scenario(db):
+        await db.execute(text("TRUNCATE yshop_products CASCADE"))
+        await db.commit()
+        await _insert(db, "anchor")
+        await search.rebuild()
+        idle = [await search.sync() for _ in range(3)]
+        product_id = await _insert(db, "wireless charger")
+        return idle, product_id, await search.sync(), await search.sync()
+
+    idle, product_id, first, second = run(scenario)
+    assert idle == [0, 0, 0]
+    assert (first, second) == (1, 0)
+    assert search.search("wireless charger") == [product_id]
+
+
+def test_sync_picks_up_rows_committed_behind_the_watermark(run):
+    search = ProductSearch()
+
+    async def scenario(db):
+        await db.execute(text("TRUNCATE yshop_products CASCADE"))
+        await db.commit()
+        await search.rebuild()
+        await _insert(db, "newer product")
+        await search.sync()
+        # Stamped a minute ago but committed only now, e.g. by a long import transaction
+        late = await _insert(db, "bluetooth speaker", age_seconds=60)
+        return late, await search.sync(), await search.sync()
+
+    late, first, second = run(scenario)
+    assert (first, second) == (1, 0)
+    assert search.search("bluetooth speaker") == [late]
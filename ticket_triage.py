@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sqlalchemy import select, desc
+from db import SessionLocal
+from models import Ticket, TicketMessage
+
+logger = logging.getLogger(__name__)
+
+# "off", "suggest" (only the triage endpoint) or "correct" (also fix confident mismatches at creation)
+TRIAGE_MODE = os.getenv("TRIAGE_MODE", "suggest")
+TRIAGE_AUTOCORRECT_CONFIDENCE = float(os.getenv("TRIAGE_AUTOCORRECT_CONFIDENCE", 0.8))
+TRIAGE_RETRAIN_SECONDS = int(os.getenv("TRIAGE_RETRAIN_SECONDS", 6 * 3600))
+TRIAGE_MAX_SAMPLES = 50000
+# Fewer labelled tickets than this and the model is not trusted
+MIN_SAMPLES = 20
+N_FEATURES = 1 << 16
+SMOOTHING = 0.1
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def features(text):
+    """Hashed unigram and bigram counts as (indices, counts) arrays."""
+    words = _WORD.findall((text or "").lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if not grams:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    hashed = np.fromiter((zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams),
+                         dtype=np.int64, count=len(grams))
+    indices, counts = np.unique(hashed, return_counts=True)
+    return indices, counts.astype(np.float32)
+
+
+def _fit(texts, labels):
+    """Multinomial naive Bayes: (labels, log priors, log feature probabilities)."""
+    classes = sorted(set(labels))
+    if len(texts) < MIN_SAMPLES or len(classes) < 2:
+        return None
+    index = {label: i for i, label in enumerate(classes)}
+    counts = np.zeros((len(classes), N_FEATURES), dtype=np.float32)
+    priors = np.zeros(len(classes), dtype=np.float64)
+    for text, label in zip(texts, labels):
+        row = index[label]
+        priors[row] += 1
+        indices, values = features(text)
+        counts[row, indices] += values
+    counts += SMOOTHING
+    log_prob = np.log(counts / counts.sum(axis=1, keepdims=True)).astype(np.float32)
+    return classes, np.log(priors / priors.sum()).astype(np.float32), log_prob
+
+
+def train(samples):
+    """Fit category and priority models from (text, category_id, priority) rows; runs in a worker process."""
+    with_category = [(text, category) for text, category, _ in samples if category is not None]
+    with_priority = [(text, priority) for text, _, priority in samples if priority]
+    return {
+        "category": _fit([t for t, _ in with_category], [c for _, c in with_category]),
+        "priority": _fit([t for t, _ in with_priority], [p for _, p in with_priority]),
+        "samples": len(samples)
+    }
+
+
+def _predict(model, indices, counts):
+    classes, log_prior, log_prob = model
+    scores = log_prior + log_prob[:, indices] @ counts
+    scores = np.exp(scores - scores.max())
+    best = int(scores.argmax())
+    return classes[best], float(scores[best] / scores.sum())
+
+
+class TicketTriage:
+    """Naive Bayes category and priority classifier retrained in a worker process.
+
+    Models are fitted on historical tickets (subject plus opening message)
+    every TRIAGE_RETRAIN_SECONDS and swapped in whole; predicting is a
+    column gather and a small matrix-vector product.
+    """
+
+    def __init__(self):
+        self.models = {"category": None, "priority": None, "samples": 0}
+        self._pool = None
+        self._task = None
+
+    async def load_samples(self, db):
+        first_message = (
+            select(TicketMessage.content)
+            .where(TicketMessage.ticketid == Ticket.ticketid,
+                   TicketMessage.isbotresponse.is_(False))
+            .order_by(TicketMessage.messageid)
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            select(Ticket.subject, first_message, Ticket.categoryid, Ticket.priority)
+            .order_by(desc(Ticket.ticketid))
+            .limit(TRIAGE_MAX_SAMPLES))
+        return [(f"{subject or ''} {message or ''}", categoryid, (priority or "").strip().lower() or None)
+                for subject, message, categoryid, priority in result.all()]
+
+    async def retrain(self):
+        async with SessionLocal() as db:
+            samples = await self.load_samples(db)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=1)
+        models = await asyncio.get_running_loop().run_in_executor(self._pool, train, samples)
+        self.models = models
+        return models["samples"]
+
+    def predict(self, subject, message):
+        """{"category_id": (value, confidence), "priority": (value, confidence)} for trained models."""
+        models = self.models
+        indices, counts = features(f"{subject or ''} {message or ''}")
+        predictions = {}
+        if len(indices):
+            for name, key in (("category", "category_id"), ("priority", "priority")):
+                if models[name] is not None:
+                    predictions[key] = _predict(models[name], indices, counts)
+        return predictions
+
+    def correct(self, payload):
+        """Overwrite category_id and priority on a new ticket payload when the model is confident they are wrong."""
+        if TRIAGE_MODE != "correct":
+            return {}
+        corrections = {}
+        for field, (value, confidence) in self.predict(payload.subject, payload.message).items():
+            current = getattr(payload, field)
+            if field == "priority":
+                current = (current or "").strip().lower()
+            if value != current and confidence >= TRIAGE_AUTOCORRECT_CONFIDENCE:
+                corrections[field] = (getattr(payload, field), value)
+                setattr(payload, field, value)
+        return corrections
+
+    async def run(self):
+        while True:
+            try:
+                trained = await self.retrain()
+                logger.info("Ticket triage models retrained on %d tickets", trained)
+            except Exception:
+                logger.exception("Ticket triage retraining failed")
+            await asyncio.sleep(TRIAGE_RETRAIN_SECONDS)
+
+    def start(self):
+        if TRIAGE_MODE != "off":
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+ticket_triage = TicketTriage()
@@ -12,6 +12,7 @@ from .yshop_controller import (
     controller_analytics,
     controller_inventory,
     controller_activate_product,
+    controller_catalog_cache_stats,
     controller_list_orders,
     controller_order_details,
     controller_update_order_status,
@@ -93,6 +94,11 @@ async def admin_activate_product(product_id: int, active: bool, db: AsyncSession
         raise HTTPException(404, "Product not found")
     return {"message": f"Product {'activated' if active else 'deactivated'}"}
 
+
+@router.get("/cache-stats", response_model=dict)
+async def admin_catalog_cache_stats():
+    return await controller_catalog_cache_stats()
+
 # Order Management
 
 
@@ -170,5 +176,5 @@ async def admin_create_shop_customer(
     customer = await controller_create_shop_customer(payload, db)
     # Log the creation event
     log_user_activity(customer.email, "create_shop_customer",
-                      f"id={customer.id}")
+                      f"id={customer.id}", category="user")
     return customer
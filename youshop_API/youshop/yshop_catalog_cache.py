@@ -0,0 +1,159 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .yshop_models import YShopProduct, YShopCatalogVersion
+
+# Most products held at once; snapshots are a few hundred bytes each
+CATALOG_CACHE_SIZE = int(os.getenv("YSHOP_CATALOG_CACHE_SIZE", 10000))
+# Product lists longer than this are not cached
+MAX_CACHED_LIST = 1000
+# How stale another worker's admin change may be seen here
+VERSION_CHECK_SECONDS = 2
+
+
+@dataclass(frozen=True, slots=True)
+class ProductSnapshot:
+    id: int
+    name: str
+    category: str
+    brand: str
+    price: float
+    description: Optional[str]
+    stock: Optional[int]
+    is_active: Optional[bool]
+
+    @classmethod
+    def from_product(cls, product):
+        return cls(product.id, product.name, product.category, product.brand, product.price,
+                   product.description, product.stock, product.is_active)
+
+
+async def bump_catalog_version(db):
+    """Increment the catalog version inside the caller's transaction; returns the new version."""
+    result = await db.execute(
+        pg_insert(YShopCatalogVersion).values(id=1, version=1, updated_at=datetime.utcnow())
+        .on_conflict_do_update(index_elements=["id"], set_={
+            "version": YShopCatalogVersion.version + 1, "updated_at": datetime.utcnow()})
+        .returning(YShopCatalogVersion.version))
+    return result.scalar_one()
+
+
+class CatalogCache:
+    """Read-through cache of immutable ProductSnapshots tagged with the catalog version.
+
+    Admin mutations bump yshop_catalog_version in their transaction and drop
+    the products they touched here. Other workers see the new version within
+    VERSION_CHECK_SECONDS and drop everything. A load that raced an
+    invalidation is returned but not kept.
+    """
+
+    def __init__(self, max_products=CATALOG_CACHE_SIZE):
+        self.max_products = max_products
+        self.version = None
+        self._products = OrderedDict()
+        self._lists = {}
+        # Bumped on every invalidation so in-flight loads know their result may be stale
+        self._generation = 0
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def _check_version(self, db):
+        if time.monotonic() - self._checked_at < VERSION_CHECK_SECONDS:
+            return
+        version = (await db.execute(
+            select(YShopCatalogVersion.version).where(YShopCatalogVersion.id == 1))).scalar_one_or_none() or 0
+        if version != self.version:
+            self._clear()
+            self.version = version
+        self._checked_at = time.monotonic()
+
+    def _clear(self):
+        self._generation += 1
+        self._products.clear()
+        self._lists.clear()
+
+    def _store(self, snapshot):
+        self._products[snapshot.id] = snapshot
+        self._products.move_to_end(snapshot.id)
+        while len(self._products) > self.max_products:
+            self._products.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, db, product_id):
+        """The product's snapshot, or None if it does not exist."""
+        return (await self.get_many(db, [product_id])).get(product_id)
+
+    async def get_many(self, db, product_ids):
+        """{product_id: snapshot} for the ids that exist, loading misses in one query."""
+        await self._check_version(db)
+        found, missing = {}, []
+        for product_id in product_ids:
+            snapshot = self._products.get(product_id)
+            if snapshot is not None:
+                self._products.move_to_end(product_id)
+                found[product_id] = snapshot
+                self.hits += 1
+            elif product_id not in found:
+                missing.append(product_id)
+        if missing:
+            self.misses += len(missing)
+            generation = self._generation
+            result = await db.execute(select(YShopProduct).where(YShopProduct.id.in_(missing)))
+            for product in result.scalars().all():
+                snapshot = ProductSnapshot.from_product(product)
+                found[product.id] = snapshot
+                if generation == self._generation:
+                    self._store(snapshot)
+        return found
+
+    async def get_list(self, db, name, load):
+        """Snapshots of the products load(db) returns, cached under name when short enough."""
+        await self._check_version(db)
+        if name in self._lists:
+            self.hits += 1
+            return list(self._lists[name])
+        self.misses += 1
+        generation = self._generation
+        snapshots = tuple(ProductSnapshot.from_product(product) for product in await load(db))
+        if len(snapshots) <= MAX_CACHED_LIST and generation == self._generation:
+            self._lists[name] = snapshots
+        return list(snapshots)
+
+    def invalidate(self, product_ids, version):
+        """Drop products changed by a committed admin mutation that bumped the catalog to version."""
+        self.invalidations += 1
+        if self.version is not None and version == self.version + 1:
+            self._generation += 1
+            for product_id in product_ids:
+                self._products.pop(product_id, None)
+            # Any cached list may hold one of them, or be missing a new product
+            self._lists.clear()
+        else:
+            # Another worker bumped the version too; its changes are unknown here
+            self._clear()
+        self.version = version
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "products": len(self._products),
+            "capacity": self.max_products,
+            "lists": len(self._lists),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+catalog_cache = CatalogCache()
@@ -1,7 +1,7 @@
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from .yshop_dbactions import (
-    search_products, get_trending_products, get_recommended_products, get_product_by_id,
+    search_products, search_products_trgm, get_products_by_ids, get_product_facets, get_trending_products, get_recommended_products, get_product_by_id,
     add_to_cart, remove_from_cart, get_cart, place_order, get_order_status,
     list_all_products, update_product, delete_product, import_products_csv, export_products_csv,
     get_admin_analytics, get_inventory_overview, activate_product,
@@ -19,6 +19,7 @@ from .yshop_dbactions import create_shop_customer, authenticate_shop_customer
 from .yshop_schemas import YShopCustomerLogin
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException, Depends
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -26,6 +27,8 @@ from passlib.context import CryptContext
 from db import get_db
 from .yshop_models import YShopCustomer
 from models import User as CoreUser
+from .yshop_search import product_search
+from .yshop_catalog_cache import catalog_cache
 
 # JWT configuration for YouShop
 SECRET_KEY = "your_secret_key_here"
@@ -104,8 +107,29 @@ async def get_current_shop_admin(
 # Public YouShop operations
 
 
-async def controller_search_products(name: str, category: str, brand: str, db: AsyncSession):
-    return await search_products(db, name, category, brand)
+async def controller_search_products(name: str, category: str, brand: str, db: AsyncSession,
+                                     q: str = None, limit: int = 50, offset: int = 0,
+                                     price: str = None, in_stock: bool = None):
+    # "name" predates free-text search and is treated as the query text
+    text = q or name
+    filters = {"category": category, "brand": brand, "price": price, "in_stock": in_stock}
+    if product_search.ready:
+        ids = product_search.search(text, filters, limit, offset)
+        return await get_products_by_ids(db, ids)
+    if product_search.trigram_ready and text:
+        return await search_products_trgm(db, text, filters, limit, offset)
+    # Index still loading: plain substring match
+    return await search_products(db, text, filters, limit, offset)
+
+
+async def controller_product_facets(q: str, category: str, brand: str, price: str, in_stock: bool,
+                                    db: AsyncSession):
+    filters = {"category": category, "brand": brand, "price": price, "in_stock": in_stock}
+    if product_search.ready:
+        total, facets = product_search.facets(q, filters)
+    else:
+        total, facets = await get_product_facets(db, q, filters, trigram=product_search.trigram_ready)
+    return {"total": total, "facets": facets}
 
 
 async def controller_get_trending(db: AsyncSession):
@@ -191,6 +215,10 @@ async def controller_activate_product(product_id: int, active: bool, db: AsyncSe
     return success
 
 
+async def controller_catalog_cache_stats():
+    return catalog_cache.stats()
+
+
 async def controller_list_orders(db: AsyncSession):
     return await list_all_orders(db)
 
@@ -1,3 +1,4 @@
+from collections import namedtuple
 from typing import List, Optional
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -5,42 +6,121 @@ from sqlalchemy.orm import selectinload
 from .yshop_models import YShopProduct, YShopOrder, YShopOrderItem, YShopCartItem
 from models import User as CoreUser
 from fastapi import UploadFile
-from sqlalchemy import func
+from sqlalchemy import func, literal, literal_column
 # no core user import needed
 import csv
 from io import StringIO
 from .yshop_models import YShopCustomer
 from controller import get_password_hash, verify_password, create_access_token
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import array
+from .yshop_search import product_search, SEARCH_DOCUMENT_SQL
+from .yshop_facets import FACETS, PRICE_BUCKETS, PRICE_LABELS
+from .yshop_catalog_cache import ProductSnapshot, catalog_cache, bump_catalog_version
+
+# A cart row with its product snapshot from the catalog cache
+CartLine = namedtuple("CartLine", ["id", "product_id", "quantity", "product"])
 
 # Product DB actions
 
 
-async def search_products(db: AsyncSession, name: Optional[str], category: Optional[str], brand: Optional[str]) -> List[YShopProduct]:
+def _facet_condition(facet, wanted):
+    if facet in ("category", "brand"):
+        return getattr(YShopProduct, facet).ilike(f"%{wanted}%")
+    if facet == "price":
+        return _price_bucket() == (PRICE_LABELS.index(wanted) if wanted in PRICE_LABELS else -1)
+    return _in_stock() == wanted
+
+
+def _price_bucket():
+    # width_bucket numbers buckets like bisect_right, so codes match price_bucket(); a NULL price is 0 there too
+    return func.width_bucket(func.coalesce(YShopProduct.price, 0), array([float(bound) for bound in PRICE_BUCKETS]))
+
+
+def _in_stock():
+    return func.coalesce(YShopProduct.stock, 0) > 0
+
+
+async def search_products(db: AsyncSession, name: Optional[str], filters: Optional[dict] = None,
+                          limit: Optional[int] = None, offset: int = 0) -> List[YShopProduct]:
     query = select(YShopProduct)
     if name:
         query = query.where(YShopProduct.name.ilike(f"%{name}%"))
-    if category:
-        query = query.where(YShopProduct.category.ilike(f"%{category}%"))
-    if brand:
-        query = query.where(YShopProduct.brand.ilike(f"%{brand}%"))
+    for facet, wanted in (filters or {}).items():
+        if wanted not in (None, ""):
+            query = query.where(_facet_condition(facet, wanted))
+    if limit is not None:
+        query = query.order_by(YShopProduct.id).offset(offset).limit(limit)
     result = await db.execute(query)
     return result.scalars().all()
 
 
-async def get_trending_products(db: AsyncSession) -> List[YShopProduct]:
+def _trigram_match(text):
+    return literal(text.lower()).op("<%")(literal_column(SEARCH_DOCUMENT_SQL))
+
+
+async def search_products_trgm(db: AsyncSession, text: str, filters: Optional[dict],
+                               limit: int, offset: int = 0) -> List[YShopProduct]:
+    """Trigram word-similarity search, served by the ix_yshop_products_search_trgm GIN index."""
+    query = select(YShopProduct).where(YShopProduct.is_active.isnot(False), _trigram_match(text))
+    for facet, wanted in (filters or {}).items():
+        if wanted not in (None, ""):
+            query = query.where(_facet_condition(facet, wanted))
+    similarity = func.word_similarity(text.lower(), literal_column(SEARCH_DOCUMENT_SQL))
+    query = query.order_by(similarity.desc(), YShopProduct.id)
+    result = await db.execute(query.offset(offset).limit(limit))
+    return result.scalars().all()
+
+
+async def get_product_facets(db: AsyncSession, text: Optional[str], filters: Optional[dict],
+                             trigram: bool = False) -> tuple:
+    """SQL version of ProductSearch.facets for when the in-memory index is not loaded."""
+    filters = {facet: wanted for facet, wanted in (filters or {}).items() if wanted not in (None, "")}
+
+    def conditions(skip=None):
+        found = [YShopProduct.is_active.isnot(False)]
+        if text:
+            found.append(_trigram_match(text) if trigram else YShopProduct.name.ilike(f"%{text}%"))
+        found.extend(_facet_condition(facet, wanted) for facet, wanted in filters.items() if facet != skip)
+        return found
+
+    # NULLs bucket like facet_value() does in the in-memory index
+    columns = {"category": func.coalesce(YShopProduct.category, ""), "brand": func.coalesce(YShopProduct.brand, ""),
+               "price": _price_bucket(), "in_stock": _in_stock()}
+    facets = {}
+    for facet in FACETS:
+        column = columns[facet]
+        result = await db.execute(
+            select(column, func.count()).where(*conditions(facet))
+            .group_by(column).order_by(func.count().desc()))
+        facets[facet] = [{"value": PRICE_LABELS[value] if facet == "price" else value, "count": count}
+                         for value, count in result.all()]
+    total = (await db.execute(select(func.count()).select_from(YShopProduct).where(*conditions()))).scalar_one()
+    return total, facets
+
+
+async def get_products_by_ids(db: AsyncSession, product_ids: List[int]) -> List[ProductSnapshot]:
+    """Products in the order of product_ids, skipping any that no longer exist."""
+    products = await catalog_cache.get_many(db, product_ids)
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+
+async def _load_trending_products(db: AsyncSession) -> List[YShopProduct]:
     result = await db.execute(select(YShopProduct).limit(2))
     return result.scalars().all()
 
 
+async def get_trending_products(db: AsyncSession) -> List[ProductSnapshot]:
+    return await catalog_cache.get_list(db, "trending", _load_trending_products)
+
+
 async def get_recommended_products(db: AsyncSession) -> List[YShopProduct]:
     result = await db.execute(select(YShopProduct).offset(1))
     return result.scalars().all()
 
 
-async def get_product_by_id(db: AsyncSession, product_id: int) -> Optional[YShopProduct]:
-    result = await db.execute(select(YShopProduct).where(YShopProduct.id == product_id))
-    return result.scalar_one_or_none()
+async def get_product_by_id(db: AsyncSession, product_id: int) -> Optional[ProductSnapshot]:
+    return await catalog_cache.get(db, product_id)
 
 # Cart DB actions
 
@@ -70,9 +150,11 @@ async def remove_from_cart(db: AsyncSession, product_id: int):
     return False
 
 
-async def get_cart(db: AsyncSession) -> List[YShopCartItem]:
-    result = await db.execute(select(YShopCartItem).options(selectinload(YShopCartItem.product)))
-    return result.scalars().all()
+async def get_cart(db: AsyncSession) -> List[CartLine]:
+    result = await db.execute(select(YShopCartItem))
+    items = result.scalars().all()
+    products = await catalog_cache.get_many(db, [item.product_id for item in items])
+    return [CartLine(item.id, item.product_id, item.quantity, products.get(item.product_id)) for item in items]
 
 # Order DB actions
 
@@ -105,19 +187,26 @@ async def get_order_status(db: AsyncSession, order_id: int) -> Optional[str]:
 # Admin DB actions
 
 
-async def list_all_products(db: AsyncSession) -> List[YShopProduct]:
+async def _load_active_products(db: AsyncSession) -> List[YShopProduct]:
     result = await db.execute(select(YShopProduct).where(YShopProduct.is_active == True))
     return result.scalars().all()
 
 
+async def list_all_products(db: AsyncSession) -> List[ProductSnapshot]:
+    return await catalog_cache.get_list(db, "active", _load_active_products)
+
+
 async def update_product(db: AsyncSession, product_id: int, data):
     product = await db.get(YShopProduct, product_id)
     if not product:
         return None
     for field, value in data.dict(exclude_unset=True).items():
         setattr(product, field, value)
+    version = await bump_catalog_version(db)
     await db.commit()
     await db.refresh(product)
+    catalog_cache.invalidate([product_id], version)
+    product_search.upsert(product)
     return product
 
 
@@ -126,14 +215,17 @@ async def delete_product(db: AsyncSession, product_id: int) -> bool:
     if not product:
         return False
     await db.delete(product)
+    version = await bump_catalog_version(db)
     await db.commit()
+    catalog_cache.invalidate([product_id], version)
+    product_search.remove(product_id)
     return True
 
 
 async def import_products_csv(db: AsyncSession, file: UploadFile) -> int:
     content = await file.read()
     reader = csv.DictReader(StringIO(content.decode()))
-    count = 0
+    products = []
     for row in reader:
         product = YShopProduct(
             name=row.get('name'), category=row.get('category'), brand=row.get('brand'),
@@ -141,9 +233,13 @@ async def import_products_csv(db: AsyncSession, file: UploadFile) -> int:
             stock=int(row.get('stock', 0)), is_active=row.get('is_active', 'True') == 'True'
         )
         db.add(product)
-        count += 1
+        products.append(product)
+    version = await bump_catalog_version(db)
     await db.commit()
-    return count
+    catalog_cache.invalidate([], version)
+    for product in products:
+        product_search.upsert(product)
+    return len(products)
 
 
 async def export_products_csv(db: AsyncSession) -> str:
@@ -176,7 +272,10 @@ async def activate_product(db: AsyncSession, product_id: int, active: bool) -> b
     if not product:
         return False
     product.is_active = active
+    version = await bump_catalog_version(db)
     await db.commit()
+    catalog_cache.invalidate([product_id], version)
+    product_search.upsert(product)
     return True
 
 
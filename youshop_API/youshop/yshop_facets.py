@@ -0,0 +1,192 @@
+import bisect
+import numpy as np
+
+FACETS = ("category", "brand", "price", "in_stock")
+# Upper bounds of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = (25, 50, 100, 250, 500, 1000)
+PRICE_LABELS = [f"{low}-{high}" for low, high in zip((0,) + PRICE_BUCKETS, PRICE_BUCKETS)] + [f"{PRICE_BUCKETS[-1]}+"]
+# Chunks with more members than this are stored as bitsets (8 KB) rather than uint16 arrays
+ARRAY_LIMIT = 4096
+_CHUNK_WORDS = 1 << 10
+
+
+def price_bucket(price):
+    return bisect.bisect_right(PRICE_BUCKETS, price or 0)
+
+
+def facet_value(facet, product):
+    """The facet's value label for a product."""
+    if facet == "price":
+        return PRICE_LABELS[price_bucket(product.price)]
+    if facet == "in_stock":
+        return bool(product.stock and product.stock > 0)
+    return getattr(product, facet) or ""
+
+
+def value_matches(facet, wanted, value):
+    # Category and brand keep the substring match of the SQL search; price buckets and stock are exact
+    if facet in ("category", "brand"):
+        return wanted.lower() in value.lower()
+    return wanted == value
+
+
+def _to_bits(low):
+    bits = np.zeros(_CHUNK_WORDS * 64, dtype=bool)
+    bits[low] = True
+    return np.packbits(bits, bitorder="little").view(np.uint64)
+
+
+def _to_low(words):
+    bits = np.unpackbits(words.view(np.uint8), bitorder="little").view(bool)
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _cardinality(container):
+    if container.dtype == np.uint16:
+        return len(container)
+    return int(np.bitwise_count(container).sum())
+
+
+def _compact(container):
+    if container.dtype == np.uint64 and _cardinality(container) <= ARRAY_LIMIT:
+        return _to_low(container)
+    if container.dtype == np.uint16 and len(container) > ARRAY_LIMIT:
+        return _to_bits(container)
+    return container
+
+
+def _and(a, b):
+    if a.dtype == np.uint16 and b.dtype == np.uint16:
+        return np.intersect1d(a, b, assume_unique=True)
+    if a.dtype == np.uint64 and b.dtype == np.uint64:
+        return _compact(a & b)
+    low, words = (a, b) if a.dtype == np.uint16 else (b, a)
+    return low[(words[low >> 6] >> (low & 63).astype(np.uint64)) & np.uint64(1) == 1]
+
+
+def _or(containers):
+    arrays = [c for c in containers if c.dtype == np.uint16]
+    words = [c for c in containers if c.dtype == np.uint64]
+    if not words and sum(map(len, arrays)) <= ARRAY_LIMIT:
+        return np.unique(np.concatenate(arrays))
+    result = _to_bits(np.concatenate(arrays)) if arrays else np.zeros(_CHUNK_WORDS, dtype=np.uint64)
+    for container in words:
+        result |= container
+    return _compact(result)
+
+
+class Bitmap:
+    """Roaring-style compressed set of doc numbers.
+
+    Doc numbers are split into 65536-wide chunks by their high 16 bits. A
+    sparse chunk is a sorted uint16 array of the low bits and a dense one a
+    1024-word bitset, so sets stay small and intersecting two of them only
+    touches the chunks both have.
+    """
+
+    __slots__ = ("keys", "containers")
+
+    def __init__(self, keys=None, containers=None):
+        self.keys = keys or []
+        self.containers = containers or []
+
+    @classmethod
+    def from_sorted(cls, docs):
+        docs = np.asarray(docs, dtype=np.int64)
+        if not len(docs):
+            return cls()
+        high = docs >> 16
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(high)) + 1))
+        keys = high[starts].tolist()
+        containers = [_compact((chunk & 0xFFFF).astype(np.uint16)) for chunk in np.split(docs, starts[1:])]
+        return cls(keys, containers)
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self.containers)
+
+    def __and__(self, other):
+        keys, containers = [], []
+        i = j = 0
+        while i < len(self.keys) and j < len(other.keys):
+            if self.keys[i] < other.keys[j]:
+                i += 1
+            elif self.keys[i] > other.keys[j]:
+                j += 1
+            else:
+                container = _and(self.containers[i], other.containers[j])
+                if len(container) and _cardinality(container):
+                    keys.append(self.keys[i])
+                    containers.append(container)
+                i += 1
+                j += 1
+        return Bitmap(keys, containers)
+
+    def __or__(self, other):
+        return Bitmap.union([self, other])
+
+    @staticmethod
+    def union(bitmaps):
+        """Union of any number of bitmaps, merging each chunk once."""
+        by_key = {}
+        for bitmap in bitmaps:
+            for key, container in zip(bitmap.keys, bitmap.containers):
+                by_key.setdefault(key, []).append(container)
+        keys = sorted(by_key)
+        return Bitmap(keys, [by_key[key][0] if len(by_key[key]) == 1 else _or(by_key[key]) for key in keys])
+
+    @staticmethod
+    def intersection(bitmaps):
+        bitmaps = sorted(bitmaps, key=lambda bitmap: len(bitmap.keys))
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap
+        return result
+
+    def to_array(self):
+        """Sorted doc numbers."""
+        parts = [(np.int64(key) << 16) | (c if c.dtype == np.uint16 else _to_low(c)).astype(np.int64)
+                 for key, c in zip(self.keys, self.containers)]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+class FacetIndex:
+    """A Bitmap of docs per facet value, plus each doc's value code for counting.
+
+    Filters are unions of value bitmaps intersected with each other and with
+    the text matches. Counting a selection is a bincount of the value codes
+    of its docs, which is one pass for facets with hundreds of values where
+    per-value intersections would be one pass each.
+    """
+
+    def __init__(self, values, codes):
+        # values: facet -> value labels; codes: facet -> value code of every doc
+        self.values = values
+        self.codes = codes
+        self._labels = {facet: {str(value).lower(): value for value in facet_values}
+                        for facet, facet_values in values.items()}
+        self.bitmaps = {}
+        self.totals = {}
+        for facet, doc_codes in codes.items():
+            self.totals[facet] = np.bincount(doc_codes, minlength=len(values[facet]))
+            order = np.argsort(doc_codes, kind="stable")
+            bounds = np.cumsum(self.totals[facet])[:-1]
+            self.bitmaps[facet] = [Bitmap.from_sorted(docs) for docs in np.split(order, bounds)]
+
+    def codes_for(self, facet, wanted):
+        return [code for code, value in enumerate(self.values[facet]) if value_matches(facet, wanted, value)]
+
+    def label(self, facet, value):
+        """The indexed label of a value, which may differ in case."""
+        return self._labels[facet].get(str(value).lower(), value)
+
+    def select(self, facet, wanted):
+        return Bitmap.union(self.bitmaps[facet][code] for code in self.codes_for(facet, wanted))
+
+    def counts(self, docs, facet, dead=None):
+        """{value: count} over the given docs (or all docs but the dead ones), most common first."""
+        if docs is None:
+            counts = self.totals[facet] - np.bincount(self.codes[facet][dead], minlength=len(self.values[facet]))
+        else:
+            counts = np.bincount(self.codes[facet][docs], minlength=len(self.values[facet]))
+        order = np.argsort(-counts, kind="stable")
+        return {self.values[facet][code]: int(counts[code]) for code in order if counts[code]}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Float, ForeignKey, DateTime, Boolean
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from models import Base
@@ -14,6 +14,16 @@ class YShopProduct(Base):
     description = Column(String(255))
     stock = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)  # soft-delete/activation flag
+    # Lets the search index of every worker pick up changes made elsewhere
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+
+class YShopCatalogVersion(Base):
+    # Single row, bumped by every admin product change
+    __tablename__ = "yshop_catalog_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 
 class YShopOrder(Base):
@@ -1,11 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
-from .yshop_schemas import ProductSearchResponse, CartResponse, OrderRequest, OrderResponse, OrderStatusResponse, MessageResponse
+from .yshop_schemas import ProductSearchResponse, ProductFacetsResponse, CartResponse, OrderRequest, OrderResponse, OrderStatusResponse, MessageResponse
 from .yshop_controller import (
     get_current_shop_customer,
     controller_search_products,
+    controller_product_facets,
     controller_get_trending,
     controller_get_recommended,
     controller_get_product_details,
@@ -29,12 +30,29 @@ async def api_search_products(
     name: Optional[str] = None,
     category: Optional[str] = None,
     brand: Optional[str] = None,
+    q: Optional[str] = None,
+    price: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
     db: AsyncSession = Depends(get_db)
 ):
-    results = await controller_search_products(name, category, brand, db)
+    results = await controller_search_products(name, category, brand, db, q, limit, offset, price, in_stock)
     return {"results": results}
 
 
+@router.get("/products/facets", response_model=ProductFacetsResponse)
+async def api_product_facets(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    price: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    return await controller_product_facets(q, category, brand, price, in_stock, db)
+
+
 @router.get("/products/trending", response_model=ProductSearchResponse)
 async def api_trending_products(db: AsyncSession = Depends(get_db)):
     results = await controller_get_trending(db)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from pydantic import BaseModel
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 
 
 class Product(BaseModel):
@@ -18,6 +18,16 @@ class ProductSearchResponse(BaseModel):
     results: List[Product]
 
 
+class FacetCount(BaseModel):
+    value: Union[bool, str]
+    count: int
+
+
+class ProductFacetsResponse(BaseModel):
+    total: int
+    facets: Dict[str, List[FacetCount]]
+
+
 class CartItem(BaseModel):
     product_id: int
     quantity: int = 1
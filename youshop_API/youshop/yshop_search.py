@@ -0,0 +1,561 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import math
+import os
+import re
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, func
+from db import SessionLocal
+from query_suggest import edit_distance, trigrams
+from .yshop_models import YShopProduct
+from .yshop_facets import FACETS, PRICE_LABELS, Bitmap, FacetIndex, facet_value, price_bucket, value_matches
+
+logger = logging.getLogger(__name__)
+
+# "memory" for the in-process index below, "pg_trgm" for trigram GIN indexes in PostgreSQL
+SEARCH_BACKEND = os.getenv("YSHOP_SEARCH_BACKEND", "memory")
+# Text the pg_trgm backend matches against; must stay identical to the expression of its GIN index
+SEARCH_DOCUMENT_SQL = "lower(name || ' ' || brand || ' ' || category || ' ' || coalesce(description, ''))"
+FIELD_WEIGHTS = {"name": 3.0, "brand": 2.0, "category": 2.0, "description": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_WEIGHT = 0.9
+# Score factor for a match one and two edits away
+FUZZY_WEIGHTS = (1.0, 0.7, 0.5)
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+# Most frequent completions of the word being typed that are searched
+MAX_PREFIX_EXPANSIONS = 8
+MAX_FUZZY_EXPANSIONS = 5
+CHAMPION_SIZE = 1000
+# Match bitmaps of recently queried terms kept for facet counts
+TERM_BITMAP_CACHE_SIZE = 512
+SYNC_INTERVAL_SECONDS = 5
+# updated_at is stamped by the writing worker's clock before its commit; rows committed up to this
+# long after being stamped (long imports, slow admin updates, clock skew) are still picked up
+SYNC_OVERLAP_SECONDS = 300
+# Fold the delta into a fresh main segment once this many products changed
+REBUILD_AFTER_CHANGES = 50000
+LOAD_BATCH_SIZE = 20000
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _WORD.findall((text or "").lower())
+
+
+def _document(name, brand, category, description):
+    counts = Counter()
+    for field, value in (("name", name), ("brand", brand), ("category", category), ("description", description)):
+        for term in tokenize(value):
+            counts[term] += FIELD_WEIGHTS[field]
+    return counts
+
+
+def _idf(df, total):
+    return math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+
+class Segment:
+    """Immutable postings for a snapshot of the catalog, in flat NumPy arrays.
+
+    Postings of term i are docs[offsets[i]:offsets[i + 1]] (sorted doc
+    numbers) with the BM25 term-frequency part of their score, which only
+    depends on the document, precomputed in impacts. Terms in more than
+    CHAMPION_SIZE products also keep their CHAMPION_SIZE highest-impact
+    docs, so a query on common words only scores a few thousand candidates.
+    Doc numbers index product_ids, alive and the FacetIndex.
+    """
+
+    def __init__(self, rows):
+        # rows: (id, name, brand, category, description, price, stock), sorted by id
+        postings_docs, postings_tfs = defaultdict(list), defaultdict(list)
+        # Category and brand values differing only in case are one facet value, labelled as first seen
+        labels = {"category": {}, "brand": {}}
+        codes = {facet: [] for facet in FACETS}
+        lengths = []
+        for doc, (_, name, brand, category, description, price, stock) in enumerate(rows):
+            counts = _document(name, brand, category, description)
+            for term, tf in counts.items():
+                postings_docs[term].append(doc)
+                postings_tfs[term].append(tf)
+            lengths.append(sum(counts.values()))
+            for facet, value in (("category", category or ""), ("brand", brand or "")):
+                seen = labels[facet]
+                codes[facet].append(seen.setdefault(value.lower(), (len(seen), value))[0])
+            codes["price"].append(price_bucket(price))
+            codes["in_stock"].append(int(bool(stock and stock > 0)))
+        self.vocabulary = sorted(postings_docs)
+        self.term_index = {term: i for i, term in enumerate(self.vocabulary)}
+        sizes = np.fromiter((len(postings_docs[t]) for t in self.vocabulary), dtype=np.int64,
+                            count=len(self.vocabulary))
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        total = int(self.offsets[-1])
+        self.docs = np.fromiter(itertools.chain.from_iterable(postings_docs[t] for t in self.vocabulary),
+                                dtype=np.int32, count=total)
+        tfs = np.fromiter(itertools.chain.from_iterable(postings_tfs[t] for t in self.vocabulary),
+                          dtype=np.float32, count=total)
+        del postings_docs, postings_tfs
+        lengths = np.array(lengths, dtype=np.float32)
+        self.avgdl = float(lengths.mean()) if len(rows) else 1.0
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self.avgdl)
+        self.impacts = tfs * (BM25_K1 + 1) / (tfs + norms[self.docs])
+        self.champions = {}
+        for i in np.nonzero(sizes > CHAMPION_SIZE)[0]:
+            start, end = self.offsets[i], self.offsets[i + 1]
+            best = np.argpartition(-self.impacts[start:end], CHAMPION_SIZE)[:CHAMPION_SIZE]
+            self.champions[int(i)] = np.sort(self.docs[start:end][best])
+        self.product_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.alive_count = len(rows)
+        values = {facet: [label for _, label in seen.values()] for facet, seen in labels.items()}
+        values.update(price=PRICE_LABELS, in_stock=[False, True])
+        self.facets = FacetIndex(values, {facet: np.array(c, dtype=np.int32) for facet, c in codes.items()})
+        self._term_bitmaps = OrderedDict()
+        by_trigram = defaultdict(list)
+        for i, term in enumerate(self.vocabulary):
+            if len(term) >= MIN_FUZZY_LENGTH - 2:
+                for gram in trigrams(term):
+                    by_trigram[gram].append(i)
+        self.by_trigram = {gram: np.array(ids, dtype=np.int32) for gram, ids in by_trigram.items()}
+        self.term_lengths = np.fromiter((len(t) for t in self.vocabulary), dtype=np.int32,
+                                        count=len(self.vocabulary))
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def doc_for(self, product_id):
+        i = int(np.searchsorted(self.product_ids, product_id))
+        if i < len(self.product_ids) and self.product_ids[i] == product_id:
+            return i
+        return None
+
+    def kill(self, doc):
+        if not self.alive[doc]:
+            return False
+        self.alive[doc] = False
+        self.alive_count -= 1
+        return True
+
+    def df(self, term):
+        i = self.term_index.get(term)
+        return 0 if i is None else int(self.offsets[i + 1] - self.offsets[i])
+
+    def postings(self, term):
+        """(docs, impacts) of the term, or None."""
+        i = self.term_index.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.impacts[start:end]
+
+    def top_docs(self, term):
+        """The term's champion docs, or all its docs when it has few."""
+        i = self.term_index.get(term)
+        if i is None:
+            return None
+        if i in self.champions:
+            return self.champions[i]
+        return self.docs[self.offsets[i]:self.offsets[i + 1]]
+
+    def prefixed(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff")
+        return self.vocabulary[start:end]
+
+    def fuzzy(self, term, limit):
+        grams = [self.by_trigram[g] for g in trigrams(term) if g in self.by_trigram]
+        if not grams:
+            return []
+        shared = np.bincount(np.concatenate(grams), minlength=len(self.vocabulary))
+        # Each edit changes at most three trigrams
+        needed = max(1, len(trigrams(term)) - 3 * limit)
+        candidates = np.nonzero((shared >= needed) & (np.abs(self.term_lengths - len(term)) <= limit))[0]
+        return [self.vocabulary[i] for i in candidates]
+
+    def term_bitmap(self, term):
+        bitmap = self._term_bitmaps.get(term)
+        if bitmap is None:
+            postings = self.postings(term)
+            bitmap = Bitmap.from_sorted(postings[0]) if postings is not None else Bitmap()
+            self._term_bitmaps[term] = bitmap
+            if len(self._term_bitmaps) > TERM_BITMAP_CACHE_SIZE:
+                self._term_bitmaps.popitem(last=False)
+        else:
+            self._term_bitmaps.move_to_end(term)
+        return bitmap
+
+    def accepts(self, docs, filters):
+        """Which of docs are alive and match every {facet: value} filter."""
+        keep = self.alive[docs]
+        for facet, wanted in filters.items():
+            keep &= np.isin(self.facets.codes[facet][docs], self.facets.codes_for(facet, wanted))
+        return keep
+
+
+class ProductSearch:
+    """BM25 product search over name, brand, category and description.
+
+    The catalog lives in an immutable main Segment plus a small delta of
+    products created, changed or deactivated since it was built; changed
+    products are tombstoned in the main segment. Every query word must
+    match (exactly, as a prefix for the last word, or within one or two
+    edits), falling back to ranking by the number of words matched.
+    """
+
+    def __init__(self):
+        self.segment = Segment([])
+        self.ready = False
+        # Set at startup once the pg_trgm index exists
+        self.trigram_ready = False
+        # product_id -> (term counts, length, facet values) for products changed since the build
+        self._delta = {}
+        self._delta_postings = defaultdict(set)
+        self._changes = 0
+        self._watermark = None
+        # product_id -> updated_at already applied, for rows inside the overlap window
+        self._applied = {}
+        self._rebuilding = False
+        self._task = None
+
+    def __len__(self):
+        return self.segment.alive_count + len(self._delta)
+
+    # --- Incremental updates ---
+
+    def _drop(self, product_id):
+        """Unindex a product; returns whether it was indexed."""
+        doc = self.segment.doc_for(product_id)
+        dropped = doc is not None and self.segment.kill(doc)
+        old = self._delta.pop(product_id, None)
+        if old is not None:
+            dropped = True
+            for term in old[0]:
+                postings = self._delta_postings.get(term)
+                if postings is not None:
+                    postings.discard(product_id)
+                    if not postings:
+                        del self._delta_postings[term]
+        return dropped
+
+    def upsert(self, product):
+        """Index a created or edited product; inactive products are removed."""
+        dropped = self._drop(product.id)
+        if product.is_active is not False:
+            counts = _document(product.name, product.brand, product.category, product.description)
+            self._delta[product.id] = (counts, sum(counts.values()),
+                                       {facet: facet_value(facet, product) for facet in FACETS})
+            for term in counts:
+                self._delta_postings[term].add(product.id)
+        elif not dropped:
+            return
+        self._changed()
+
+    def remove(self, product_id):
+        if self._drop(product_id):
+            self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= REBUILD_AFTER_CHANGES and not self._rebuilding and self._task is not None:
+            asyncio.get_running_loop().create_task(self.rebuild())
+
+    # --- Querying ---
+
+    def _expand(self, term, prefix):
+        """(vocabulary term, score factor) pairs a query word stands for."""
+        segment = self.segment
+        exact = term in segment.term_index or term in self._delta_postings
+        expansions = {term: 1.0} if exact else {}
+        if prefix and len(term) >= MIN_PREFIX_LENGTH:
+            words = segment.prefixed(term) + [w for w in self._delta_postings if w.startswith(term)]
+            words = sorted(set(words) - {term}, key=lambda w: -segment.df(w))[:MAX_PREFIX_EXPANSIONS]
+            expansions.update((w, PREFIX_WEIGHT) for w in words)
+        if not exact and len(term) >= MIN_FUZZY_LENGTH:
+            limit = 1 if len(term) < 8 else 2
+            scored = []
+            for word in set(segment.fuzzy(term, limit)) | {w for w in self._delta_postings
+                                                            if abs(len(w) - len(term)) <= limit}:
+                distance = edit_distance(term, word, limit)
+                if 0 < distance <= limit:
+                    scored.append((distance, -segment.df(word), word))
+            for distance, _, word in sorted(scored)[:MAX_FUZZY_EXPANSIONS]:
+                expansions.setdefault(word, FUZZY_WEIGHTS[distance])
+        return expansions
+
+    def _score(self, positions, candidates, idfs):
+        """Words matched and BM25 score of each candidate doc in the main segment."""
+        segment = self.segment
+        matched_count = np.zeros(len(candidates), dtype=np.int32)
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        for expansions in positions:
+            best = np.zeros(len(candidates), dtype=np.float32)
+            for term, factor in expansions.items():
+                postings = segment.postings(term)
+                if postings is None or not len(candidates):
+                    continue
+                docs, impacts = postings
+                index = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                hit = docs[index] == candidates
+                best[hit] = np.maximum(best[hit], factor * idfs[term] * impacts[index[hit]])
+            matched_count += best > 0
+            scores += best
+        return matched_count, scores
+
+    def _candidates(self, parts, filters):
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        candidates = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+        return candidates[self.segment.accepts(candidates, filters)]
+
+    def _positions(self, text, words):
+        # The last word is still being typed unless the text ends in a space
+        typing = text[-1:].isalnum()
+        return [self._expand(w, typing and i == len(words) - 1) for i, w in enumerate(words)]
+
+    def _delta_matched(self, product_id, positions):
+        counts = self._delta[product_id][0]
+        return sum(1 for expansions in positions if any(t in counts for t in expansions))
+
+    def _delta_ids(self, filters, skip=None):
+        return [pid for pid, (_, _, values) in self._delta.items()
+                if all(value_matches(f, wanted, values[f]) for f, wanted in filters.items() if f != skip)]
+
+    def _delta_score(self, product_id, expansions, idfs, avgdl):
+        counts, length = self._delta[product_id][:2]
+        best = 0.0
+        for term, factor in expansions.items():
+            tf = counts.get(term)
+            if tf:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                best = max(best, factor * idfs[term] * tf * (BM25_K1 + 1) / (tf + norm))
+        return best
+
+    def search(self, text=None, filters=None, limit=50, offset=0):
+        """Product ids for the query, best first; without text, filtered products by id.
+
+        filters maps facets to the value wanted: a substring of the category
+        or brand, a price bucket label or an in_stock boolean.
+        """
+        segment = self.segment
+        filters = {facet: wanted for facet, wanted in (filters or {}).items() if wanted not in (None, "")}
+        delta_ids = self._delta_ids(filters)
+        words = tokenize(text)
+        wanted = offset + limit
+        if not words:
+            docs = np.arange(len(segment), dtype=np.int32)
+            docs = docs[segment.accepts(docs, filters)][:wanted]
+            ids = np.concatenate([segment.product_ids[docs], np.array(sorted(delta_ids)[:wanted], dtype=np.int64)])
+            return [int(i) for i in np.sort(ids)[offset:wanted]]
+        positions = self._positions(text, words)
+        total = max(len(self), 1)
+        idfs = {}
+        for expansions in positions:
+            for term in expansions:
+                idfs[term] = _idf(segment.df(term) + len(self._delta_postings.get(term, ())), total)
+        # Candidates are the best docs of every word; rare words contribute all their docs
+        parts = [docs for expansions in positions for docs in map(segment.top_docs, expansions) if docs is not None]
+        truncated = any(segment.term_index.get(t) in segment.champions for e in positions for t in e)
+        candidates = self._candidates(parts, filters)
+        matched_count, scores = self._score(positions, candidates, idfs)
+        if truncated and np.count_nonzero(matched_count == len(positions)) < wanted:
+            # Too few full matches among the champions (e.g. a narrow filter): score every full match
+            full = self._match_bitmap(positions, filters)
+            if len(full):
+                candidates = self._candidates([full.to_array()], filters)
+                matched_count, scores = self._score(positions, candidates, idfs)
+        # Only products matching every word, unless there are none
+        require = len(positions) if (matched_count == len(positions)).any() else 1
+        if any(self._delta_matched(pid, positions) == len(positions) for pid in delta_ids):
+            require = len(positions)
+        keep = matched_count >= require
+        candidates, matched_count, scores = candidates[keep], matched_count[keep], scores[keep]
+        # Words matched dominate, then BM25
+        keys = matched_count.astype(np.float64) * 1e6 + scores
+        if len(keys) > wanted:
+            top = np.argpartition(-keys, wanted - 1)[:wanted]
+        else:
+            top = np.arange(len(keys))
+        ranked = [(float(keys[i]), int(segment.product_ids[candidates[i]])) for i in top]
+        for pid in delta_ids:
+            count = self._delta_matched(pid, positions)
+            if count >= require:
+                score = sum(self._delta_score(pid, expansions, idfs, segment.avgdl) for expansions in positions)
+                ranked.append((count * 1e6 + score, pid))
+        ranked.sort(key=lambda pair: (-pair[0], pair[1]))
+        return [pid for _, pid in ranked[offset:wanted]]
+
+    def _word_bitmaps(self, positions):
+        segment = self.segment
+        return [Bitmap.union([segment.term_bitmap(t) for t in expansions if t in segment.term_index])
+                for expansions in positions]
+
+    def _match_bitmap(self, positions, filters):
+        """Main segment docs matching every word and filter."""
+        index = self.segment.facets
+        selections = [index.select(facet, wanted) for facet, wanted in filters.items()]
+        return Bitmap.intersection(self._word_bitmaps(positions) + selections)
+
+    def facets(self, text=None, filters=None):
+        """(matching products, {facet: [{"value", "count"}]}) for the query and filters.
+
+        Each facet is counted with every filter but its own applied, so its
+        counts say what picking another value of it would return. Text
+        matches follow search(): every word, or any word if nothing matches
+        them all.
+        """
+        segment = self.segment
+        index = segment.facets
+        filters = {facet: wanted for facet, wanted in (filters or {}).items() if wanted not in (None, "")}
+        matched = None
+        delta_ids = list(self._delta)
+        words = tokenize(text)
+        if words:
+            positions = self._positions(text, words)
+            by_word = self._word_bitmaps(positions)
+            matched = Bitmap.intersection(by_word)
+            delta_matched = {pid: self._delta_matched(pid, positions) for pid in delta_ids}
+            require = len(positions)
+            if not len(matched) and require not in delta_matched.values():
+                matched, require = Bitmap.union(by_word), 1
+            delta_ids = [pid for pid, count in delta_matched.items() if count >= require]
+        selections = {facet: index.select(facet, wanted) for facet, wanted in filters.items()}
+
+        def selected(skip=None):
+            """Alive docs of the selection, or None for all of them."""
+            bitmaps = [bitmap for facet, bitmap in selections.items() if facet != skip]
+            if matched is not None:
+                bitmaps.append(matched)
+            if not bitmaps:
+                return None
+            docs = Bitmap.intersection(bitmaps).to_array()
+            return docs[segment.alive[docs]]
+
+        dead = np.flatnonzero(~segment.alive)
+        everything = selected()
+        wanted_delta = set(delta_ids)
+        facets = {}
+        for facet in FACETS:
+            # Only a filtered facet's own counts differ from the overall selection
+            counts = index.counts(selected(facet) if facet in filters else everything, facet, dead)
+            for pid in self._delta_ids(filters, skip=facet):
+                if pid in wanted_delta:
+                    value = index.label(facet, self._delta[pid][2][facet])
+                    counts[value] = counts.get(value, 0) + 1
+            facets[facet] = [{"value": value, "count": count}
+                             for value, count in sorted(counts.items(), key=lambda pair: -pair[1])]
+        total = segment.alive_count if everything is None else len(everything)
+        total += len(wanted_delta.intersection(self._delta_ids(filters)))
+        return total, facets
+
+    # --- Loading and synchronisation ---
+
+    async def _load_rows(self):
+        columns = (YShopProduct.id, YShopProduct.name, YShopProduct.brand, YShopProduct.category,
+                   YShopProduct.description, YShopProduct.price, YShopProduct.stock)
+        rows = []
+        async with SessionLocal() as db:
+            result = await db.stream(
+                select(*columns).where(YShopProduct.is_active.isnot(False)).order_by(YShopProduct.id)
+                .execution_options(yield_per=LOAD_BATCH_SIZE))
+            async for partition in result.partitions():
+                rows.extend(tuple(row) for row in partition)
+        return rows
+
+    async def rebuild(self):
+        """Build a fresh main segment from the database and swap it in."""
+        self._rebuilding = True
+        try:
+            started = datetime.utcnow()
+            # Read before the snapshot, so the snapshot holds these versions or newer ones
+            async with SessionLocal() as db:
+                window = dict((await db.execute(
+                    select(YShopProduct.id, YShopProduct.updated_at).where(
+                        YShopProduct.updated_at >= started - timedelta(seconds=SYNC_OVERLAP_SECONDS)))).all())
+            rows = await self._load_rows()
+            segment = await asyncio.to_thread(Segment, rows)
+            self.segment = segment
+            self._delta = {}
+            self._delta_postings = defaultdict(set)
+            self._changes = 0
+            # The first sync re-reads the overlap window and applies what changed while the snapshot was loading
+            self._watermark = started
+            self._applied = window
+            self.ready = True
+            await self.sync()
+            logger.info("Product search index built for %d products", len(segment))
+        finally:
+            self._rebuilding = False
+
+    async def sync(self):
+        """Apply product changes made by other workers since the last sync; returns how many were applied."""
+        applied = 0
+        async with SessionLocal() as db:
+            query = select(YShopProduct.id, YShopProduct.updated_at)
+            if self._watermark is not None:
+                query = query.where(
+                    YShopProduct.updated_at >= self._watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS))
+            rows = (await db.execute(query)).all()
+            # Rows of the window already applied at the same updated_at are skipped
+            fresh = [product_id for product_id, updated_at in rows
+                     if updated_at is None or self._applied.get(product_id) != updated_at]
+            for start in range(0, len(fresh), LOAD_BATCH_SIZE):
+                result = await db.execute(
+                    select(YShopProduct).where(YShopProduct.id.in_(fresh[start:start + LOAD_BATCH_SIZE])))
+                for product in result.scalars().all():
+                    self.upsert(product)
+                    applied += 1
+                    if product.updated_at is not None:
+                        self._applied[product.id] = product.updated_at
+            newest = max((updated_at for _, updated_at in rows if updated_at is not None), default=None)
+            if newest is not None and (self._watermark is None or newest > self._watermark):
+                self._watermark = newest
+            if self._watermark is not None:
+                since = self._watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+                self._applied = {product_id: updated_at for product_id, updated_at in self._applied.items()
+                                 if updated_at >= since}
+            # Hard deletes leave no updated_at behind; a count mismatch finds them
+            active = (await db.execute(
+                select(func.count()).select_from(YShopProduct).where(YShopProduct.is_active.isnot(False))
+            )).scalar_one()
+            if active != len(self):
+                ids = set((await db.execute(
+                    select(YShopProduct.id).where(YShopProduct.is_active.isnot(False)))).scalars().all())
+                indexed = set(self.segment.product_ids[self.segment.alive].tolist()) | set(self._delta)
+                for product_id in indexed - ids:
+                    self.remove(product_id)
+                    applied += 1
+        return applied
+
+    async def run(self):
+        while True:
+            try:
+                if not self.ready:
+                    await self.rebuild()
+                else:
+                    await self.sync()
+            except Exception:
+                logger.exception("Product search index sync failed")
+            await asyncio.sleep(SYNC_INTERVAL_SECONDS)
+
+    def start(self):
+        if SEARCH_BACKEND == "memory":
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+product_search = ProductSearch()